@@ -61,7 +61,12 @@ class ActionReader(ConfigReader):
 				["string", "actionstop", ""],
 				["string", "actioncheck", ""],
 				["string", "actionban", ""],
-				["string", "actionunban", ""]]
+				["string", "actionunban", ""],
+				["string", "actionban_batch", None],
+				["string", "actionunban_batch", None],
+				["int", "actioncheck_ttl", None],
+				["bool", "actionexpires", None],
+				["int", "actionconcurrency", None]]
 		self.__opts = ConfigReader.getOptions(self, "Definition", opts, pOpts)
 		
 		if self.has_section("Init"):
@@ -84,6 +89,20 @@ class ActionReader(ConfigReader):
 				stream.append(head + ["actionban", self.__file, self.__opts[opt]])
 			elif opt == "actionunban":
 				stream.append(head + ["actionunban", self.__file, self.__opts[opt]])
+			elif opt == "actionban_batch":
+				stream.append(head + ["actionbanbatch", self.__file, self.__opts[opt]])
+			elif opt == "actionunban_batch":
+				stream.append(head + ["actionunbanbatch", self.__file, self.__opts[opt]])
+			elif opt == "actioncheck_ttl":
+				stream.append(head + ["actioncheckttl", self.__file, self.__opts[opt]])
+			elif opt == "actionexpires":
+				if self.__opts[opt]:
+					value = "true"
+				else:
+					value = "false"
+				stream.append(head + ["actionexpires", self.__file, value])
+			elif opt == "actionconcurrency":
+				stream.append(head + ["actionconcurrency", self.__file, self.__opts[opt]])
 		# cInfo
 		if self.__cInfo:
 			for p in self.__cInfo:
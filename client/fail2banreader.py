@@ -47,7 +47,11 @@ class Fail2banReader(ConfigReader):
 	
 	def getOptions(self):
 		opts = [["int", "loglevel", 1],
-				["string", "logtarget", "STDERR"]]
+				["string", "logtarget", "STDERR"],
+				["string", "cursorfile", None],
+				["int", "metricsinterval", None],
+				["string", "metrics", None],
+				["int", "actionworkers", None]]
 		self.__opts = ConfigReader.getOptions(self, "Definition", opts)
 	
 	def convert(self):
@@ -57,5 +61,18 @@ class Fail2banReader(ConfigReader):
 				stream.append(["set", "loglevel", self.__opts[opt]])
 			elif opt == "logtarget":
 				stream.append(["set", "logtarget", self.__opts[opt]])
+		if self.__opts.has_key("cursorfile"):
+			stream.append(["set", "cursorfile", self.__opts["cursorfile"]])
+		# Sets the interval before the sampler starts with its first exporter
+		if self.__opts.has_key("metricsinterval"):
+			stream.append(["set", "metricsinterval",
+						   self.__opts["metricsinterval"]])
+		# Removes the exporters of the previous configuration on reload
+		stream.append(["set", "delmetrics", "all"])
+		if self.__opts.has_key("metrics"):
+			for exporter in self.__opts["metrics"].split():
+				stream.append(["set", "metrics", exporter])
+		if self.__opts.has_key("actionworkers"):
+			stream.append(["set", "actionworkers", self.__opts["actionworkers"]])
 		return stream
 	
@@ -66,6 +66,7 @@ class JailReader(ConfigReader):
 				["int", "findtime", 600],
 				["int", "bantime", 600],
 				["string", "usedns", "warn"],
+				["bool", "bytelines", None],
 				["string", "failregex", None],
 				["string", "ignoreregex", None],
 				["string", "ignoreip", None],
@@ -106,6 +107,12 @@ class JailReader(ConfigReader):
 			if opt == "logpath":
 				for path in self.__opts[opt].split("\n"):
 					pathList = glob.glob(path)
+					if glob.has_magic(path):
+						# The server adds the files as they appear
+						if len(pathList) == 0:
+							logSys.warn("No file found for " + path + " yet")
+						stream.append(["set", self.__name, "addlogpath", path])
+						continue
 					if len(pathList) == 0:
 						logSys.error("No file found for " + path)
 					for p in pathList:
@@ -125,6 +132,12 @@ class JailReader(ConfigReader):
 				stream.append(["set", self.__name, "bantime", self.__opts[opt]])
 			elif opt == "usedns":
 				stream.append(["set", self.__name, "usedns", self.__opts[opt]])
+			elif opt == "bytelines":
+				if self.__opts[opt]:
+					value = "true"
+				else:
+					value = "false"
+				stream.append(["set", self.__name, "bytelines", value])
 			elif opt == "failregex":
 				stream.append(["set", self.__name, "addfailregex", self.__opts[opt]])
 			elif opt == "ignoreregex":
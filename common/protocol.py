@@ -45,17 +45,30 @@ protocol = [
 ["get loglevel", "gets the logging level"], 
 ["set logtarget <TARGET>", "sets logging target to <TARGET>. Can be STDOUT, STDERR, SYSLOG or a file"], 
 ["get logtarget", "gets logging target"], 
+['', "FILE CURSORS", ""],
+["set cursorfile <FILE>", "keeps the position reached in the log files of the jails added afterwards in <FILE>"], 
+["get cursorfile", "gets the file keeping the position reached in the log files"], 
+['', "METRICS", ""],
+["set metrics <EXPORTER>", "exports the failure statistics to <EXPORTER>. Can be rrd:<FILE>, file:<FILE> or socket:<HOST>:<PORT>"], 
+["set delmetrics <EXPORTER>", "stops exporting the failure statistics to <EXPORTER>, or to all the exporters if <EXPORTER> is all"], 
+["get metrics", "gets the metrics exporters"], 
+["set metricsinterval <TIME>", "sets the interval between two samples of the metrics to <TIME> seconds"], 
+["get metricsinterval", "gets the interval between two samples of the metrics"], 
+['', "ACTION EXECUTOR", ""],
+["set actionworkers <NUM>", "runs the action commands of all the jails in <NUM> threads"], 
+["get actionworkers", "gets the number of threads running the action commands"], 
 ['', "JAIL CONTROL", ""],
 ["add <JAIL> <BACKEND>", "creates <JAIL> using <BACKEND>"], 
 ["start <JAIL>", "starts the jail <JAIL>"], 
 ["stop <JAIL>", "stops the jail <JAIL>. The jail is removed"], 
 ["status <JAIL>", "gets the current status of <JAIL>"],
+["status <JAIL> <START> [<COUNT>]", "gets the current status of <JAIL>, listing at most <COUNT> banned IPs from the <START>th one"],
 ['', "JAIL CONFIGURATION", ""],
 ["set <JAIL> idle on|off", "sets the idle state of <JAIL>"], 
 ["set <JAIL> addignoreip <IP>", "adds <IP> to the ignore list of <JAIL>"], 
 ["set <JAIL> delignoreip <IP>", "removes <IP> from the ignore list of <JAIL>"], 
-["set <JAIL> addlogpath <FILE>", "adds <FILE> to the monitoring list of <JAIL>"], 
-["set <JAIL> dellogpath <FILE>", "removes <FILE> from the monitoring list of <JAIL>"],
+["set <JAIL> addlogpath <FILE>", "adds <FILE> to the monitoring list of <JAIL>. If <FILE> is a glob pattern, the matching files are added as they appear"], 
+["set <JAIL> dellogpath <FILE>", "removes <FILE> or the files of the glob pattern <FILE> from the monitoring list of <JAIL>"],
 ["set <JAIL> addfailregex <REGEX>", "adds the regular expression <REGEX> which must match failures for <JAIL>"], 
 ["set <JAIL> delfailregex <INDEX>", "removes the regular expression at <INDEX> for failregex"], 
 ["set <JAIL> addignoreregex <REGEX>", "adds the regular expression <REGEX> which should match pattern to exclude for <JAIL>"],
@@ -63,6 +76,7 @@ protocol = [
 ["set <JAIL> findtime <TIME>", "sets the number of seconds <TIME> for which the filter will look back for <JAIL>"], 
 ["set <JAIL> bantime <TIME>", "sets the number of seconds <TIME> a host will be banned for <JAIL>"], 
 ["set <JAIL> usedns <VALUE>", "sets the usedns mode for <JAIL>"],
+["set <JAIL> bytelines <VALUE>", "matches the log lines of <JAIL> without decoding them if <VALUE> is true"],
 ["set <JAIL> banip <IP>", "manually Ban <IP> for <JAIL>"], 
 ["set <JAIL> maxretry <RETRY>", "sets the number of failures <RETRY> before banning the host for <JAIL>"], 
 ["set <JAIL> addaction <ACT>", "adds a new action named <NAME> for <JAIL>"], 
@@ -74,6 +88,11 @@ protocol = [
 ["set <JAIL> actioncheck <ACT> <CMD>", "sets the check command <CMD> of the action <ACT> for <JAIL>"], 
 ["set <JAIL> actionban <ACT> <CMD>", "sets the ban command <CMD> of the action <ACT> for <JAIL>"],
 ["set <JAIL> actionunban <ACT> <CMD>", "sets the unban command <CMD> of the action <ACT> for <JAIL>"], 
+["set <JAIL> actionbanbatch <ACT> <CMD>", "sets the ban command <CMD> of the action <ACT> for <JAIL> banning the IPs <ips> at once"], 
+["set <JAIL> actionunbanbatch <ACT> <CMD>", "sets the unban command <CMD> of the action <ACT> for <JAIL> unbanning the IPs <ips> at once"], 
+["set <JAIL> actioncheckttl <ACT> <TIME>", "trusts a successful check command of the action <ACT> for <JAIL> during <TIME> seconds"], 
+["set <JAIL> actionexpires <ACT> true|false", "if true, the bans of the action <ACT> for <JAIL> expire in the firewall and its unban command is not executed when a ban expires"], 
+["set <JAIL> actionconcurrency <ACT> <NUM>", "allows <NUM> commands of the action <ACT> for <JAIL> to run at once"], 
 ['', "JAIL INFORMATION", ""],
 ["get <JAIL> logpath", "gets the list of the monitored files for <JAIL>"],
 ["get <JAIL> ignoreip", "gets the list of ignored IP addresses for <JAIL>"],
@@ -82,6 +101,7 @@ protocol = [
 ["get <JAIL> findtime", "gets the time for which the filter will look back for failures for <JAIL>"],
 ["get <JAIL> bantime", "gets the time a host is banned for <JAIL>"],
 ["get <JAIL> usedns", "gets the usedns setting for <JAIL>"],
+["get <JAIL> bytelines", "gets the bytelines setting for <JAIL>"],
 ["get <JAIL> maxretry", "gets the number of failures allowed for <JAIL>"],
 ["get <JAIL> addaction", "gets the last action which has been added for <JAIL>"],
 ["get <JAIL> actionstart <ACT>", "gets the start command for the action <ACT> for <JAIL>"],
@@ -89,6 +109,11 @@ protocol = [
 ["get <JAIL> actioncheck <ACT>", "gets the check command for the action <ACT> for <JAIL>"],
 ["get <JAIL> actionban <ACT>", "gets the ban command for the action <ACT> for <JAIL>"],
 ["get <JAIL> actionunban <ACT>", "gets the unban command for the action <ACT> for <JAIL>"],
+["get <JAIL> actionbanbatch <ACT>", "gets the batched ban command for the action <ACT> for <JAIL>"],
+["get <JAIL> actionunbanbatch <ACT>", "gets the batched unban command for the action <ACT> for <JAIL>"],
+["get <JAIL> actioncheckttl <ACT>", "gets the time during which a successful check command of the action <ACT> for <JAIL> is trusted"],
+["get <JAIL> actionexpires <ACT>", "gets whether the bans of the action <ACT> for <JAIL> expire in the firewall"],
+["get <JAIL> actionconcurrency <ACT>", "gets the number of commands of the action <ACT> for <JAIL> allowed to run at once"],
 ]
 
 ##
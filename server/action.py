@@ -27,15 +27,15 @@ __date__ = "$Date$"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier"
 __license__ = "GPL"
 
-import logging, os
-import threading
+import logging, os, sys, time, subprocess
+from threading import Lock, Thread, Condition
 #from subprocess import call
 
 # Gets the instance of the logger.
 logSys = logging.getLogger("fail2ban.actions.action")
 
-# Create a lock for running system commands
-_cmd_lock = threading.Lock()
+# The CommandRunner executing the commands or None to fork the server
+_runner = None
 
 ##
 # Execute commands.
@@ -55,10 +55,25 @@ class Action:
 		self.__actionBan = ''
 		## Command executed when an IP address gets removed.
 		self.__actionUnban = ''
+		## Command executed when IP addresses get banned or empty.
+		self.__actionBanBatch = ''
+		## Command executed when IP addresses get removed or empty.
+		self.__actionUnbanBatch = ''
 		## Command executed in order to check requirements.
 		self.__actionCheck = ''
 		## Command executed in order to stop the system.
 		self.__actionStop = ''
+		## Maximal number of commands running at once.
+		self.__concurrency = 1
+		## True if the bans expire without the "unban" command.
+		self.__expires = False
+		## Seconds during which a successful "check" command is trusted.
+		self.__checkTTL = 60
+		## Time of the last successful "check" command or None.
+		self.__checkTime = None
+		## True while the "check" command runs in the background.
+		self.__rechecking = False
+		self.__checkLock = Lock()
 		logSys.debug("Created Action")
 	
 	##
@@ -77,6 +92,35 @@ class Action:
 	def getName(self):
 		return self.__name
 	
+	##
+	# Sets the maximal number of commands running at once.
+	#
+	# Commands of the action for different IP addresses may run in
+	# parallel if the value is greater than 1.
+	# @param value the number of commands
+	
+	def setConcurrency(self, value):
+		self.__concurrency = value
+		logSys.debug("Set concurrency = %s" % value)
+	
+	def getConcurrency(self):
+		return self.__concurrency
+	
+	##
+	# Sets whether the bans expire by themselves.
+	#
+	# The firewall removes the IP addresses after the ban time, e.g. with
+	# the timeout of an ipset, so that the "unban" command is not executed
+	# when a ban expires.
+	# @param value True if the bans expire
+	
+	def setExpires(self, value):
+		self.__expires = value
+		logSys.debug("Set expires = %s" % value)
+	
+	def getExpires(self):
+		return self.__expires
+	
 	##
 	# Sets a "CInfo".
 	#
@@ -185,6 +229,76 @@ class Action:
 	def execActionUnban(self, aInfo):
 		return self.__processCmd(self.__actionUnban, aInfo)
 	
+	##
+	# Set the batched "ban" command.
+	#
+	# The tag <ips> is replaced with the space separated IP addresses.
+	# @param value the command
+	
+	def setActionBanBatch(self, value):
+		self.__actionBanBatch = value
+		logSys.debug("Set actionBanBatch = %s" % value)
+	
+	def getActionBanBatch(self):
+		return self.__actionBanBatch
+	
+	##
+	# Executes the "ban" command for several IP addresses.
+	#
+	# Executes the batched "ban" command once if it is defined, else the
+	# "ban" command for each IP address. A batch may be rejected as a whole
+	# because of a single address, e.g. by iptables-restore, so the "ban"
+	# command is then executed for each IP address.
+	# @param aInfos the list of the properties of the tickets
+	# @return True if the commands succeeded
+	
+	def execActionBanBatch(self, aInfos):
+		if self.__actionBanBatch != "":
+			if self.__processCmd(self.__actionBanBatch,
+								 Action.batchInfo(aInfos)):
+				return True
+			logSys.warn("Batched ban failed, banning the %d addresses "
+						"one by one" % len(aInfos))
+		ret = True
+		for aInfo in aInfos:
+			ret = self.execActionBan(aInfo) and ret
+		return ret
+	
+	##
+	# Set the batched "unban" command.
+	#
+	# The tag <ips> is replaced with the space separated IP addresses.
+	# @param value the command
+	
+	def setActionUnbanBatch(self, value):
+		self.__actionUnbanBatch = value
+		logSys.debug("Set actionUnbanBatch = %s" % value)
+	
+	def getActionUnbanBatch(self):
+		return self.__actionUnbanBatch
+	
+	##
+	# Executes the "unban" command for several IP addresses.
+	#
+	# Executes the batched "unban" command once if it is defined, else the
+	# "unban" command for each IP address. A batch may fail as a whole
+	# because of a single address, e.g. whose rule was already removed, so
+	# the "unban" command is then executed for each IP address.
+	# @param aInfos the list of the properties of the tickets
+	# @return True if the commands succeeded
+	
+	def execActionUnbanBatch(self, aInfos):
+		if self.__actionUnbanBatch != "":
+			if self.__processCmd(self.__actionUnbanBatch,
+								 Action.batchInfo(aInfos)):
+				return True
+			logSys.warn("Batched unban failed, unbanning the %d addresses "
+						"one by one" % len(aInfos))
+		ret = True
+		for aInfo in aInfos:
+			ret = self.execActionUnban(aInfo) and ret
+		return ret
+	
 	##
 	# Set the "check" command.
 	#
@@ -192,6 +306,7 @@ class Action:
 	
 	def setActionCheck(self, value):
 		self.__actionCheck = value
+		self.__invalidateCheck()
 		logSys.debug("Set actionCheck = %s" % value)
 	
 	##
@@ -202,6 +317,21 @@ class Action:
 	def getActionCheck(self):
 		return self.__actionCheck
 	
+	##
+	# Set the time to live of the "check" command result.
+	#
+	# After a successful "check" command, the commands run without checking
+	# during this number of seconds. The check is then run again in the
+	# background. 0 checks before every command.
+	# @param value the number of seconds
+	
+	def setCheckTTL(self, value):
+		self.__checkTTL = value
+		logSys.debug("Set checkTTL = %s" % value)
+	
+	def getCheckTTL(self):
+		return self.__checkTTL
+	
 	##
 	# Set the "stop" command.
 	#
@@ -228,6 +358,7 @@ class Action:
 	# @return True if the command succeeded
 	
 	def execActionStop(self):
+		self.__invalidateCheck()
 		stopCmd = Action.replaceTag(self.__actionStop, self.__cInfo)
 		return Action.executeCmd(stopCmd)
 	
@@ -250,6 +381,17 @@ class Action:
 		return string
 	replaceTag = staticmethod(replaceTag)
 	
+	##
+	# Get the properties of a batch of tickets.
+	#
+	# @param aInfos the list of the properties of the tickets
+	# @return the properties with the tag "ips"
+	
+	#@staticmethod
+	def batchInfo(aInfos):
+		return {"ips": " ".join([str(aInfo["ip"]) for aInfo in aInfos])}
+	batchInfo = staticmethod(batchInfo)
+	
 	##
 	# Executes a command with preliminary checks and substitutions.
 	#
@@ -270,17 +412,8 @@ class Action:
 			logSys.debug("Nothing to do")
 			return True
 		
-		checkCmd = Action.replaceTag(self.__actionCheck, self.__cInfo)
-		if not Action.executeCmd(checkCmd):
-			logSys.error("Invariant check failed. Trying to restore a sane" +
-						 " environment")
-			stopCmd = Action.replaceTag(self.__actionStop, self.__cInfo)
-			Action.executeCmd(stopCmd)
-			startCmd = Action.replaceTag(self.__actionStart, self.__cInfo)
-			Action.executeCmd(startCmd)
-			if not Action.executeCmd(checkCmd):
-				logSys.fatal("Unable to restore environment")
-				return False
+		if not self.__checkEnv():
+			return False
 
 		# Replace tags
 		if not aInfo == None:
@@ -291,7 +424,79 @@ class Action:
 		# Replace static fields
 		realCmd = Action.replaceTag(realCmd, self.__cInfo)
 		
-		return Action.executeCmd(realCmd)
+		if not Action.executeCmd(realCmd):
+			# The environment may be broken
+			self.__invalidateCheck()
+			return False
+		return True
+
+	##
+	# Executes the "check" command if needed.
+	#
+	# A successful check is trusted during the time to live. Once it
+	# expired, the check is run again in the background while the commands
+	# go on. If it is not trusted, the check runs now and tries to restore a
+	# sane environment if it fails.
+	#
+	# @return True if the environment is sane
+	
+	def __checkEnv(self):
+		try:
+			self.__checkLock.acquire()
+			if self.__actionCheck == "":
+				return True
+			checkTime = self.__checkTime
+			if checkTime is not None and self.__checkTTL > 0:
+				if time.time() >= checkTime + self.__checkTTL \
+				   and not self.__rechecking:
+					self.__rechecking = True
+					thread = Thread(target = self.__recheck)
+					thread.setDaemon(True)
+					thread.start()
+				return True
+			checkCmd = Action.replaceTag(self.__actionCheck, self.__cInfo)
+			if not Action.executeCmd(checkCmd):
+				logSys.error("Invariant check failed. Trying to restore a sane" +
+							 " environment")
+				stopCmd = Action.replaceTag(self.__actionStop, self.__cInfo)
+				Action.executeCmd(stopCmd)
+				startCmd = Action.replaceTag(self.__actionStart, self.__cInfo)
+				Action.executeCmd(startCmd)
+				if not Action.executeCmd(checkCmd):
+					logSys.fatal("Unable to restore environment")
+					return False
+			self.__checkTime = time.time()
+			return True
+		finally:
+			self.__checkLock.release()
+
+	##
+	# Runs the "check" command in the background.
+	#
+	# If it fails, the next command runs the check again and restores the
+	# environment.
+	
+	def __recheck(self):
+		checkCmd = Action.replaceTag(self.__actionCheck, self.__cInfo)
+		ret = Action.executeCmd(checkCmd)
+		try:
+			self.__checkLock.acquire()
+			self.__rechecking = False
+			if ret:
+				self.__checkTime = time.time()
+			else:
+				logSys.warn("Invariant check failed. Checking again before the "
+							"next command")
+				self.__checkTime = None
+		finally:
+			self.__checkLock.release()
+
+	def __invalidateCheck(self):
+		try:
+			self.__checkLock.acquire()
+			self.__checkTime = None
+		finally:
+			self.__checkLock.release()
 
 	##
 	# Executes a command.
@@ -308,21 +513,214 @@ class Action:
 	#@staticmethod
 	def executeCmd(realCmd):
 		logSys.debug(realCmd)
-		_cmd_lock.acquire()
-		try: # Try wrapped within another try needed for python version < 2.5
-			try:
+		try:
+			retcode = None
+			runner = _runner
+			if runner is not None:
+				retcode = runner.execute(realCmd)
+			if retcode is None:
 				# The following line gives deadlock with multiple jails
 				#retcode = call(realCmd, shell=True)
 				retcode = os.system(realCmd)
-				if retcode == 0:
-					logSys.debug("%s returned successfully" % realCmd)
-					return True
-				else:
-					logSys.error("%s returned %x" % (realCmd, retcode))
-			except OSError, e:
-				logSys.error("%s failed with %s" % (realCmd, e))
-		finally:
-			_cmd_lock.release()
+			if retcode == 0:
+				logSys.debug("%s returned successfully" % realCmd)
+				return True
+			else:
+				logSys.error("%s returned %x" % (realCmd, retcode))
+		except OSError, e:
+			logSys.error("%s failed with %s" % (realCmd, e))
 		return False
 	executeCmd = staticmethod(executeCmd)
 	
+	
+	##
+	# Start the command runner.
+	#
+	# The commands are then executed by the CommandRunner instead of
+	# os.system(). Should be called early, while the server is small.
+	
+	#@staticmethod
+	def startRunner():
+		global _runner
+		if _runner is None:
+			runner = CommandRunner()
+			try:
+				runner.start()
+				_runner = runner
+			except OSError, e:
+				logSys.error("Unable to start the command runner: %s" % e)
+	startRunner = staticmethod(startRunner)
+	
+	#@staticmethod
+	def stopRunner():
+		global _runner
+		runner = _runner
+		_runner = None
+		if runner is not None:
+			runner.stop()
+	stopRunner = staticmethod(stopRunner)
+
+
+##
+# Command runner.
+#
+# A small helper process, this module run as a script, which executes the
+# commands with /bin/sh. The commands are sent over a pipe and the exit
+# status are read back from another one, so that executing a command does
+# not fork the server, whose memory grows with the fail and ban lists.
+# Several commands may run at once.
+#
+# Request: "<id> <length>\n<command>"
+# Reply:   "<id> <status>\n", status as returned by os.system()
+
+class CommandRunner:
+	
+	## Exit status of a command whose helper exited before reporting it.
+	LOST = -1
+	
+	def __init__(self):
+		self.__cond = Condition()
+		self.__process = None
+		self.__alive = False
+		self.__nextId = 0
+		## The exit status of the finished commands indexed by id.
+		self.__results = dict()
+	
+	##
+	# Start the helper process.
+	#
+	# It runs in its own session so that a signal sent to the terminal of
+	# the server does not stop it before the server executes the "stop"
+	# commands.
+	
+	def start(self):
+		script = __file__
+		if script[-4:] in (".pyc", ".pyo") and os.path.exists(script[:-1]):
+			script = script[:-1]
+		self.__process = subprocess.Popen([sys.executable, script],
+										  stdin = subprocess.PIPE,
+										  stdout = subprocess.PIPE,
+										  close_fds = True,
+										  preexec_fn = os.setsid)
+		self.__alive = True
+		reader = Thread(target = self.__read)
+		reader.setDaemon(True)
+		reader.start()
+		logSys.debug("Started the command runner (pid %d)" % self.__process.pid)
+	
+	##
+	# Stop the helper process.
+	#
+	# It exits once the running commands are done.
+	
+	def stop(self):
+		try:
+			self.__cond.acquire()
+			self.__alive = False
+			try:
+				self.__process.stdin.close()
+			except IOError:
+				pass
+		finally:
+			self.__cond.release()
+		self.__process.wait()
+	
+	def isAlive(self):
+		return self.__alive
+	
+	##
+	# Execute a command.
+	#
+	# A command which was sent is never executed again: if the helper
+	# exits before it reports the status, the command is failed.
+	# @param realCmd the command
+	# @return the exit status or None if the command was not sent
+	
+	def execute(self, realCmd):
+		if isinstance(realCmd, unicode):
+			realCmd = realCmd.encode("utf-8")
+		try:
+			self.__cond.acquire()
+			if not self.__alive:
+				return None
+			cmdId = self.__nextId
+			self.__nextId += 1
+			try:
+				self.__process.stdin.write("%d %d\n%s"
+										   % (cmdId, len(realCmd), realCmd))
+				self.__process.stdin.flush()
+			except (IOError, OSError), e:
+				# The helper exited, it did not get the whole command
+				logSys.error("Command runner failed: %s" % e)
+				self.__alive = False
+				return None
+			while self.__alive and not self.__results.has_key(cmdId):
+				self.__cond.wait()
+			if not self.__results.has_key(cmdId):
+				logSys.error("Command runner exited while executing %s"
+							 % realCmd)
+				return self.LOST
+			return self.__results.pop(cmdId)
+		finally:
+			self.__cond.release()
+	
+	def __read(self):
+		stdout = self.__process.stdout
+		while True:
+			line = stdout.readline()
+			if not line:
+				break
+			cmdId, status = line.split()
+			try:
+				self.__cond.acquire()
+				self.__results[int(cmdId)] = int(status)
+				self.__cond.notifyAll()
+			finally:
+				self.__cond.release()
+		try:
+			self.__cond.acquire()
+			if self.__alive:
+				logSys.error("Command runner exited")
+			self.__alive = False
+			self.__cond.notifyAll()
+		finally:
+			self.__cond.release()
+	
+	##
+	# Main loop of the helper process.
+	#
+	# Reads the commands from stdin and writes their exit status to stdout.
+	# The commands write to stderr instead of stdout.
+	
+	#@staticmethod
+	def serve():
+		results = os.fdopen(os.dup(1), "w")
+		os.dup2(2, 1)
+		devnull = open(os.devnull)
+		lock = Lock()
+		def run(cmdId, cmd):
+			retcode = subprocess.call(["/bin/sh", "-c", cmd], stdin = devnull,
+									  close_fds = True)
+			# Same status as os.system()
+			if retcode < 0:
+				status = -retcode
+			else:
+				status = retcode << 8
+			try:
+				lock.acquire()
+				results.write("%d %d\n" % (cmdId, status))
+				results.flush()
+			finally:
+				lock.release()
+		while True:
+			header = sys.stdin.readline()
+			if not header:
+				break
+			cmdId, length = header.split()
+			cmd = sys.stdin.read(int(length))
+			Thread(target = run, args = (int(cmdId), cmd)).start()
+	serve = staticmethod(serve)
+
+
+if __name__ == "__main__":
+	CommandRunner.serve()
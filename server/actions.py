@@ -45,6 +45,9 @@ logSys = logging.getLogger("fail2ban.actions")
 
 class Actions(JailThread):
 	
+	## Maximal number of IP addresses banned or unbanned by one command.
+	BATCH_SIZE = 1000
+	
 	##
 	# Constructor.
 	#
@@ -58,6 +61,16 @@ class Actions(JailThread):
 		self.__actions = list()
 		## The ban manager.
 		self.__banManager = BanManager()
+		## The ActionExecutor or None to run the commands in this thread.
+		self.__executor = None
+	
+	##
+	# Set the action executor.
+	#
+	# @param executor an ActionExecutor or None
+	
+	def setExecutor(self, executor):
+		self.__executor = executor
 	
 	##
 	# Adds an action.
@@ -66,6 +79,7 @@ class Actions(JailThread):
 	
 	def addAction(self, name):
 		action = Action(name)
+		Actions.__setBanTimeInfo(action, self.getBanTime())
 		self.__actions.append(action)
 	
 	##
@@ -110,7 +124,49 @@ class Actions(JailThread):
 	
 	def setBanTime(self, value):
 		self.__banManager.setBanTime(value)
+		for action in self.__actions:
+			Actions.__setBanTimeInfo(action, value)
 		logSys.info("Set banTime = %s" % value)
+		self.__renewBans(int(value))
+	
+	##
+	# Renew the current bans of the actions whose bans expire by themselves.
+	#
+	# Their bans keep the timeout they were made with, so the "ban" command
+	# is executed again with the time remaining under the new ban time, or
+	# 0 if the ban time is negative. The bans then end with the BanManager.
+	# @param banTime the new ban time
+	
+	def __renewBans(self, banTime):
+		actions = [action for action in self.__actions if action.getExpires()]
+		now = MyTime.time()
+		for ticket in self.__banManager.getBanTicketList():
+			if banTime < 0:
+				ticket.setPermanent(True)
+			if not actions:
+				continue
+			aInfo = Actions.__getInfo(ticket)
+			if banTime < 0:
+				aInfo["timeout"] = 0
+			else:
+				# 0 would never expire
+				aInfo["timeout"] = max(int(ticket.getTime() + banTime - now), 1)
+			for action in actions:
+				self.__execute(action, action.execActionBan, aInfo)
+	
+	##
+	# Make the ban time available to an action.
+	#
+	# The tag <bantime> is replaced with the ban time and <timeout> with
+	# the ban time or 0 if the bans are permanent, e.g. for an ipset.
+	# @param action the action
+	# @param value the ban time
+	
+	#@staticmethod
+	def __setBanTimeInfo(action, value):
+		action.setCInfo("bantime", value)
+		action.setCInfo("timeout", max(int(value), 0))
+	__setBanTimeInfo = staticmethod(__setBanTimeInfo)
 	
 	##
 	# Get the ban time.
@@ -130,7 +186,7 @@ class Actions(JailThread):
 	def run(self):
 		self.setActive(True)
 		for action in self.__actions:
-			action.execActionStart()
+			self.__execute(action, action.execActionStart)
 		while self._isActive():
 			if not self.getIdle():
 				#logSys.debug(self.jail.getName() + ": action")
@@ -142,35 +198,78 @@ class Actions(JailThread):
 				time.sleep(self.getSleepTime())
 		self.__flushBan()
 		for action in self.__actions:
-			action.execActionStop()
+			self.__execute(action, action.execActionStop)
+		if self.__executor is not None:
+			for action in self.__actions:
+				self.__executor.wait(action)
 		logSys.debug(self.jail.getName() + ": action terminated")
 		return True
 
+	##
+	# Run a command of an action.
+	#
+	# The command is handed to the executor if there is one.
+	# @param action the action
+	# @param function the function running the command
+	# @param aInfos the list of the properties of the tickets, the
+	# properties of a ticket or None
+	
+	def __execute(self, action, function, aInfos = None):
+		if aInfos is None:
+			args = ()
+			key = None
+		elif isinstance(aInfos, dict):
+			args = (aInfos,)
+			key = (aInfos["ip"],)
+		else:
+			args = (aInfos,)
+			key = tuple([aInfo["ip"] for aInfo in aInfos])
+		if self.__executor is None:
+			function(*args)
+		else:
+			self.__executor.submit(action, function, args, key)
+
 	##
 	# Check for IP address to ban.
 	#
-	# Look in the Jail queue for FailTicket. If a ticket is available,
-	# it executes the "ban" command and add a ticket to the BanManager.
-	# @return True if an IP address get banned
+	# Look in the Jail queue for FailTicket. The pending tickets, at most
+	# BATCH_SIZE, are added to the BanManager and the "ban" command is
+	# executed for all of them at once.
+	# @return True if tickets were pending
 	
 	def __checkBan(self):
-		ticket = self.jail.getFailTicket()
-		if ticket != False:
-			aInfo = dict()
+		tickets = self.jail.getFailTickets(self.BATCH_SIZE)
+		aInfos = list()
+		for ticket in tickets:
 			bTicket = BanManager.createBanTicket(ticket)
-			aInfo["ip"] = bTicket.getIP()
-			aInfo["failures"] = bTicket.getAttempt()
-			aInfo["time"] = bTicket.getTime()
-			aInfo["matches"] = "".join(bTicket.getMatches())
+			bTicket.setPermanent(self.getBanTime() < 0)
+			aInfo = Actions.__getInfo(bTicket)
 			if self.__banManager.addBanTicket(bTicket):
 				logSys.warn("[%s] Ban %s" % (self.jail.getName(), str(aInfo["ip"])))
-				for action in self.__actions:
-					action.execActionBan(aInfo)
-				return True
+				aInfos.append(aInfo)
 			else:
 				logSys.warn("[%s] %s already banned" % (self.jail.getName(), 
 														str(aInfo["ip"])))
-		return False
+		if aInfos:
+			for action in self.__actions:
+				self.__execute(action, action.execActionBanBatch, aInfos)
+		return len(tickets) > 0
+	
+	##
+	# Get the properties of a ticket for the actions.
+	#
+	# @param ticket the BanTicket
+	# @return a dictionary
+	
+	#@staticmethod
+	def __getInfo(ticket):
+		aInfo = dict()
+		aInfo["ip"] = ticket.getIP()
+		aInfo["failures"] = ticket.getAttempt()
+		aInfo["time"] = ticket.getTime()
+		aInfo["matches"] = "".join(ticket.getMatches())
+		return aInfo
+	__getInfo = staticmethod(__getInfo)
 	
 	##
 	# Check for IP address to unban.
@@ -178,8 +277,7 @@ class Actions(JailThread):
 	# Unban IP address which are outdated.
 	
 	def __checkUnBan(self):
-		for ticket in self.__banManager.unBanList(MyTime.time()):
-			self.__unBan(ticket)
+		self.__unBan(self.__banManager.unBanList(MyTime.time()), True)
 	
 	##
 	# Flush the ban list.
@@ -188,24 +286,35 @@ class Actions(JailThread):
 	
 	def __flushBan(self):
 		logSys.debug("Flush ban list")
-		for ticket in self.__banManager.flushBanList():
-			self.__unBan(ticket)
+		self.__unBan(self.__banManager.flushBanList())
 	
 	##
-	# Unbans host corresponding to the ticket.
+	# Unbans hosts corresponding to the tickets.
 	#
-	# Executes the actions in order to unban the host given in the
-	# ticket.
+	# Executes the actions in order to unban the hosts given in the
+	# tickets, at most BATCH_SIZE by command.
+	# @param tickets the BanTicket list
+	# @param expired True if the bans expired, the actions whose bans
+	# expire by themselves are then skipped, unless the bans were
+	# permanent when they were made
 	
-	def __unBan(self, ticket):
-		aInfo = dict()
-		aInfo["ip"] = ticket.getIP()
-		aInfo["failures"] = ticket.getAttempt()
-		aInfo["time"] = ticket.getTime()
-		aInfo["matches"] = "".join(ticket.getMatches())
-		logSys.warn("[%s] Unban %s" % (self.jail.getName(), aInfo["ip"]))
+	def __unBan(self, tickets, expired = False):
+		aInfos = list()
+		permanent = list()
+		for ticket in tickets:
+			aInfo = Actions.__getInfo(ticket)
+			logSys.warn("[%s] Unban %s" % (self.jail.getName(), aInfo["ip"]))
+			aInfos.append(aInfo)
+			if ticket.isPermanent():
+				permanent.append(aInfo)
 		for action in self.__actions:
-			action.execActionUnban(aInfo)
+			if expired and action.getExpires():
+				batches = permanent
+			else:
+				batches = aInfos
+			for i in range(0, len(batches), self.BATCH_SIZE):
+				batch = batches[i:i + self.BATCH_SIZE]
+				self.__execute(action, action.execActionUnbanBatch, batch)
 			
 	
 	##
@@ -215,8 +324,8 @@ class Actions(JailThread):
 	# number of failures.
 	# @return a list with tuple
 	
-	def status(self):
+	def status(self, start = 0, count = None):
 		ret = [("Currently banned", self.__banManager.size()), 
 			   ("Total banned", self.__banManager.getBanTotal()),
-			   ("IP list", self.__banManager.getBanList())]
+			   ("IP list", self.__banManager.getBanList(start, count))]
 		return ret
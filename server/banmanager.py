@@ -30,7 +30,7 @@ __license__ = "GPL"
 from ticket import BanTicket
 from threading import Lock
 from mytime import MyTime
-import logging
+import logging, heapq
 
 # Gets the instance of the logger.
 logSys = logging.getLogger("fail2ban.action")
@@ -51,8 +51,11 @@ class BanManager:
 	def __init__(self):
 		## Mutex used to protect the ban list.
 		self.__lock = Lock()
-		## The ban list.
-		self.__banList = list()
+		## The ban list, indexed by IP address.
+		self.__banList = dict()
+		## Heap of (time, IP address, ticket) ordered by ban time, so the
+		## tickets to unban are always at the top.
+		self.__banHeap = list()
 		## The amount of time an IP address gets banned.
 		self.__banTime = 600
 		## Total number of banned IP address
@@ -111,12 +114,32 @@ class BanManager:
 	##
 	# Returns a copy of the IP list.
 	#
+	# The addresses are sorted by ban time, the oldest ban first. A part
+	# of the list can be requested with start and count.
+	# @param start index of the first address to return
+	# @param count maximal number of addresses to return or None for all
 	# @return IP list
 	
-	def getBanList(self):
+	def getBanList(self, start = 0, count = None):
 		try:
 			self.__lock.acquire()
-			return [m.getIP() for m in self.__banList]
+			if count is None:
+				entries = sorted(self.__banHeap)[start:]
+			else:
+				entries = heapq.nsmallest(start + count, self.__banHeap)[start:]
+			return [ip for t, ip, ticket in entries]
+		finally:
+			self.__lock.release()
+
+	##
+	# Returns a copy of the ticket list.
+	#
+	# @return the BanTicket list
+	
+	def getBanTicketList(self):
+		try:
+			self.__lock.acquire()
+			return self.__banList.values()
 		finally:
 			self.__lock.release()
 
@@ -148,8 +171,10 @@ class BanManager:
 	def addBanTicket(self, ticket):
 		try:
 			self.__lock.acquire()
-			if not self.__inBanList(ticket):
-				self.__banList.append(ticket)
+			ip = ticket.getIP()
+			if not self.__banList.has_key(ip):
+				self.__banList[ip] = ticket
+				heapq.heappush(self.__banHeap, (ticket.getTime(), ip, ticket))
 				self.__banTotal += 1
 				return True
 			return False
@@ -169,20 +194,6 @@ class BanManager:
 		finally:
 			self.__lock.release()
 	
-	##
-	# Check if a ticket is in the list.
-	#
-	# Check if a BanTicket with a given IP address is already in the
-	# ban list.
-	# @param ticket the ticket
-	# @return True if a ticket already exists
-	
-	def __inBanList(self, ticket):
-		for i in self.__banList:
-			if ticket.getIP() == i.getIP():
-				return True
-		return False
-	
 	##
 	# Get the list of IP address to unban.
 	#
@@ -197,14 +208,13 @@ class BanManager:
 			if self.__banTime < 0:
 				return list()
 
-			# Gets the list of ticket to remove.
-			unBanList = [ticket for ticket in self.__banList
-						 if ticket.getTime() < time - self.__banTime]
-			
-			# Removes tickets.
-			self.__banList = [ticket for ticket in self.__banList
-							  if ticket not in unBanList]
-						
+			# Pops the tickets to remove from the top of the heap.
+			unBanList = list()
+			limit = time - self.__banTime
+			while self.__banHeap and self.__banHeap[0][0] < limit:
+				t, ip, ticket = heapq.heappop(self.__banHeap)
+				del self.__banList[ip]
+				unBanList.append(ticket)
 			return unBanList
 		finally:
 			self.__lock.release()
@@ -218,8 +228,9 @@ class BanManager:
 	def flushBanList(self):
 		try:
 			self.__lock.acquire()
-			uBList = self.__banList
-			self.__banList = list()
+			uBList = [ticket for t, ip, ticket in self.__banHeap]
+			self.__banList = dict()
+			self.__banHeap = list()
 			return uBList
 		finally:
 			self.__lock.release()
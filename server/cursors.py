@@ -0,0 +1,145 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: t -*-
+# vi: set ft=python sts=4 ts=4 sw=4 noet :
+
+# This file is part of Fail2Ban.
+#
+# Fail2Ban is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Fail2Ban is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Fail2Ban; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+__copyright__ = "Copyright (c) 2004 Cyril Jaquier"
+__license__ = "GPL"
+
+from threading import Lock
+import logging, os, time, tempfile, cPickle
+
+# Gets the instance of the logger.
+logSys = logging.getLogger("fail2ban.filter")
+
+##
+# Persistent file cursors.
+#
+# Keeps the position reached in each log file of each jail, together with
+# the inode and the hash of the first line of the file, so that the files
+# are not read again from the start after a restart. The cursors are
+# written to the state file at most every SAVE_INTERVAL seconds and when
+# the jails are stopped.
+
+class FileCursors:
+
+	## Minimal number of seconds between two writes of the state file.
+	SAVE_INTERVAL = 60
+
+	##
+	# Constructor.
+	#
+	# Loads the cursors from the state file if it exists.
+	# @param filename the state file
+
+	def __init__(self, filename):
+		self.__lock = Lock()
+		self.__filename = filename
+		## The cursors (inode, hash, position) indexed by (jail, path).
+		self.__cursors = dict()
+		self.__dirty = False
+		self.__nextSave = 0
+		try:
+			f = open(filename, "rb")
+			try:
+				self.__cursors = cPickle.load(f)
+			finally:
+				f.close()
+			logSys.debug("Loaded %d file cursors from %s"
+						 % (len(self.__cursors), filename))
+		except IOError:
+			# No state yet
+			pass
+		except Exception, e:
+			logSys.error("Unable to load the file cursors from %s: %s"
+						 % (filename, e))
+
+	def getFileName(self):
+		return self.__filename
+
+	##
+	# Get the cursor of a log file.
+	#
+	# @param jail the jail name
+	# @param path the log file
+	# @return a tuple (inode, hash, position) or None
+
+	def get(self, jail, path):
+		try:
+			self.__lock.acquire()
+			return self.__cursors.get((jail, path))
+		finally:
+			self.__lock.release()
+
+	##
+	# Update the cursor of a log file.
+	#
+	# The state file is written if the last write is older than
+	# SAVE_INTERVAL.
+	# @param jail the jail name
+	# @param path the log file
+	# @param cursor a tuple (inode, hash, position)
+
+	def update(self, jail, path, cursor):
+		try:
+			self.__lock.acquire()
+			if self.__cursors.get((jail, path)) != cursor:
+				self.__cursors[(jail, path)] = cursor
+				self.__dirty = True
+			if self.__dirty and time.time() >= self.__nextSave:
+				self.__save()
+		finally:
+			self.__lock.release()
+
+	##
+	# Write the state file if it is not up to date.
+
+	def save(self):
+		try:
+			self.__lock.acquire()
+			if self.__dirty:
+				self.__save()
+		finally:
+			self.__lock.release()
+
+	##
+	# Write the state file.
+	#
+	# The cursors are written to a temporary file which then replaces the
+	# state file, so that a crash never leaves a truncated state.
+
+	def __save(self):
+		self.__nextSave = time.time() + self.SAVE_INTERVAL
+		dirname = os.path.dirname(os.path.abspath(self.__filename))
+		try:
+			fd, tmp = tempfile.mkstemp(".tmp", "cursors", dirname)
+			try:
+				f = os.fdopen(fd, "wb")
+				try:
+					cPickle.dump(self.__cursors, f, cPickle.HIGHEST_PROTOCOL)
+					f.flush()
+					os.fsync(f.fileno())
+				finally:
+					f.close()
+				os.rename(tmp, self.__filename)
+			except:
+				os.unlink(tmp)
+				raise
+			self.__dirty = False
+		except (IOError, OSError), e:
+			logSys.error("Unable to save the file cursors to %s: %s"
+						 % (self.__filename, e))
@@ -37,9 +37,24 @@ logSys = logging.getLogger("fail2ban.filter.datedetector")
 
 class DateDetector:
 	
-	def __init__(self):
+	## Matches the three characters of a month or day name in UTF-8 encoded
+	## lines, instead of \S{3} which matches three bytes.
+	BYTE_NAME = r"(?:[^\s\x80-\xff]|[\xc0-\xff][\x80-\xbf]+){3}"
+	
+	##
+	# Constructor.
+	#
+	# @param byteLines True if the lines are not decoded, see
+	# Filter.setByteLines()
+	
+	def __init__(self, byteLines = False):
 		self.__lock = Lock()
+		self.__byteLines = byteLines
 		self.__templates = list()
+		## The template which matched last, tried first by matchTime().
+		self.__lastTemplate = None
+		## The match returned last by matchTime().
+		self.__lastMatch = None
 	
 	def addDefaultTemplate(self):
 		self.__lock.acquire()
@@ -47,7 +62,7 @@ class DateDetector:
 			# standard
 			template = DateStrptime()
 			template.setName("MONTH Day Hour:Minute:Second")
-			template.setRegex("\S{3}\s{1,2}\d{1,2} \d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<b>\S{3})\s{1,2}(?P<d>\d{1,2}) (?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%b %d %H:%M:%S")
 			self.__templates.append(template)
 			# asctime
@@ -65,13 +80,13 @@ class DateDetector:
 			# simple date
 			template = DateStrptime()
 			template.setName("Year/Month/Day Hour:Minute:Second")
-			template.setRegex("\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<Y>\d{4})/(?P<m>\d{2})/(?P<d>\d{2}) (?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%Y/%m/%d %H:%M:%S")
 			self.__templates.append(template)
 			# simple date too (from x11vnc)
 			template = DateStrptime()
 			template.setName("Day/Month/Year Hour:Minute:Second")
-			template.setRegex("\d{2}/\d{2}/\d{4} \d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<d>\d{2})/(?P<m>\d{2})/(?P<Y>\d{4}) (?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%d/%m/%Y %H:%M:%S")
 			self.__templates.append(template)
 			# previous one but with year given by 2 digits
@@ -84,43 +99,43 @@ class DateDetector:
 			# Apache format [31/Oct/2006:09:22:55 -0000]
 			template = DateStrptime()
 			template.setName("Day/MONTH/Year:Hour:Minute:Second")
-			template.setRegex("\d{2}/\S{3}/\d{4}:\d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<d>\d{2})/(?P<b>\S{3})/(?P<Y>\d{4}):(?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%d/%b/%Y:%H:%M:%S")
 			self.__templates.append(template)
 			# CPanel 05/20/2008:01:57:39
 			template = DateStrptime()
 			template.setName("Month/Day/Year:Hour:Minute:Second")
-			template.setRegex("\d{2}/\d{2}/\d{4}:\d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<m>\d{2})/(?P<d>\d{2})/(?P<Y>\d{4}):(?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%m/%d/%Y:%H:%M:%S")
 			self.__templates.append(template)
 			# Exim 2006-12-21 06:43:20
 			template = DateStrptime()
 			template.setName("Year-Month-Day Hour:Minute:Second")
-			template.setRegex("\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<Y>\d{4})-(?P<m>\d{2})-(?P<d>\d{2}) (?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%Y-%m-%d %H:%M:%S")
 			self.__templates.append(template)
 			# custom for syslog-ng 2006.12.21 06:43:20
 			template = DateStrptime()
 			template.setName("Year.Month.Day Hour:Minute:Second")
-			template.setRegex("\d{4}.\d{2}.\d{2} \d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<Y>\d{4}).(?P<m>\d{2}).(?P<d>\d{2}) (?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%Y.%m.%d %H:%M:%S")
 			self.__templates.append(template)
 			# named 26-Jul-2007 15:20:52.252 
 			template = DateStrptime()
 			template.setName("Day-MONTH-Year Hour:Minute:Second[.Millisecond]")
-			template.setRegex("\d{2}-\S{3}-\d{4} \d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<d>\d{2})-(?P<b>\S{3})-(?P<Y>\d{4}) (?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%d-%b-%Y %H:%M:%S")
 			self.__templates.append(template)
 			# 17-07-2008 17:23:25
 			template = DateStrptime()
 			template.setName("Day-Month-Year Hour:Minute:Second")
-			template.setRegex("\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<d>\d{2})-(?P<m>\d{2})-(?P<Y>\d{4}) (?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%d-%m-%Y %H:%M:%S")
 			self.__templates.append(template)
 			# 01-27-2012 16:22:44.252
 			template = DateStrptime()
 			template.setName("Month-Day-Year Hour:Minute:Second[.Millisecond]")
-			template.setRegex("\d{2}-\d{2}-\d{4} \d{2}:\d{2}:\d{2}")
+			template.setRegex("(?P<m>\d{2})-(?P<d>\d{2})-(?P<Y>\d{4}) (?P<H>\d{2}):(?P<M>\d{2}):(?P<S>\d{2})")
 			template.setPattern("%m-%d-%Y %H:%M:%S")
 			self.__templates.append(template)
 			# TAI64N
@@ -147,29 +162,104 @@ class DateDetector:
 			template.setRegex("^<\d{2}/\d{2}/\d{2}@\d{2}:\d{2}:\d{2}>")
 			template.setPattern("<%m/%d/%y@%H:%M:%S>")
 			self.__templates.append(template)
+			if self.__byteLines:
+				for template in self.__templates:
+					regex = template.getRegex()
+					if regex.find("\S{3}") >= 0:
+						template.setRegex(
+							regex.replace("\S{3}", DateDetector.BYTE_NAME))
 		finally:
 			self.__lock.release()
 	
 	def getTemplates(self):
 		return self.__templates
 	
+	##
+	# Searches the date in the line.
+	#
+	# Log files usually use a single format, so the template which matched
+	# the previous line is tried first. The other templates are tried in
+	# the order of the list, which is kept sorted by hits as they match.
+	# @param line the log line
+	# @return the match object or None
+	
 	def matchTime(self, line):
 		self.__lock.acquire()
 		try:
-			for template in self.__templates:
+			lastTemplate = self.__lastTemplate
+			if lastTemplate is not None:
+				match = lastTemplate.matchDate(line)
+				if match is not None:
+					self.__lastMatch = match
+					return match
+			for index, template in enumerate(self.__templates):
+				if template is lastTemplate:
+					continue
 				match = template.matchDate(line)
-				if not match == None:
+				if match is not None:
+					self.__lastTemplate = template
+					self.__lastMatch = match
+					self.__promoteTemplate(index)
 					return match
+			self.__lastMatch = None
 			return None
 		finally:
 			self.__lock.release()
 
-	def getTime(self, line):
+	##
+	# Moves a template up the list while it has more hits than its
+	# predecessor.
+	#
+	# @param index the position of the template in the list
+	
+	def __promoteTemplate(self, index):
+		templates = self.__templates
+		template = templates[index]
+		while index > 0 and template.getHits() > templates[index - 1].getHits():
+			templates[index] = templates[index - 1]
+			index -= 1
+		templates[index] = template
+
+	##
+	# Gets the date from the line.
+	#
+	# If timeMatch is the match last returned by matchTime(), the date is
+	# taken from it directly instead of searching the templates again.
+	# @param line the log line
+	# @param timeMatch the result of matchTime() for this line (optional)
+	# @return the date as a list (see time.struct_time) or None
+	
+	def getTime(self, line, timeMatch = None):
+		return self.__getDate(line, timeMatch, False)
+
+	##
+	# Gets the date from the line as seconds since the epoch.
+	#
+	# @see getTime
+	# @return the time in seconds or None
+
+	def getUnixTime(self, line, timeMatch = None):
+		return self.__getDate(line, timeMatch, True)
+
+	def __getDate(self, line, timeMatch, unixTime):
 		self.__lock.acquire()
 		try:
+			if timeMatch is not None and timeMatch is self.__lastMatch:
+				try:
+					if unixTime:
+						date = self.__lastTemplate.getUnixTime(line, timeMatch)
+					else:
+						date = self.__lastTemplate.getDate(line, timeMatch)
+					if date is not None:
+						return date
+				except ValueError:
+					pass
 			for template in self.__templates:
 				try:
-					date = template.getDate(line)
+					if unixTime:
+						date = template.getUnixTime(line)
+					else:
+						date = template.getDate(line)
 					if date == None:
 						continue
 					return date
@@ -179,16 +269,9 @@ class DateDetector:
 		finally:
 			self.__lock.release()
 
-	def getUnixTime(self, line):
-		date = self.getTime(line)
-		if date == None:
-			return None
-		else:
-			return time.mktime(date)
-
 	##
-	# Sort the template lists using the hits score. This method is not called
-	# in this object and thus should be called from time to time.
+	# Sort the template lists using the hits score. matchTime() already
+	# keeps the list ordered as templates match, so this is rarely needed.
 	
 	def sortTemplate(self):
 		self.__lock.acquire()
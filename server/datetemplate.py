@@ -27,7 +27,7 @@ __date__ = "$Date$"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier"
 __license__ = "GPL"
 
-import re, time
+import re, time, calendar
 
 from mytime import MyTime
 import iso8601
@@ -37,12 +37,23 @@ logSys = logging.getLogger("fail2ban.datetemplate")
 
 
 class DateTemplate:
+
+	## Maximum number of entries kept by the getUnixTime() cache.
+	CACHE_SIZE = 1000
 	
 	def __init__(self):
 		self.__name = ""
 		self.__regex = ""
 		self.__cRegex = None
 		self.__hits = 0
+		## Times already computed, keyed by the matched date string.
+		self.__cache = dict()
+		## The cache is flushed at this time (end of the current UTC day).
+		self.__cacheEnd = 0
+		## Time of the last lookup, to detect the clock going backwards.
+		self.__cacheNow = 0
+		## Set to False by getDate() if its result must not be cached.
+		self._cacheable = True
 	
 	def setName(self, name):
 		self.__name = name
@@ -66,8 +77,62 @@ class DateTemplate:
 			self.__hits += 1
 		return dateMatch
 	
-	def getDate(self, line):
-		raise Exception("matchDate() is abstract")
+	##
+	# Gets the date from the line.
+	#
+	# @param line the log line
+	# @param dateMatch the result of matchDate(line) if already known
+	# @return the date as a list (see time.struct_time) or None
+	
+	def getDate(self, line, dateMatch = None):
+		raise Exception("getDate() is abstract")
+	
+	##
+	# Gets the date from the line as seconds since the epoch.
+	#
+	# Busy logs contain many lines with the same date string, so the
+	# results are cached. Dates without a year depend on the current day
+	# (see DateStrptime.getDate), so the cache is flushed when the day
+	# changes or the clock goes backwards.
+	# @param line the log line
+	# @param dateMatch the result of matchDate(line) if already known
+	# @return the time in seconds or None
+	
+	def getUnixTime(self, line, dateMatch = None):
+		if dateMatch is None:
+			dateMatch = self.matchDate(line)
+			if dateMatch is None:
+				return None
+		now = MyTime.time()
+		if now >= self.__cacheEnd or now < self.__cacheNow:
+			self.__cache.clear()
+			self.__cacheEnd = now - now % 86400 + 86400
+		self.__cacheNow = now
+		key = dateMatch.group()
+		try:
+			return self.__cache[key]
+		except KeyError:
+			pass
+		self._cacheable = True
+		unixTime = self._getUnixTime(line, dateMatch)
+		if self._cacheable and unixTime is not None:
+			if len(self.__cache) >= self.CACHE_SIZE:
+				self.__cache.clear()
+			self.__cache[key] = unixTime
+		return unixTime
+	
+	##
+	# Computes the time for getUnixTime().
+	#
+	# @param line the log line
+	# @param dateMatch the result of matchDate(line)
+	# @return the time in seconds or None
+	
+	def _getUnixTime(self, line, dateMatch):
+		date = self.getDate(line, dateMatch)
+		if date is None:
+			return None
+		return time.mktime(date)
 
 
 class DateEpoch(DateTemplate):
@@ -77,9 +142,10 @@ class DateEpoch(DateTemplate):
 		# We already know the format for TAI64N
 		self.setRegex("^\d{10}(\.\d{6})?")
 	
-	def getDate(self, line):
+	def getDate(self, line, dateMatch = None):
 		date = None
-		dateMatch = self.matchDate(line)
+		if dateMatch is None:
+			dateMatch = self.matchDate(line)
 		if dateMatch:
 			# extract part of format which represents seconds since epoch
 			date = list(MyTime.localtime(float(dateMatch.group())))
@@ -106,10 +172,41 @@ class DateStrptime(DateTemplate):
 	TABLE["Oct"] = [u"Paź"]
 	TABLE["Nov"] = ["Lis"]
 	TABLE["Dec"] = [u"Déc", "Dez", "Gru"]
+
+	## TABLE with UTF-8 encoded names, for the lines which are not decoded.
+	TABLE_BYTES = dict()
+	for t in TABLE:
+		TABLE_BYTES[t] = [m.encode("utf-8") for m in TABLE[t]]
+	del t
+
+	MONTHS = dict(zip(("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug",
+					   "sep", "oct", "nov", "dec"), range(1, 13)))
+
+	## Local time at the start of (year, month, day, hour), see _localTime.
+	_LOCALTIMES = dict()
 	
 	def __init__(self):
 		DateTemplate.__init__(self)
 		self.__pattern = ""
+		## Fields available as named groups of the regex, see setRegex.
+		self.__fastFields = None
+	
+	##
+	# Sets the regular expression.
+	#
+	# If the regular expression provides the date fields as named groups
+	# (Y, m or b, d, H, M and S, named after the strptime directives), the
+	# time is computed from them directly instead of calling strptime.
+	# @param regex the regular expression
+	
+	def setRegex(self, regex):
+		DateTemplate.setRegex(self, regex)
+		fields = re.compile(regex).groupindex
+		if "d" in fields and "H" in fields and "M" in fields and "S" in fields \
+				and ("m" in fields or "b" in fields):
+			self.__fastFields = fields
+		else:
+			self.__fastFields = None
 	
 	def setPattern(self, pattern):
 		self.__pattern = pattern.strip()
@@ -119,8 +216,12 @@ class DateStrptime(DateTemplate):
 	
 	#@staticmethod
 	def convertLocale(date):
-		for t in DateStrptime.TABLE:
-			for m in DateStrptime.TABLE[t]:
+		if isinstance(date, unicode):
+			table = DateStrptime.TABLE
+		else:
+			table = DateStrptime.TABLE_BYTES
+		for t in table:
+			for m in table[t]:
 				if date.find(m) >= 0:
 					logSys.debug(u"Replacing %r with %r in %r" %
 								 (m, t, date))
@@ -128,9 +229,10 @@ class DateStrptime(DateTemplate):
 		return date
 	convertLocale = staticmethod(convertLocale)
 	
-	def getDate(self, line):
+	def getDate(self, line, dateMatch = None):
 		date = None
-		dateMatch = self.matchDate(line)
+		if dateMatch is None:
+			dateMatch = self.matchDate(line)
 		if dateMatch:
 			try:
 				# Try first with 'C' locale
@@ -163,6 +265,8 @@ class DateStrptime(DateTemplate):
 				# If the date is greater than the current time, we suppose
 				# that the log is not from this year but from the year before
 				if time.mktime(date) > MyTime.time():
+					# Becomes wrong once the time is reached.
+					self._cacheable = False
 					logSys.debug(
 						u"Correcting deduced year from %d to %d since %f > %f" %
 						(date[0], date[0]-1, time.mktime(date), MyTime.time()))
@@ -174,6 +278,72 @@ class DateStrptime(DateTemplate):
 					date[2] = MyTime.gmtime()[2]
 		return date
 
+	def _getUnixTime(self, line, dateMatch):
+		if self.__fastFields is not None:
+			unixTime = self.__getFastUnixTime(dateMatch)
+			if unixTime is not None:
+				return unixTime
+		return DateTemplate._getUnixTime(self, line, dateMatch)
+
+	##
+	# Computes the time from the named groups of the match.
+	#
+	# Returns None whenever the result could differ from the one of
+	# getDate() (invalid or unusual fields, year correction), so that the
+	# caller falls back to strptime.
+	# @param dateMatch the match object
+	# @return the time in seconds or None
+
+	def __getFastUnixTime(self, dateMatch):
+		group = dateMatch.group
+		if "b" in self.__fastFields:
+			month = DateStrptime.MONTHS.get(group("b").lower())
+			if month is None:
+				return None
+		else:
+			month = int(group("m"))
+			if month < 1 or month > 12:
+				return None
+		day = int(group("d"))
+		hour = int(group("H"))
+		minute = int(group("M"))
+		second = int(group("S"))
+		if hour > 23 or minute > 59 or second > 59:
+			return None
+		if "Y" in self.__fastFields:
+			year = int(group("Y"))
+			if year < 2000:
+				return None
+		else:
+			year = MyTime.gmtime()[0]
+		if day < 1 or day > calendar.monthrange(year, month)[1]:
+			return None
+		unixTime = DateStrptime._localTime(year, month, day, hour) \
+			+ minute * 60 + second
+		if not "Y" in self.__fastFields and (unixTime > MyTime.time() or
+											 (month == 1 and day == 1)):
+			# getDate() would correct the year or the day
+			return None
+		return unixTime
+
+	##
+	# Returns the local time at the start of the given hour.
+	#
+	# Results are memoized. The key includes the hour since daylight saving
+	# time changes within a day.
+
+	#@staticmethod
+	def _localTime(year, month, day, hour):
+		key = (year, month, day, hour)
+		try:
+			return DateStrptime._LOCALTIMES[key]
+		except KeyError:
+			if len(DateStrptime._LOCALTIMES) > 10000:
+				DateStrptime._LOCALTIMES.clear()
+			unixTime = time.mktime((year, month, day, hour, 0, 0, 0, 0, -1))
+			DateStrptime._LOCALTIMES[key] = unixTime
+			return unixTime
+	_localTime = staticmethod(_localTime)
 
 class DateTai64n(DateTemplate):
 	
@@ -182,9 +352,10 @@ class DateTai64n(DateTemplate):
 		# We already know the format for TAI64N
 		self.setRegex("@[0-9a-f]{24}")
 	
-	def getDate(self, line):
+	def getDate(self, line, dateMatch = None):
 		date = None
-		dateMatch = self.matchDate(line)
+		if dateMatch is None:
+			dateMatch = self.matchDate(line)
 		if dateMatch:
 			# extract part of format which represents seconds since epoch
 			value = dateMatch.group()
@@ -203,9 +374,10 @@ class DateISO8601(DateTemplate):
 		"(Z|(([-+])([0-9]{2}):([0-9]{2})))?"
 		self.setRegex(date_re)
 	
-	def getDate(self, line):
+	def getDate(self, line, dateMatch = None):
 		date = None
-		dateMatch = self.matchDate(line)
+		if dateMatch is None:
+			dateMatch = self.matchDate(line)
 		if dateMatch:
 			# Parses the date.
 			value = dateMatch.group()
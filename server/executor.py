@@ -0,0 +1,200 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: t -*-
+# vi: set ft=python sts=4 ts=4 sw=4 noet :
+
+# This file is part of Fail2Ban.
+#
+# Fail2Ban is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Fail2Ban is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Fail2Ban; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+__copyright__ = "Copyright (c) 2004 Cyril Jaquier"
+__license__ = "GPL"
+
+from threading import Thread, Condition
+from collections import deque
+import logging
+
+# Gets the instance of the logger.
+logSys = logging.getLogger("fail2ban.actions.executor")
+
+##
+# Action executor.
+#
+# Runs the commands of the actions of all the jails in a pool of worker
+# threads, so that a slow action does not delay the others. The commands
+# of an action start in the order they are submitted and at most
+# action.getConcurrency() of them run at once. A command bound to IP
+# addresses does not start while a command of the same action for one of
+# these addresses runs, and a command bound to no address, e.g. "start" or
+# "stop", runs alone. The worker threads are started with the first command, i.e.
+# after the server daemonized.
+
+class ActionExecutor:
+
+	def __init__(self, workers = 4):
+		self.__cond = Condition()
+		## The number of worker threads.
+		self.__workers = 0
+		## The number of worker threads running or waiting.
+		self.__threads = 0
+		## The pending commands indexed by action.
+		self.__queues = dict()
+		## The keys of the running commands indexed by action.
+		self.__running = dict()
+		## The actions with pending commands, in submission order.
+		self.__order = list()
+		self.setWorkers(workers)
+
+	##
+	# Set the number of worker threads.
+	#
+	# @param value the number of threads
+
+	def setWorkers(self, value):
+		if value < 1:
+			raise ValueError("At least one worker is needed")
+		try:
+			self.__cond.acquire()
+			self.__workers = value
+			if self.__threads:
+				self.__spawn()
+			# Superfluous workers exit when they wake up
+			self.__cond.notifyAll()
+		finally:
+			self.__cond.release()
+
+	def getWorkers(self):
+		return self.__workers
+
+	##
+	# Submit a command of an action.
+	#
+	# @param action the action
+	# @param function the function running the command
+	# @param args the arguments of the function
+	# @param key a tuple with the IP addresses of the command or None
+
+	def submit(self, action, function, args = (), key = None):
+		try:
+			self.__cond.acquire()
+			if not self.__queues.has_key(action):
+				self.__queues[action] = deque()
+				self.__running.setdefault(action, list())
+				self.__order.append(action)
+			self.__queues[action].append((function, args, key))
+			self.__spawn()
+			self.__cond.notifyAll()
+		finally:
+			self.__cond.release()
+
+	##
+	# Start the missing worker threads.
+	#
+	# Must be called with the lock held.
+
+	def __spawn(self):
+		while self.__threads < self.__workers:
+			self.__threads += 1
+			worker = Thread(target = self.__work)
+			worker.setDaemon(True)
+			worker.start()
+
+	##
+	# Wait until the submitted commands of an action are done.
+	#
+	# @param action the action
+
+	def wait(self, action):
+		try:
+			self.__cond.acquire()
+			while self.__queues.has_key(action) or self.__running.get(action):
+				self.__cond.wait()
+		finally:
+			self.__cond.release()
+
+	##
+	# Get the next command which may start.
+	#
+	# Must be called with the lock held.
+	# @return a tuple (action, function, args, key) or None
+
+	def __next(self):
+		for action in self.__order:
+			queue = self.__queues[action]
+			running = self.__running[action]
+			function, args, key = queue[0]
+			if len(running) >= max(1, action.getConcurrency()):
+				continue
+			if ActionExecutor.__conflicts(key, running):
+				continue
+			queue.popleft()
+			if not queue:
+				del self.__queues[action]
+				self.__order.remove(action)
+			else:
+				# Round robin between the actions
+				self.__order.remove(action)
+				self.__order.append(action)
+			running.append(key)
+			return action, function, args, key
+		return None
+
+	##
+	# Check whether a command must wait for the running ones.
+	#
+	# @param key the IP addresses of the command or None
+	# @param running the IP addresses of the running commands
+	# @return True if the command must wait
+
+	#@staticmethod
+	def __conflicts(key, running):
+		if key is None:
+			return len(running) > 0
+		for other in running:
+			if other is None:
+				return True
+			for ip in key:
+				if ip in other:
+					return True
+		return False
+	__conflicts = staticmethod(__conflicts)
+
+	def __work(self):
+		while True:
+			try:
+				self.__cond.acquire()
+				job = None
+				while self.__threads <= self.__workers:
+					job = self.__next()
+					if job is not None:
+						break
+					self.__cond.wait()
+				if job is None:
+					self.__threads -= 1
+					return
+			finally:
+				self.__cond.release()
+			action, function, args, key = job
+			try:
+				function(*args)
+			except Exception, e:
+				logSys.error("Action %s failed: %s" % (action.getName(), e))
+			try:
+				self.__cond.acquire()
+				running = self.__running[action]
+				running.remove(key)
+				if not running and not self.__queues.has_key(action):
+					del self.__running[action]
+				self.__cond.notifyAll()
+			finally:
+				self.__cond.release()
@@ -27,11 +27,10 @@ __date__ = "$Date$"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier"
 __license__ = "GPL"
 
-import commands
 from faildata import FailData
 from ticket import FailTicket
 from threading import Lock
-import logging
+import logging, heapq
 
 
 # Gets the instance of the logger.
@@ -42,16 +41,20 @@ class FailManager:
 	def __init__(self):
 		self.__lock = Lock()
 		self.__failList = dict()
+		## IP addresses whose retry count reached maxRetry.
+		self.__ready = set()
+		## Heap of (last time, ip, data) used by cleanup(). Each FailData has
+		## one entry. Its time is usually at most the current last time, but
+		## can be later when the log times arrive out of order, which only
+		## delays the removal by cleanup().
+		self.__expiry = list()
 		self.__maxRetry = 3
 		self.__maxTime = 600
 		self.__failTotal = 0
-		self.__mostIP = 0 # AD
-		self.__mostRetry = 0 # AD
-		self.__sumRetry = 0 # AD
-		self.__samplesRetry = 0 # AD
-		self.__lastRRDUpdateTime = 0 # AD
-		self.__updateTime = 59 # AD
-		self.__updateLastTimeStamp = 0 # AD
+		## Highest retry count and its IP address since the last call of
+		## sampleMostRetry(). Replaced as a whole so that it can be read
+		## without the lock.
+		self.__mostRetry = (0, None)
 	
 	def setFailTotal(self, value):
 		try:
@@ -71,6 +74,8 @@ class FailManager:
 		try:
 			self.__lock.acquire()
 			self.__maxRetry = value
+			self.__ready = set([ip for ip, data in self.__failList.iteritems()
+								if data.getRetry() >= value])
 		finally:
 			self.__lock.release()
 	
@@ -101,32 +106,6 @@ class FailManager:
 			ip = ticket.getIP()
 			unixTime = ticket.getTime()
 			matches = ticket.getMatches()
-			# AD START
-			if logSys.isEnabledFor(logging.INFO) or logSys.isEnabledFor(logging.DEBUG) :
-				# INIT & CLEAN UP
-				if self.__updateLastTimeStamp == 0:
-					self.__updateLastTimeStamp = unixTime
-				if self.__lastRRDUpdateTime == 0:
-					self.__lastRRDUpdateTime = unixTime
-				if self.__samplesRetry > 1000000:
-					self.__sumRetry = 0
-					self.__samplesRetry = 0 
-				# CHECK LAST UPDATE
-				diffRRDTime = unixTime - self.__lastRRDUpdateTime
-				if diffRRDTime > self.__updateTime:
-					# UPDATE IS LONG TIME AGO - RRDTOOL UPDATE
-					logSys.debug("diffRRDTime: %s" % diffRRDTime)
-					logSys.debug('/usr/bin/rrdtool update /var/www/fail2ban/fail2ban_ad.rrd N:%d' %(self.__mostRetry))
-					commands.getstatusoutput('/usr/bin/rrdtool update /var/www/fail2ban/fail2ban_ad.rrd N:%d' %(self.__mostRetry))
-					# RESET PARAMETER
-					self.__samplesRetry += (diffRRDTime%self.__updateTime)
-					self.__lastRRDUpdateTime = unixTime
-					if ( unixTime - self.__updateLastTimeStamp ) > ( self.__updateTime * 2 ):
-						self.__mostRetry = 0
-						self.__updateLastTimeStamp = unixTime
-				else:
-					self.__samplesRetry += 1
-			# AD STOP
 			if self.__failList.has_key(ip):
 				fData = self.__failList[ip]
 				if fData.getLastReset() < unixTime - self.__maxTime:
@@ -134,32 +113,36 @@ class FailManager:
 					fData.setRetry(0)
 				fData.inc(matches)
 				fData.setLastTime(unixTime)
-				# AD START
-				if logSys.isEnabledFor(logging.INFO) or logSys.isEnabledFor(logging.DEBUG) :
-					self.__sumRetry += fData.getRetry()
-					if fData.getRetry() > self.__mostRetry:
-						if self.__mostIP == ip:
-							self.__mostRetry = fData.getRetry()
-						else:
-							self.__mostRetry = fData.getRetry()
-							self.__mostIP = ip
-				# AD STOP
 			else:
 				fData = FailData()
 				fData.inc(matches)
 				fData.setLastReset(unixTime)
 				fData.setLastTime(unixTime)
 				self.__failList[ip] = fData
-				# AD START
-				if logSys.isEnabledFor(logging.INFO) or logSys.isEnabledFor(logging.DEBUG) :
-					self.__sumRetry += 1	
-				# AD STOP
+				heapq.heappush(self.__expiry, (unixTime, ip, fData))
+			if fData.getRetry() > self.__mostRetry[0]:
+				self.__mostRetry = (fData.getRetry(), ip)
+			if fData.getRetry() >= self.__maxRetry:
+				self.__ready.add(ip)
+			else:
+				self.__ready.discard(ip)
 			logSys.debug("Currently have failures from %d IPs: %s"
 						 % (len(self.__failList), self.__failList.keys()))
 			self.__failTotal += 1
 		finally:
 			self.__lock.release()
 	
+	##
+	# Get the highest retry count since the last call.
+	#
+	# Used by the metrics sampler. Does not take the lock.
+	# @return a tuple (retry, ip), ip is None if there was no failure
+	
+	def sampleMostRetry(self):
+		mostRetry = self.__mostRetry
+		self.__mostRetry = (0, None)
+		return mostRetry
+	
 	def size(self):
 		try:
 			self.__lock.acquire()
@@ -170,31 +153,58 @@ class FailManager:
 	def cleanup(self, time):
 		try:
 			self.__lock.acquire()
-			tmp = self.__failList.copy()
-			for item in tmp:
-				if tmp[item].getLastTime() < time - self.__maxTime:
-					self.__delFailure(item)
+			limit = time - self.__maxTime
+			expiry = self.__expiry
+			while expiry and expiry[0][0] < limit:
+				lastTime, ip, data = heapq.heappop(expiry)
+				if self.__failList.get(ip) is not data:
+					# Already banned or removed
+					continue
+				if data.getLastTime() < limit:
+					self.__delFailure(ip)
+				else:
+					# Seen again since, check it later
+					heapq.heappush(expiry, (data.getLastTime(), ip, data))
 		finally:
 			self.__lock.release()
 	
 	def __delFailure(self, ip):
 		if self.__failList.has_key(ip):
 			del self.__failList[ip]
+			self.__ready.discard(ip)
 	
 	def toBan(self):
 		try:
 			self.__lock.acquire()
-			for ip in self.__failList:
-				data = self.__failList[ip]
-				if data.getRetry() >= self.__maxRetry:
-					self.__delFailure(ip)
-					# Create a FailTicket from BanData
-					failTicket = FailTicket(ip, data.getLastTime(), data.getMatches())
-					failTicket.setAttempt(data.getRetry())
-					return failTicket
-			raise FailManagerEmpty
+			if not self.__ready:
+				raise FailManagerEmpty
+			return self.__popTicket(self.__ready.pop())
 		finally:
 			self.__lock.release()
+	
+	##
+	# Get the tickets of all the IP addresses to ban.
+	#
+	# Removes every IP address whose retry count reached maxRetry from the
+	# list in one pass.
+	# @return a list of FailTicket sorted by time, possibly empty
+	
+	def toBanBatch(self):
+		try:
+			self.__lock.acquire()
+			tickets = [self.__popTicket(ip) for ip in self.__ready]
+			self.__ready.clear()
+			tickets.sort(key = FailTicket.getTime)
+			return tickets
+		finally:
+			self.__lock.release()
+	
+	def __popTicket(self, ip):
+		data = self.__failList.pop(ip)
+		# Create a FailTicket from BanData
+		failTicket = FailTicket(ip, data.getLastTime(), data.getMatches())
+		failTicket.setAttempt(data.getRetry())
+		return failTicket
 
 class FailManagerEmpty(Exception):
 	pass
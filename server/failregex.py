@@ -27,7 +27,7 @@ __date__ = "$Date$"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier"
 __license__ = "GPL"
 
-import re, sre_constants
+import re, sre_constants, sre_parse
 
 ##
 # Regular expression class.
@@ -45,6 +45,8 @@ class Regex:
 	
 	def __init__(self, regex):
 		self._matchCache = None
+		## Prefix of the named groups in the cached match (see RegexSet).
+		self._groupPrefix = ""
 		# Perform shortcuts expansions.
 		# Replace "<HOST>" with default regular expression for host.
 		regex = regex.replace("<HOST>", "(?:::f{4,6}:)?(?P<host>[\w\-.^_]+)")
@@ -56,6 +58,12 @@ class Regex:
 		except sre_constants.error:
 			raise RegexException("Unable to compile regular expression '%s'" %
 								 regex)
+		## The longest literal string every match contains (or "").
+		self._literal = ""
+		if not self._regexObj.flags & re.IGNORECASE:
+			for literal in Regex._findLiterals(sre_parse.parse(regex).data):
+				if len(literal) > len(self._literal):
+					self._literal = literal
 	
 	##
 	# Gets the regular expression.
@@ -66,6 +74,49 @@ class Regex:
 	def getRegex(self):
 		return self._regex
 	
+	##
+	# Gets the literal string required by the regular expression.
+	#
+	# A line not containing this string cannot match. An empty string is
+	# returned if no such literal could be found.
+	# @return the literal string
+	
+	def getLiteral(self):
+		return self._literal
+	
+	##
+	# Collects the runs of literal characters which every match contains.
+	#
+	# Only parts which cannot be skipped (i.e. not in alternations or in
+	# optional repeats) are considered. The literals are ASCII, so that they
+	# can be looked up in decoded lines as well.
+	# @param items the parsed regular expression (see sre_parse)
+	# @return a list of strings
+	
+	#@staticmethod
+	def _findLiterals(items):
+		literals = list()
+		run = list()
+		for op, av in items:
+			if op == sre_constants.LITERAL and av < 128:
+				run.append(chr(av))
+				continue
+			if op == sre_constants.AT:
+				# Zero-width, the surrounding characters stay adjacent.
+				continue
+			if run:
+				literals.append("".join(run))
+				run = list()
+			if op == sre_constants.SUBPATTERN:
+				literals.extend(Regex._findLiterals(av[-1]))
+			elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) \
+					and av[0] > 0:
+				literals.extend(Regex._findLiterals(av[2]))
+		if run:
+			literals.append("".join(run))
+		return literals
+	_findLiterals = staticmethod(_findLiterals)
+	
 	##
 	# Searches the regular expression.
 	#
@@ -76,6 +127,7 @@ class Regex:
 	
 	def search(self, value):
 		self._matchCache = self._regexObj.search(value)
+		self._groupPrefix = ""
 	
 	##
 	# Checks if the previous call to search() matched.
@@ -124,10 +176,226 @@ class FailRegex(Regex):
 	# @return the matched host
 	
 	def getHost(self):
-		host = self._matchCache.group("host")
+		host = self._matchCache.group(self._groupPrefix + "host")
 		if host == None:
 			# Gets a few information.
 			s = self._matchCache.string
 			r = self._matchCache.re
 			raise RegexException("No 'host' found in '%s' using '%s'" % (s, r))
 		return host
+
+
+##
+# Set of regular expressions searched in a single pass.
+#
+# The regular expressions are combined into one alternation. Every member is
+# wrapped into its own group and its named groups get prefixed with the
+# member index, so one search tells which member matched and provides its
+# groups (e.g. "host") at the same time. Members which cannot be combined
+# safely (numbered backreferences, conditional groups or different flags)
+# make the set fall back to searching the members one after another.
+#
+# Before any of this, the literal strings required by the members (see
+# Regex.getLiteral()) are looked up in the line. Members whose literal is
+# missing cannot match and are not searched at all.
+
+class RegexSet:
+
+	# Named group definitions and references: (?P<name>...) and (?P=name)
+	_GROUP_CRE = re.compile(r"(?<!\\)\(\?P([<=])(\w+)")
+	# Constructs depending on the group numbering
+	_UNSAFE_CRE = re.compile(r"\\[1-9]|\(\?\(")
+
+	##
+	# Constructor.
+	#
+	# @param regexList the list of Regex objects, in order of precedence
+
+	def __init__(self, regexList):
+		self.__regexList = list(regexList)
+		self.__regexObj = None
+		## Maps the index of the wrapping group to the member index.
+		self.__members = dict()
+		self.__prefixes = list()
+		## Literal prefilter: (literal, member indexes) and members without.
+		self.__literals = list()
+		self.__always = list()
+		self.__buildLiteralIndex()
+		if len(self.__regexList) > 1:
+			self.__combine()
+
+	def __buildLiteralIndex(self):
+		literals = dict()
+		for index, regex in enumerate(self.__regexList):
+			literal = regex.getLiteral()
+			if literal:
+				literals.setdefault(literal, list()).append(index)
+			else:
+				self.__always.append(index)
+		self.__literals = literals.items()
+
+	def __combine(self):
+		flags = None
+		values = list()
+		for regex in self.__regexList:
+			value = regex.getRegex()
+			if RegexSet._UNSAFE_CRE.search(value):
+				return
+			# Inline flags apply to the whole expression, so all members
+			# have to agree on them.
+			if flags is None:
+				flags = regex._regexObj.flags
+			elif flags != regex._regexObj.flags:
+				return
+			values.append(value)
+		prefix = RegexSet._commonPrefix(values, flags)
+		parts = list()
+		members = dict()
+		groupIndex = 1
+		for index, regex in enumerate(self.__regexList):
+			value = values[index][len(prefix):]
+			name = "f2b%d_" % index
+			value = RegexSet._GROUP_CRE.sub(
+				lambda m: "(?P%s%s%s" % (m.group(1), name, m.group(2)), value)
+			parts.append("(%s)" % value)
+			members[groupIndex] = index
+			groupIndex += regex._regexObj.groups + 1
+		try:
+			regexObj = re.compile("%s(?:%s)" % (prefix, "|".join(parts)), flags)
+		except sre_constants.error:
+			return
+		if regexObj.groups != groupIndex - 1:
+			return
+		self.__regexObj = regexObj
+		self.__members = members
+		self.__prefixes = ["f2b%d_" % i for i in xrange(len(self.__regexList))]
+
+	##
+	# Returns the longest leading part common to all the expressions.
+	#
+	# Expressions often start the same way (e.g. with __prefix_line), which
+	# would otherwise be matched once per member. The prefix is only factored
+	# out if it parses into exactly the leading items of every expression
+	# and does not contain any group.
+	# @param values the regular expressions
+	# @param flags the compilation flags
+	# @return the common prefix, possibly empty
+
+	#@staticmethod
+	def _commonPrefix(values, flags):
+		size = min([len(v) for v in values])
+		for v in values[1:]:
+			i = 0
+			while i < size and v[i] == values[0][i]:
+				i += 1
+			size = i
+		try:
+			parsed = [repr(sre_parse.parse(v, flags).data) for v in values]
+		except sre_constants.error:
+			return ""
+		while size > 0:
+			prefix = values[0][:size]
+			try:
+				items = sre_parse.parse(prefix, flags).data
+				if items and re.compile(prefix, flags).groups == 0:
+					head = repr(items)[:-1]
+					for p in parsed:
+						if not p.startswith(head) or p[len(head)] not in ",]":
+							break
+					else:
+						return prefix
+			except sre_constants.error:
+				pass
+			size -= 1
+		return ""
+	_commonPrefix = staticmethod(_commonPrefix)
+
+	##
+	# Tells whether the members are searched in a single pass.
+	#
+	# @return True if the members could be combined
+
+	def isCombined(self):
+		return self.__regexObj is not None
+
+	def __len__(self):
+		return len(self.__regexList)
+
+	def __getitem__(self, index):
+		return self.__regexList[index]
+
+	##
+	# Searches the first member matching the value.
+	#
+	# Members are considered in the order they were given. The match of the
+	# returned member is cached in it, so hasMatched() and getHost() can be
+	# used as after a call to its own search().
+	# @param value the line
+	# @param start index of the first member to consider
+	# @return the index of the matching member or -1
+
+	def search(self, value, start=0):
+		regexList = self.__regexList
+		end = len(regexList)
+		if self.__literals:
+			candidates = self.__candidates(value)
+			if len(candidates) < end:
+				for index in candidates:
+					if index >= start:
+						regex = regexList[index]
+						regex.search(value)
+						if regex.hasMatched():
+							return index
+				return -1
+		found = -1
+		if start == 0 and self.__regexObj is not None:
+			match = self.__regexObj.search(value)
+			if match is None:
+				return -1
+			found = end = self.__members[match.lastindex]
+			regex = regexList[found]
+			regex._matchCache = match
+			regex._groupPrefix = self.__prefixes[found]
+		# Members preceding the found one might still match further in the
+		# line, in which case they take precedence.
+		for index in xrange(start, end):
+			regex = regexList[index]
+			regex.search(value)
+			if regex.hasMatched():
+				return index
+		return found
+
+	##
+	# Checks whether a member might match the value.
+	#
+	# Only uses the literal prefilter, so it is cheap. Since a literal in a
+	# part of the value is also in the value, the whole line can be checked
+	# before removing the date from it.
+	# @param value the line or a string containing it
+	# @return False if no member can match
+
+	def mayMatch(self, value):
+		if self.__always:
+			return True
+		for literal, indexes in self.__literals:
+			if literal in value:
+				return True
+		return False
+
+	##
+	# Returns the members which might match the value.
+	#
+	# @param value the line
+	# @return the sorted list of member indexes
+
+	def __candidates(self, value):
+		candidates = None
+		for literal, indexes in self.__literals:
+			if literal in value:
+				if candidates is None:
+					candidates = list(self.__always)
+				candidates.extend(indexes)
+		if candidates is None:
+			return self.__always
+		candidates.sort()
+		return candidates
@@ -32,9 +32,11 @@ from ticket import FailTicket
 from jailthread import JailThread
 from datedetector import DateDetector
 from mytime import MyTime
-from failregex import FailRegex, Regex, RegexException
+from failregex import FailRegex, Regex, RegexSet, RegexException
 
-import logging, re, os, fcntl, time
+import logging, re, os, fcntl, time, glob
+from cStringIO import StringIO
+from threading import Lock
 
 # Gets the instance of the logger.
 logSys = logging.getLogger("fail2ban.filter")
@@ -60,16 +62,24 @@ class Filter(JailThread):
 		self.jail = jail
 		## The failures manager.
 		self.failManager = FailManager()
+		## Lock of the regular expressions and ignore list, which are used
+		## by the thread reading a shared log.
+		self.__lock = Lock()
 		## The regular expression list matching the failures.
 		self.__failRegex = list()
 		## The regular expression list with expressions to ignore.
 		self.__ignoreRegex = list()
+		## The regular expression sets, built on demand from the lists above.
+		self.__failRegexSet = None
+		self.__ignoreRegexSet = None
 		## Use DNS setting
 		self.setUseDns(useDns)
 		## The amount of time to look back.
 		self.__findTime = 6000
 		## The ignore IP list.
-		self.__ignoreIpList = []
+		self.__ignoreIpList = IPRangeIndex()
+		## True if the lines are matched as read, without decoding.
+		self.__byteLines = False
 
 		self.dateDetector = DateDetector()
 		self.dateDetector.addDefaultTemplate()
@@ -89,17 +99,28 @@ class Filter(JailThread):
 	def addFailRegex(self, value):
 		try:
 			regex = FailRegex(value)
-			self.__failRegex.append(regex)
 		except RegexException, e:
 			logSys.error(e)
+			return
+		try:
+			self.__lock.acquire()
+			self.__failRegex.append(regex)
+			self.__failRegexSet = None
+		finally:
+			self.__lock.release()
 
 
 	def delFailRegex(self, index):
 		try:
-			del self.__failRegex[index]
-		except IndexError:
-			logSys.error("Cannot remove regular expression. Index %d is not "
-						 "valid" % index)
+			self.__lock.acquire()
+			try:
+				del self.__failRegex[index]
+				self.__failRegexSet = None
+			except IndexError:
+				logSys.error("Cannot remove regular expression. Index %d is "
+							 "not valid" % index)
+		finally:
+			self.__lock.release()
 
 	##
 	# Get the regular expression which matches the failure.
@@ -122,16 +143,27 @@ class Filter(JailThread):
 	def addIgnoreRegex(self, value):
 		try:
 			regex = Regex(value)
-			self.__ignoreRegex.append(regex)
 		except RegexException, e:
 			logSys.error(e)
+			return
+		try:
+			self.__lock.acquire()
+			self.__ignoreRegex.append(regex)
+			self.__ignoreRegexSet = None
+		finally:
+			self.__lock.release()
 
 	def delIgnoreRegex(self, index):
 		try:
-			del self.__ignoreRegex[index]
-		except IndexError:
-			logSys.error("Cannot remove regular expression. Index %d is not "
-						 "valid" % index)
+			self.__lock.acquire()
+			try:
+				del self.__ignoreRegex[index]
+				self.__ignoreRegexSet = None
+			except IndexError:
+				logSys.error("Cannot remove regular expression. Index %d is "
+							 "not valid" % index)
+		finally:
+			self.__lock.release()
 
 	##
 	# Get the regular expression which matches the failure.
@@ -166,6 +198,50 @@ class Filter(JailThread):
 	def getUseDns(self):
 		return self.__useDns
 
+	##
+	# Set the byte lines mode.
+	#
+	# By default the lines are decoded from UTF-8 before they are matched.
+	# In byte lines mode they are matched as read, which is faster, but the
+	# failregex must then match the encoded lines. The date detector is
+	# replaced with one whose templates match UTF-8 encoded month names.
+	# @param value True to match the lines as read
+
+	def setByteLines(self, value):
+		dateDetector = DateDetector(value)
+		dateDetector.addDefaultTemplate()
+		self.dateDetector = dateDetector
+		self.__byteLines = value
+		logSys.debug("Setting bytelines = %s for %s" % (value, self))
+
+	def getByteLines(self):
+		return self.__byteLines
+
+	##
+	# Decode a line from UTF-8.
+	#
+	# @param line the line as read
+	# @return the decoded line, or the line itself if it is not UTF-8
+
+	#@staticmethod
+	def decodeLine(line):
+		try:
+			return line.decode('utf-8')
+		except UnicodeError:
+			return line
+	decodeLine = staticmethod(decodeLine)
+
+	##
+	# Get the time of a line as read from the log file.
+	#
+	# @param line the line as read
+	# @return the time in seconds or None
+
+	def getLineTime(self, line):
+		if not self.__byteLines:
+			line = Filter.decodeLine(line)
+		return self.dateDetector.getUnixTime(line)
+
 	##
 	# Set the time needed to find a failure.
 	#
@@ -235,14 +311,22 @@ class Filter(JailThread):
 
 	def addIgnoreIP(self, ip):
 		logSys.debug("Add " + ip + " to ignore list")
-		self.__ignoreIpList.append(ip)
+		try:
+			self.__lock.acquire()
+			self.__ignoreIpList.add(ip)
+		finally:
+			self.__lock.release()
 
 	def delIgnoreIP(self, ip):
 		logSys.debug("Remove " + ip + " from ignore list")
-		self.__ignoreIpList.remove(ip)
+		try:
+			self.__lock.acquire()
+			self.__ignoreIpList.remove(ip)
+		finally:
+			self.__lock.release()
 
 	def getIgnoreIP(self):
-		return self.__ignoreIpList
+		return self.__ignoreIpList.getEntries()
 
 	##
 	# Check if IP address/DNS is in the ignore list.
@@ -253,55 +337,74 @@ class Filter(JailThread):
 	# @return True if IP address is in ignore list
 
 	def inIgnoreIPList(self, ip):
-		for i in self.__ignoreIpList:
-			# An empty string is always false
-			if i == "":
-				continue
-			s = i.split('/', 1)
-			# IP address without CIDR mask
-			if len(s) == 1:
-				s.insert(1, '32')
-			s[1] = long(s[1])
-			try:
-				a = DNSUtils.cidr(s[0], s[1])
-				b = DNSUtils.cidr(ip, s[1])
-			except Exception:
-				# Check if IP in DNS
-				ips = DNSUtils.dnsToIp(i)
-				if ip in ips:
-					return True
-				else:
-					continue
-			if a == b:
-				return True
-		return False
+		return ip in self.__ignoreIpList
 
 
 	def processLine(self, line):
 		"""Split the time portion from log msg and return findFailures on them
 		"""
+		if not self.__byteLines:
+			line = Filter.decodeLine(line)
+		return self.processDatedLine(line, self.dateDetector.matchTime(line),
+									 self.dateDetector)
+
+	##
+	# Processes a line whose date was already searched.
+	#
+	# @param line the line, decoded unless in byte lines mode
+	# @param timeMatch the result of dateDetector.matchTime(line)
+	# @param dateDetector the DateDetector which searched the date
+	# @return a list of [IP address, time]
+
+	def processDatedLine(self, line, timeMatch, dateDetector):
 		try:
-			# Decode line to UTF-8
-			l = line.decode('utf-8')
-		except UnicodeDecodeError:
-			l = line
-		timeMatch = self.dateDetector.matchTime(l)
+			self.__lock.acquire()
+			return self.__processDatedLine(line, timeMatch, dateDetector)
+		finally:
+			self.__lock.release()
+
+	def __processDatedLine(self, line, timeMatch, dateDetector):
 		if timeMatch:
 			# Lets split into time part and log part of the line
 			timeLine = timeMatch.group()
-			# Lets leave the beginning in as well, so if there is no
-			# anchore at the beginning of the time regexp, we don't
-			# at least allow injection. Should be harmless otherwise
-			logLine  = l[:timeMatch.start()] + l[timeMatch.end():]
+			if timeMatch.start() == 0:
+				# Most lines do not contain the literals required by the
+				# failregex, which the whole line tells without a copy.
+				if not self.__getFailRegexSet().mayMatch(line):
+					return []
+				logLine = line[timeMatch.end():]
+			else:
+				# Lets leave the beginning in as well, so if there is no
+				# anchore at the beginning of the time regexp, we don't
+				# at least allow injection. Should be harmless otherwise
+				logLine = line[:timeMatch.start()] + line[timeMatch.end():]
 		else:
-			timeLine = l
-			logLine = l
-		return self.findFailure(timeLine, logLine)
+			timeLine = line
+			logLine = line
+		return self.findFailure(timeLine, logLine, timeMatch, dateDetector)
 
 	def processLineAndAdd(self, line):
 		"""Processes the line for failures and populates failManager
 		"""
-		for element in self.processLine(line):
+		self.addFailures(self.processLine(line), line)
+
+	##
+	# Adds the failures found in a line to the FailManager.
+	#
+	# Failures older than findtime or from an ignored IP address are
+	# dropped.
+	# @param failList the list of [IP address, time] found in the line
+	# @param line the line
+
+	def addFailures(self, failList, line):
+		try:
+			self.__lock.acquire()
+			self.__addFailures(failList, line)
+		finally:
+			self.__lock.release()
+
+	def __addFailures(self, failList, line):
+		for element in failList:
 			ip = element[0]
 			unixTime = element[1]
 			logSys.debug("Processing line with time:%s and ip:%s"
@@ -316,6 +419,12 @@ class Filter(JailThread):
 			logSys.debug("Found %s" % ip)
 			self.failManager.addFailure(FailTicket(ip, unixTime, [line]))
 
+	def __getFailRegexSet(self):
+		failRegexSet = self.__failRegexSet
+		if failRegexSet is None:
+			failRegexSet = self.__failRegexSet = RegexSet(self.__failRegex)
+		return failRegexSet
+
 	##
 	# Returns true if the line should be ignored.
 	#
@@ -324,48 +433,54 @@ class Filter(JailThread):
 	# @return: a boolean
 
 	def ignoreLine(self, line):
-		for ignoreRegex in self.__ignoreRegex:
-			ignoreRegex.search(line)
-			if ignoreRegex.hasMatched():
-				return True
-		return False
+		ignoreRegexSet = self.__ignoreRegexSet
+		if ignoreRegexSet is None:
+			ignoreRegexSet = self.__ignoreRegexSet = RegexSet(self.__ignoreRegex)
+		return ignoreRegexSet.search(line) >= 0
 
 	##
 	# Finds the failure in a line given split into time and log parts.
 	#
 	# Uses the failregex pattern to find it and timeregex in order
 	# to find the logging time.
+	# @param timeMatch the date match found by processLine (optional)
+	# @param dateDetector the DateDetector which found timeMatch (optional)
 	# @return a dict with IP and timestamp.
 
-	def findFailure(self, timeLine, logLine):
+	def findFailure(self, timeLine, logLine, timeMatch = None,
+					dateDetector = None):
+		if dateDetector is None:
+			dateDetector = self.dateDetector
 		failList = list()
 		# Checks if we must ignore this line.
 		if self.ignoreLine(logLine):
 			# The ignoreregex matched. Return.
 			return failList
-		# Iterates over all the regular expressions.
-		for failRegex in self.__failRegex:
-			failRegex.search(logLine)
-			if failRegex.hasMatched():
-				# The failregex matched.
-				date = self.dateDetector.getUnixTime(timeLine)
-				if date == None:
-					logSys.debug("Found a match for %r but no valid date/time "
-								 "found for %r. Please file a detailed issue on"
-								 " https://github.com/fail2ban/fail2ban/issues "
-								 "in order to get support for this format."
-								 % (logLine, timeLine))
-				else:
-					try:
-						host = failRegex.getHost()
-						ipMatch = DNSUtils.textToIp(host, self.__useDns)
-						if ipMatch:
-							for ip in ipMatch:
-								failList.append([ip, date])
-							# We matched a regex, it is enough to stop.
-							break
-					except RegexException, e:
-						logSys.error(e)
+		failRegexSet = self.__getFailRegexSet()
+		# Iterates over the matching regular expressions, in order.
+		index = failRegexSet.search(logLine)
+		while index >= 0:
+			failRegex = failRegexSet[index]
+			# The failregex matched.
+			date = dateDetector.getUnixTime(timeLine, timeMatch)
+			if date == None:
+				logSys.debug("Found a match for %r but no valid date/time "
+							 "found for %r. Please file a detailed issue on"
+							 " https://github.com/fail2ban/fail2ban/issues "
+							 "in order to get support for this format."
+							 % (logLine, timeLine))
+			else:
+				try:
+					host = failRegex.getHost()
+					ipMatch = DNSUtils.textToIp(host, self.__useDns)
+					if ipMatch:
+						for ip in ipMatch:
+							failList.append([ip, date])
+						# We matched a regex, it is enough to stop.
+						break
+				except RegexException, e:
+					logSys.error(e)
+			index = failRegexSet.search(logLine, index + 1)
 		return failList
 
 
@@ -384,10 +499,43 @@ class Filter(JailThread):
 
 class FileFilter(Filter):
 
+	## Maximal number of log files added by the glob patterns.
+	MAX_GLOB_FILES = 512
+
 	def __init__(self, jail, **kwargs):
 		Filter.__init__(self, jail, **kwargs)
 		## The log file path.
 		self.__logPath = []
+		## The paths added by each glob pattern.
+		self.__logGlobs = dict()
+		## The directories watched for the glob patterns.
+		self.__globDirs = list()
+		## Lock of the glob patterns, which are changed by the transmitter
+		## and refreshed by the filter thread.
+		self.__globLock = Lock()
+		## The persistent file cursors or None.
+		self.__cursors = None
+		## The LogHub sharing the log files with other filters or None.
+		self.__logHub = None
+
+	##
+	# Set the persistent file cursors.
+	#
+	# The log files added afterwards continue from their saved position.
+	# @param cursors a FileCursors object or None
+
+	def setCursors(self, cursors):
+		self.__cursors = cursors
+
+	##
+	# Set the log hub.
+	#
+	# The log files added afterwards are read through the hub, together
+	# with the other filters watching them.
+	# @param logHub a LogHub object or None
+
+	def setLogHub(self, logHub):
+		self.__logHub = logHub
 
 	##
 	# Add a log file path
@@ -395,9 +543,22 @@ class FileFilter(Filter):
 	# @param path log file path
 
 	def addLogPath(self, path, tail = False):
-		container = FileContainer(path, tail)
+		if self.__logHub is not None:
+			container = self.__logHub.subscribe(self, path, tail)
+		else:
+			container = FileContainer(path, tail)
+		if self.__cursors is not None:
+			cursor = self.__cursors.get(self.__getJailName(), path)
+			if cursor is not None and container.setCursor(cursor):
+				logSys.info("Continue reading %s from position %d"
+							% (path, cursor[2]))
 		self.__logPath.append(container)
 
+	def __getJailName(self):
+		if self.jail is None:
+			return None
+		return self.jail.getName()
+
 	##
 	# Delete a log path
 	#
@@ -407,8 +568,175 @@ class FileFilter(Filter):
 		for log in self.__logPath:
 			if log.getFileName() == path:
 				self.__logPath.remove(log)
+				if self.__logHub is not None:
+					self.__logHub.unsubscribe(self, path)
+				else:
+					log.release()
 				return
 
+	##
+	# Add a glob pattern of log files.
+	#
+	# The matching files are added now and whenever they appear, until
+	# MAX_GLOB_FILES files are monitored through patterns. The files are
+	# removed when they disappear.
+	# @param pattern the glob pattern
+
+	def addLogGlob(self, pattern):
+		try:
+			self.__globLock.acquire()
+			if self.__logGlobs.has_key(pattern):
+				logSys.error(pattern + " already exists")
+				return
+			self.__logGlobs[pattern] = list()
+			logSys.info("Added log pattern = %s" % pattern)
+			self.__refreshLogGlobs()
+		finally:
+			self.__globLock.release()
+
+	##
+	# Delete a glob pattern of log files.
+	#
+	# The files added by the pattern are removed.
+	# @param pattern the glob pattern
+
+	def delLogGlob(self, pattern):
+		try:
+			self.__globLock.acquire()
+			if not self.__logGlobs.has_key(pattern):
+				logSys.error(pattern + " is not monitored")
+				return
+			paths = self.__logGlobs.pop(pattern)
+			for path in paths:
+				if not self.__isGlobbed(path):
+					self.delLogPath(path)
+			logSys.info("Removed log pattern = %s" % pattern)
+			self.__watchGlobDirs()
+		finally:
+			self.__globLock.release()
+
+	def getLogGlob(self):
+		try:
+			self.__globLock.acquire()
+			return self.__logGlobs.keys()
+		finally:
+			self.__globLock.release()
+
+	##
+	# Check whether a directory is watched for the glob patterns.
+	#
+	# @param path the directory
+	# @return True if a file may appear or disappear in it
+
+	def isLogGlobDir(self, path):
+		try:
+			self.__globLock.acquire()
+			return path in self.__globDirs
+		finally:
+			self.__globLock.release()
+
+	##
+	# Add the new files matching the glob patterns and remove the ones
+	# which do not exist any more.
+	#
+	# Called by the backends when a watched directory changes.
+
+	def refreshLogGlobs(self):
+		try:
+			self.__globLock.acquire()
+			self.__refreshLogGlobs()
+		finally:
+			self.__globLock.release()
+
+	def __refreshLogGlobs(self):
+		count = 0
+		for paths in self.__logGlobs.values():
+			count += len(paths)
+		for pattern, paths in self.__logGlobs.items():
+			matches = glob.glob(pattern)
+			matches.sort()
+			for path in paths[:]:
+				if not path in matches:
+					paths.remove(path)
+					count -= 1
+					if not self.__isGlobbed(path):
+						logSys.info("%s does not exist any more" % path)
+						self.__drainLogPath(path)
+						self.delLogPath(path)
+			for path in matches:
+				if path in paths:
+					continue
+				if self.__isGlobbed(path):
+					# Added by another pattern
+					paths.append(path)
+				elif self.containsLogPath(path):
+					# Added explicitly, not removed with the pattern
+					continue
+				elif count >= self.MAX_GLOB_FILES:
+					logSys.warn("Too many files match the log patterns, "
+								"%s is not monitored" % path)
+				else:
+					self.addLogPath(path)
+					if self.containsLogPath(path):
+						paths.append(path)
+						count += 1
+		self.__watchGlobDirs()
+
+	##
+	# Reads the lines written to a log file before it was moved away.
+	#
+	# The open descriptor still points to the moved file, e.g. on log
+	# rotation, so the end of the file is not lost when it is removed.
+	# @param path the log file
+
+	def __drainLogPath(self, path):
+		container = self.getFileContainer(path)
+		if container is not None and container.isOpen():
+			self.getFailures(path)
+
+	def __isGlobbed(self, path):
+		for paths in self.__logGlobs.values():
+			if path in paths:
+				return True
+		return False
+
+	##
+	# Update the directories watched for the glob patterns.
+	#
+	# Called with the lock of the glob patterns held.
+
+	def __watchGlobDirs(self):
+		dirs = list()
+		for pattern in self.__logGlobs.keys():
+			dirname = os.path.dirname(pattern) or os.curdir
+			if glob.has_magic(dirname):
+				candidates = glob.glob(dirname)
+			else:
+				candidates = [dirname]
+			for d in candidates:
+				if not d in dirs:
+					dirs.append(d)
+		for d in self.__globDirs[:]:
+			if not d in dirs:
+				self.__globDirs.remove(d)
+				self._delDirWatch(d)
+		for d in dirs:
+			if not d in self.__globDirs:
+				self.__globDirs.append(d)
+				self._addDirWatch(d)
+
+	##
+	# Watch a directory for new or removed files.
+	#
+	# The backend calls refreshLogGlobs() when the directory changes.
+	# @param path the directory
+
+	def _addDirWatch(self, path):
+		pass
+
+	def _delDirWatch(self, path):
+		pass
+
 	##
 	# Get the log file path
 	#
@@ -447,25 +775,38 @@ class FileFilter(Filter):
 		if container == None:
 			logSys.error("Unable to get failures in " + filename)
 			return False
-		# Try to open log file.
-		try:
-			container.open()
-		except Exception, e:
-			logSys.error("Unable to open %s" % filename)
-			logSys.exception(e)
-			return False
-
-		line = container.readline()
-		while not line == "":
-			if not self._isActive():
-				# The jail has been stopped
-				break
-			self.processLineAndAdd(line)
-			# Read a new line.
-			line = container.readline()
-		container.close()
+		if self.__logHub is not None:
+			if not container.read(self):
+				return False
+		else:
+			# Try to open log file.
+			try:
+				container.open()
+			except Exception, e:
+				logSys.error("Unable to open %s" % filename)
+				logSys.exception(e)
+				return False
+			self.__readFailures(container)
+		if self.__cursors is not None:
+			self.__cursors.update(self.__getJailName(), filename,
+								  container.getCursor())
 		return True
 
+	def __readFailures(self, container):
+		try:
+			# Skips the lines older than findtime when reading from the start
+			if container.getPos() == 0:
+				container.seekTime(MyTime.time() - self.getFindTime(),
+								   self.getLineTime)
+			for lines in container.readlines():
+				if not self._isActive():
+					# The jail has been stopped
+					break
+				for line in lines:
+					self.processLineAndAdd(line)
+		finally:
+			container.close()
+
 	def status(self):
 		ret = Filter.status(self)
 		path = [m.getFileName() for m in self.getLogPath()]
@@ -490,10 +831,15 @@ except ImportError:
 
 class FileContainer:
 
+	## Number of bytes read at once by readlines().
+	BLOCK_SIZE = 1 << 20
+
 	def __init__(self, filename, tail = False):
 		self.__filename = filename
 		self.__tail = tail
 		self.__handler = None
+		## The new file, opened while the rotated one is read to its end.
+		self.__next = None
 		# Try to open the file. Raises an exception if an error occured.
 		handler = open(filename)
 		stats = os.fstat(handler.fileno())
@@ -514,37 +860,419 @@ class FileContainer:
 	def getFileName(self):
 		return self.__filename
 
+	##
+	# Get the cursor of the file.
+	#
+	# @return a tuple (inode, hash of the first line, position)
+
+	def getCursor(self):
+		return (self.__ino, self.__hash, self.__pos)
+
+	def getPos(self):
+		return self.__pos
+
+	##
+	# Check whether the descriptor is kept open.
+	#
+	# @return True if the file was read and not released since
+
+	def isOpen(self):
+		return self.__handler != None
+
+	##
+	# Continue from a cursor returned by getCursor().
+	#
+	# The cursor is only used if the file was not rotated since, i.e. if
+	# the inode and the hash of the first line are the same and the file
+	# is not shorter than the position.
+	# @param cursor the cursor
+	# @return True if the cursor is used
+
+	def setCursor(self, cursor):
+		ino, myHash, pos = cursor
+		if ino != self.__ino or myHash != self.__hash \
+				or pos > os.path.getsize(self.__filename):
+			return False
+		self.__pos = pos
+		return True
+
+	##
+	# Opens the file for reading from the position.
+	#
+	# The descriptor is kept open between two reads. If it is still open,
+	# the file is checked again when the path does not point to the open
+	# inode anymore, when the file is shorter than the position or when the
+	# hash of its first line changed. A file which was moved away is read
+	# to its end through the open descriptor before readlines() continues
+	# with the new file. A file which is shorter or starts with another
+	# line was truncated (copytruncate), possibly written again past the
+	# position since, and is read from the start.
+
 	def open(self):
-		self.__handler = open(self.__filename)
-		# Set the file descriptor to be FD_CLOEXEC
-		fd = self.__handler.fileno()
-		fcntl.fcntl(fd, fcntl.F_SETFD, fd | fcntl.FD_CLOEXEC)
-		firstLine = self.__handler.readline()
-		# Computes the MD5 of the first line.
-		myHash = md5sum(firstLine).digest()
-		stats = os.fstat(self.__handler.fileno())
+		if self.__handler != None:
+			fstats = os.fstat(self.__handler.fileno())
+			try:
+				stats = os.stat(self.__filename)
+			except OSError:
+				# Moved away and not created again yet, read to its end
+				self.__handler.seek(self.__pos)
+				return
+			if stats.st_ino != fstats.st_ino or stats.st_dev != fstats.st_dev:
+				logSys.info("Log rotation detected for %s" % self.__filename)
+				if self.__next != None:
+					self.__next[0].close()
+				self.__next = self.__openFile()
+			elif fstats.st_size < self.__pos or (self.__pos and
+					self.__firstLineHash() != self.__hash):
+				logSys.info("Log truncation detected for %s" % self.__filename)
+				# Reopens, the buffered data is not valid anymore
+				self.__handler.close()
+				self.__handler, self.__ino, self.__hash = self.__openFile()
+				self.__pos = 0
+			# Sets the file pointer to the last position.
+			self.__handler.seek(self.__pos)
+			return
+		self.__handler, ino, myHash = self.__openFile()
 		# Compare hash and inode
-		if self.__hash != myHash or self.__ino != stats.st_ino:
+		if self.__hash != myHash or self.__ino != ino:
 			logSys.info("Log rotation detected for %s" % self.__filename)
 			self.__hash = myHash
-			self.__ino = stats.st_ino
+			self.__ino = ino
+			self.__pos = 0
+		elif os.fstat(self.__handler.fileno()).st_size < self.__pos:
+			logSys.info("Log truncation detected for %s" % self.__filename)
 			self.__pos = 0
 		# Sets the file pointer to the last position.
 		self.__handler.seek(self.__pos)
 
+	##
+	# Opens the file.
+	#
+	# @return a tuple (handler, inode, hash of the first line)
+
+	def __openFile(self):
+		handler = open(self.__filename)
+		# Set the file descriptor to be FD_CLOEXEC
+		fd = handler.fileno()
+		fcntl.fcntl(fd, fcntl.F_SETFD, fd | fcntl.FD_CLOEXEC)
+		firstLine = handler.readline()
+		# Computes the MD5 of the first line.
+		myHash = md5sum(firstLine).digest()
+		return handler, os.fstat(fd).st_ino, myHash
+
+	##
+	# Computes the hash of the first line of the file.
+	#
+	# The line is read through another descriptor, the buffer of the open
+	# one may still hold the line from before a truncation.
+	# @return the MD5 of the first line
+
+	def __firstLineHash(self):
+		handler = open(self.__filename)
+		try:
+			return md5sum(handler.readline()).digest()
+		finally:
+			handler.close()
+
+	##
+	# Continues with the new file once the rotated one is read.
+	#
+	# @return True if there was a new file
+
+	def __switch(self):
+		if self.__next == None:
+			return False
+		self.__handler.close()
+		self.__handler, self.__ino, self.__hash = self.__next
+		self.__next = None
+		self.__pos = 0
+		self.__handler.seek(0)
+		return True
+
+	##
+	# Reads the next complete line.
+	#
+	# A line which is still being written is left for the next call.
+	# @return the line or "" if there is no complete line
+
 	def readline(self):
 		if self.__handler == None:
 			return ""
-		return self.__handler.readline()
+		line = self.__handler.readline()
+		if not line.endswith("\n"):
+			if self.__switch():
+				return self.readline()
+			self.__handler.seek(self.__pos)
+			return ""
+		if not self.__pos:
+			# The first line may have been incomplete when opened
+			self.__hash = md5sum(line).digest()
+		self.__pos += len(line)
+		return line
+
+	##
+	# Reads the complete lines in batches.
+	#
+	# The file is read in blocks of BLOCK_SIZE bytes. The partial line at
+	# the end of a block is carried over to the next one, the one at the
+	# end of the file is left for the next time. The position is only
+	# advanced past a batch when the next one is requested, so that the
+	# lines of a batch which is not processed are read again.
+	# @return a generator of lists of lines
+
+	def readlines(self):
+		if self.__handler == None:
+			return
+		while True:
+			carry = ""
+			while True:
+				block = self.__handler.read(self.BLOCK_SIZE)
+				if not block:
+					break
+				data = carry + block
+				end = data.rfind("\n") + 1
+				carry = data[end:]
+				if end:
+					lines = StringIO(data[:end]).readlines()
+					if not self.__pos:
+						# The first line may have been incomplete when opened
+						self.__hash = md5sum(lines[0]).digest()
+					yield lines
+					self.__pos += end
+			if not self.__switch():
+				break
+		self.__handler.seek(self.__pos)
+
+	##
+	# Skips the lines older than a given time.
+	#
+	# Bisects the file between the position and its end, looking at the
+	# first line with a date after each probed offset, until the first line
+	# not older than unixTime is less than BLOCK_SIZE bytes away. Lines
+	# without a date keep the lines before them. The file must be open.
+	# @param unixTime the time
+	# @param getTime a function returning the time of a line or None
+
+	def seekTime(self, unixTime, getTime):
+		if self.__handler == None:
+			return
+		lo = self.__pos
+		hi = os.fstat(self.__handler.fileno()).st_size
+		while hi - lo > self.BLOCK_SIZE:
+			mid = (lo + hi) // 2
+			# Resynchronises on the first line starting at mid or after
+			self.__handler.seek(mid - 1)
+			self.__handler.readline()
+			lineTime = None
+			while lineTime is None and self.__handler.tell() < hi:
+				line = self.__handler.readline()
+				if not line.endswith("\n"):
+					break
+				lineTime = getTime(line)
+			if lineTime is None or lineTime >= unixTime:
+				hi = mid
+			else:
+				lo = self.__handler.tell()
+		if lo != self.__pos:
+			logSys.debug("Skipped %d bytes older than %s in %s"
+						 % (lo - self.__pos, unixTime, self.__filename))
+		self.__pos = lo
+		self.__handler.seek(lo)
+
+	##
+	# Ends a read.
+	#
+	# The descriptor is kept open for the next read, see release().
 
 	def close(self):
+		pass
+
+	##
+	# Closes the file descriptor.
+
+	def release(self):
 		if not self.__handler == None:
-			# Saves the last position.
-			self.__pos = self.__handler.tell()
 			# Closes the file.
 			self.__handler.close()
 			self.__handler = None
+		if not self.__next == None:
+			self.__next[0].close()
+			self.__next = None
+
+
+
+import socket, struct
+from bisect import bisect_right
+from threading import Lock, Thread
+
+##
+# Index of IP addresses, CIDR ranges and host names.
+#
+# The entries are parsed once when they are added and kept as a sorted
+# list of disjoint integer ranges, so that a lookup is a binary search.
+# Host names are resolved when they are added and resolved again in a
+# background thread once their addresses are older than DNS_TTL. Lookups
+# never wait for the DNS.
+
+class IPRangeIndex:
+
+	## Seconds after which the addresses of host names are refreshed.
+	DNS_TTL = 300
+
+	def __init__(self):
+		self.__lock = Lock()
+		## The entries in the order they were added.
+		self.__entries = list()
+		## The ranges (first, last) of each entry.
+		self.__ranges = dict()
+		## The host names and the time of their last resolution.
+		self.__hosts = dict()
+		self.__refreshing = False
+		## Sorted starts and corresponding ends of the merged ranges.
+		self.__index = ([], [])
+
+	##
+	# Adds an IP address, a CIDR range or a host name.
+	#
+	# @param entry the entry as given in the ignoreip option
+
+	def add(self, entry):
+		ranges = None
+		isHost = False
+		# An empty string never matches
+		if entry != "":
+			ranges = IPRangeIndex.parse(entry)
+			if ranges is None:
+				isHost = True
+				ranges = IPRangeIndex.__resolve(entry)
+		self.__lock.acquire()
+		try:
+			self.__entries.append(entry)
+			if ranges is not None:
+				self.__ranges[entry] = ranges
+			if isHost:
+				self.__hosts[entry] = time.time()
+			self.__rebuild()
+		finally:
+			self.__lock.release()
+
+	##
+	# Removes an entry previously added.
+	#
+	# @param entry the entry as given to add()
+
+	def remove(self, entry):
+		self.__lock.acquire()
+		try:
+			self.__entries.remove(entry)
+			if not entry in self.__entries:
+				if self.__ranges.has_key(entry):
+					del self.__ranges[entry]
+				if self.__hosts.has_key(entry):
+					del self.__hosts[entry]
+			self.__rebuild()
+		finally:
+			self.__lock.release()
 
+	def getEntries(self):
+		return self.__entries
+
+	def __contains__(self, ip):
+		self.__checkHosts()
+		try:
+			addr = DNSUtils.addr2bin(ip)
+		except (socket.error, struct.error):
+			return False
+		starts, ends = self.__index
+		i = bisect_right(starts, addr) - 1
+		return i >= 0 and addr <= ends[i]
+
+	##
+	# Merges the ranges of all the entries into the index.
+	#
+	# Must be called with the lock held. The index is replaced as a whole
+	# so that lookups do not need the lock.
+
+	def __rebuild(self):
+		ranges = list()
+		for r in self.__ranges.values():
+			ranges.extend(r)
+		ranges.sort()
+		starts = list()
+		ends = list()
+		for first, last in ranges:
+			if ends and first <= ends[-1] + 1:
+				if last > ends[-1]:
+					ends[-1] = last
+			else:
+				starts.append(first)
+				ends.append(last)
+		self.__index = (starts, ends)
+
+	def __checkHosts(self):
+		if not self.__hosts or self.__refreshing:
+			return
+		limit = time.time() - self.DNS_TTL
+		for resolved in self.__hosts.values():
+			if resolved < limit:
+				break
+		else:
+			return
+		self.__refreshing = True
+		thread = Thread(target = self.__refreshHosts)
+		thread.setDaemon(True)
+		thread.start()
+
+	def __refreshHosts(self):
+		try:
+			limit = time.time() - self.DNS_TTL
+			for host, resolved in self.__hosts.items():
+				if resolved >= limit:
+					continue
+				ranges = IPRangeIndex.__resolve(host)
+				self.__lock.acquire()
+				try:
+					if self.__hosts.has_key(host):
+						self.__hosts[host] = time.time()
+						self.__ranges[host] = ranges
+						self.__rebuild()
+				finally:
+					self.__lock.release()
+		finally:
+			self.__refreshing = False
+
+	##
+	# Converts an IP address or a CIDR range into an integer range.
+	#
+	# @param entry the IP address, optionally followed by /mask
+	# @return a list with the range (first, last) or None if entry is not
+	# an IP address
+
+	#@staticmethod
+	def parse(entry):
+		s = entry.split('/', 1)
+		try:
+			addr = DNSUtils.addr2bin(s[0])
+		except (socket.error, struct.error):
+			return None
+		mask = 32
+		if len(s) == 2:
+			try:
+				mask = int(s[1])
+			except ValueError:
+				mask = -1
+			if not 0 <= mask <= 32:
+				logSys.error("Invalid mask in %s" % entry)
+				return []
+		first = DNSUtils.cidr(s[0], mask)
+		return [(first, first | (0xFFFFFFFFL >> mask))]
+	parse = staticmethod(parse)
+
+	#@staticmethod
+	def __resolve(host):
+		return [(addr, addr) for addr in
+				map(DNSUtils.addr2bin, DNSUtils.dnsToIp(host))]
+	__resolve = staticmethod(__resolve)
 
 
 ##
@@ -553,8 +1281,6 @@ class FileContainer:
 # This class contains only static methods used to handle DNS and IP
 # addresses.
 
-import socket, struct
-
 class DNSUtils:
 
 	IP_CRE = re.compile("^(?:\d{1,3}\.){3}\d{1,3}$")
@@ -27,7 +27,6 @@ __date__ = "$Date$"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier"
 __license__ = "GPL"
 
-from failmanager import FailManagerEmpty
 from filter import FileFilter
 from mytime import MyTime
 
@@ -93,6 +92,19 @@ class FilterGamin(FileFilter):
 			FileFilter.delLogPath(self, path)
 			logSys.info("Removed logfile = %s" % path)
 		
+	def _addDirWatch(self, path):
+		self.monitor.watch_directory(path, self.__dirCallback)
+
+	def _delDirWatch(self, path):
+		self.monitor.stop_watch(path)
+
+	def __dirCallback(self, path, event):
+		if event in (gamin.GAMCreated, gamin.GAMDeleted, gamin.GAMMoved):
+			logSys.debug("Directory changed: " + path)
+			self.refreshLogGlobs()
+			# Files which disappeared are read to their end first
+			self.__modified = True
+
 	##
 	# Main loop.
 	#
@@ -110,13 +122,8 @@ class FilterGamin(FileFilter):
 					self.monitor.handle_events()
 
 				if self.__modified:
-					try:
-						while True:
-							ticket = self.failManager.toBan()
-							self.jail.putFailTicket(ticket)
-					except FailManagerEmpty:
-						self.failManager.cleanup(MyTime.time())
-					self.dateDetector.sortTemplate()
+					self.jail.putFailTickets(self.failManager.toBanBatch())
+					self.failManager.cleanup(MyTime.time())
 					self.__modified = False
 				time.sleep(self.getSleepTime())
 			else:
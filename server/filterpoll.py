@@ -27,11 +27,11 @@ __date__ = "$Date$"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier"
 __license__ = "GPL"
 
-from failmanager import FailManagerEmpty
 from filter import FileFilter
 from mytime import MyTime
+from threading import Thread, Lock, Condition
 
-import time, logging, os
+import logging, os, select, errno, heapq, time
 
 # Gets the instance of the logger.
 logSys = logging.getLogger("fail2ban.filter")
@@ -42,6 +42,9 @@ logSys = logging.getLogger("fail2ban.filter")
 # This class reads a log file and detects login failures or anything else
 # that matches a given regular expression. This class is instanciated by
 # a Jail object.
+#
+# The log files are polled by the PollScheduler of the server, the thread
+# sleeps until one of them is reported as modified.
 
 class FilterPoll(FileFilter):
 
@@ -53,10 +56,11 @@ class FilterPoll(FileFilter):
 	
 	def __init__(self, jail):
 		FileFilter.__init__(self, jail)
-		self.__modified = False
-		## The time of the last modification of the file.
-		self.__lastModTime = dict()
+		self.__scheduler = PollScheduler.getInstance()
 		self.__file404Cnt = dict()
+		## The log files modified since the last wake up.
+		self.__pending = list()
+		self.__event = Condition()
 		logSys.debug("Created FilterPoll")
 
 	##
@@ -68,9 +72,9 @@ class FilterPoll(FileFilter):
 		if self.containsLogPath(path):
 			logSys.error(path + " already exists")
 		else:
-			self.__lastModTime[path] = 0
 			self.__file404Cnt[path] = 0
 			FileFilter.addLogPath(self, path, tail)
+			self.__scheduler.addWatch(self, path)
 			logSys.info("Added logfile = %s" % path)	
 	
 	##
@@ -82,64 +86,337 @@ class FilterPoll(FileFilter):
 		if not self.containsLogPath(path):
 			logSys.error(path + " is not monitored")
 		else:
-			del self.__lastModTime[path]
+			self.__scheduler.delWatch(self, path)
 			del self.__file404Cnt[path]
 			FileFilter.delLogPath(self, path)
 			logSys.info("Removed logfile = %s" % path)
 	
+	##
+	# Signal a modification of a log file.
+	#
+	# Called by the PollScheduler, wakes the thread up.
+	# @param path log file path
+
+	def notify(self, path):
+		if self.__file404Cnt.has_key(path):
+			self.__file404Cnt[path] = 0
+		try:
+			self.__event.acquire()
+			if not path in self.__pending:
+				self.__pending.append(path)
+			self.__event.notify()
+		finally:
+			self.__event.release()
+
+	##
+	# Set the idle flag.
+	#
+	# The modifications notified while the jail is idle are dropped, so the
+	# log files are read again when it is resumed.
+	# @param value the idle flag
+
+	def setIdle(self, value):
+		resumed = self.getIdle() and not value
+		FileFilter.setIdle(self, value)
+		if resumed:
+			for container in self.getLogPath():
+				self.notify(container.getFileName())
+
+	##
+	# Signal that a log file could not be polled.
+	#
+	# The jail is set idle after too many errors.
+	# @param path log file path
+
+	def notifyError(self, path):
+		if self.isLogGlobDir(os.path.dirname(path)):
+			# Possibly removed, checked against the glob patterns
+			self.notify(os.path.dirname(path))
+			return
+		logSys.error("Unable to get stat on " + path)
+		if not self.__file404Cnt.has_key(path):
+			# A directory of the glob patterns
+			return
+		self.__file404Cnt[path] = self.__file404Cnt[path] + 1
+		if self.__file404Cnt[path] > 2:
+			logSys.warn("Too much read error. Set the jail idle")
+			self.jail.setIdle(True)
+			self.__file404Cnt[path] = 0
+
+	def _addDirWatch(self, path):
+		self.__scheduler.addWatch(self, path)
+
+	def _delDirWatch(self, path):
+		self.__scheduler.delWatch(self, path)
+
 	##
 	# Main loop.
 	#
-	# This function is the main loop of the thread. It checks if the
+	# This function is the main loop of the thread. It waits until a
 	# file has been modified and looks for failures.
 	# @return True when the thread exits nicely
 
 	def run(self):
 		self.setActive(True)
-		while self._isActive():
-			if not self.getIdle():
-				# Get file modification
-				for container in self.getLogPath():
-					if self.isModified(container.getFileName()):
-						self.getFailures(container.getFileName())
-						self.__modified = True
-
-				if self.__modified:
-					try:
-						while True:
-							ticket = self.failManager.toBan()
-							self.jail.putFailTicket(ticket)
-					except FailManagerEmpty:
-						self.failManager.cleanup(MyTime.time())
-					self.dateDetector.sortTemplate()
-					self.__modified = False
-				time.sleep(self.getSleepTime())
-			else:
-				time.sleep(self.getSleepTime())
+		while True:
+			paths = self.__wait()
+			if paths is None:
+				break
+			if self.getIdle():
+				continue
+			for path in paths:
+				if self.isLogGlobDir(path):
+					self.refreshLogGlobs()
+				elif self.containsLogPath(path):
+					self.getFailures(path)
+			self.jail.putFailTickets(self.failManager.toBanBatch())
+			self.failManager.cleanup(MyTime.time())
+		for container in self.getLogPath():
+			self.__scheduler.delWatch(self, container.getFileName())
+		for pattern in self.getLogGlob():
+			self.delLogGlob(pattern)
 		logSys.debug(self.jail.getName() + ": filter terminated")
 		return True
 
 	##
-	# Checks if the log file has been modified.
+	# Wait for modifications of the log files.
 	#
-	# Checks if the log file has been modified using os.stat().
-	# @return True if log file has been modified
-	
-	def isModified(self, filename):
+	# @return the modified paths or None when the thread is stopped
+
+	def __wait(self):
 		try:
-			logStats = os.stat(filename)
-			self.__file404Cnt[filename] = 0
-			if self.__lastModTime[filename] == logStats.st_mtime:
-				return False
-			else:
-				logSys.debug(filename + " has been modified")
-				self.__lastModTime[filename] = logStats.st_mtime
-				return True
+			self.__event.acquire()
+			while self._isActive() and not self.__pending:
+				self.__event.wait()
+			if not self._isActive():
+				return None
+			paths = self.__pending
+			self.__pending = list()
+			return paths
+		finally:
+			self.__event.release()
+
+	##
+	# Call super.stop() and then wake the thread up
+
+	def stop(self):
+		super(FilterPoll, self).stop()
+		try:
+			self.__event.acquire()
+			self.__event.notify()
+		finally:
+			self.__event.release()
+
+
+##
+# Poll scheduler.
+#
+# A single thread polling the log files of all the polling jails. Every
+# file has its own interval: it is polled every sleeptime seconds of its
+# jails while it is written, and the interval doubles, up to MAX_BACKOFF
+# times, each time it is found unchanged. The files due within SLACK
+# seconds are polled together, so that files with the same interval share
+# their wake ups.
+
+class PollScheduler(Thread):
+
+	## Maximal factor applied to the sleeptime of a quiet file.
+	MAX_BACKOFF = 16
+	## Seconds by which a file may be polled early to share a wake up.
+	SLACK = 0.1
+
+	__instance = None
+	__instanceLock = Lock()
+
+	##
+	# Get the scheduler of the server.
+	#
+	# The scheduler is created and started on first use.
+	# @return the PollScheduler
+
+	#@staticmethod
+	def getInstance():
+		try:
+			PollScheduler.__instanceLock.acquire()
+			if PollScheduler.__instance is None:
+				scheduler = PollScheduler()
+				scheduler.start()
+				PollScheduler.__instance = scheduler
+			return PollScheduler.__instance
+		finally:
+			PollScheduler.__instanceLock.release()
+	getInstance = staticmethod(getInstance)
+
+	##
+	# Get the stats used to detect a modification.
+	#
+	# The size, the modification time with the best available precision and
+	# the inode, so that writes within the same second and files replaced
+	# by a file of the same size are noticed.
+	# @param path the file
+	# @return a tuple
+	# @throws OSError if the file can not be stat'ed
+
+	#@staticmethod
+	def getStats(path):
+		stats = os.stat(path)
+		mtime = getattr(stats, "st_mtime_ns", None)
+		if mtime is None:
+			mtime = stats.st_mtime
+		return (stats.st_size, mtime, stats.st_ino)
+	getStats = staticmethod(getStats)
+
+	def __init__(self):
+		Thread.__init__(self)
+		self.setDaemon(True)
+		self.__lock = Lock()
+		## The polled files indexed by path.
+		self.__files = dict()
+		## Heap of (time, path) of the next polls.
+		self.__queue = list()
+		# Pipe waking the thread up when a file is added
+		self.__wakeup = os.pipe()
+
+	##
+	# Poll a log file for a filter.
+	#
+	# The file is polled immediately and seen as modified, so that the new
+	# filter reads it even if it is already polled for other filters.
+	# @param filter_ the filter to notify
+	# @param path log file path
+
+	def addWatch(self, filter_, path):
+		try:
+			self.__lock.acquire()
+			polled = self.__files.get(path)
+			if polled is None:
+				polled = PolledFile(path)
+				self.__files[path] = polled
+			polled.filters.append(filter_)
+			polled.stats = None
+			self.__schedule(polled, time.time())
+			os.write(self.__wakeup[1], "x")
+		finally:
+			self.__lock.release()
+
+	##
+	# Stop polling a log file for a filter.
+	#
+	# @param filter_ the filter
+	# @param path log file path
+
+	def delWatch(self, filter_, path):
+		try:
+			self.__lock.acquire()
+			polled = self.__files.get(path)
+			if polled is not None and filter_ in polled.filters:
+				polled.filters.remove(filter_)
+				if not polled.filters:
+					# Its queue entry is dropped when it is due
+					del self.__files[path]
+		finally:
+			self.__lock.release()
+
+	def __schedule(self, polled, nextTime):
+		polled.nextTime = nextTime
+		heapq.heappush(self.__queue, (nextTime, polled.path))
+
+	##
+	# Get the files due for a poll.
+	#
+	# @param now the current time
+	# @return the list of PolledFile and the time until the next poll
+
+	def __getDue(self, now):
+		try:
+			self.__lock.acquire()
+			due = list()
+			queue = self.__queue
+			while queue and queue[0][0] <= now + self.SLACK:
+				nextTime, path = heapq.heappop(queue)
+				polled = self.__files.get(path)
+				if polled is not None and polled.nextTime == nextTime:
+					due.append(polled)
+			if queue:
+				return due, max(0, queue[0][0] - now)
+			return due, None
+		finally:
+			self.__lock.release()
+
+	##
+	# Poll a file and schedule its next poll.
+	#
+	# @param polled the PolledFile
+	# @param now the current time
+
+	def __poll(self, polled, now):
+		try:
+			stats = PollScheduler.getStats(polled.path)
 		except OSError:
-			logSys.error("Unable to get stat on " + filename)
-			self.__file404Cnt[filename] = self.__file404Cnt[filename] + 1
-			if self.__file404Cnt[filename] > 2:
-				logSys.warn("Too much read error. Set the jail idle")
-				self.jail.setIdle(True)
-				self.__file404Cnt[filename] = 0
-			return False
+			stats = None
+		try:
+			self.__lock.acquire()
+			if self.__files.get(polled.path) is not polled:
+				# Not polled any more
+				return
+			filters = polled.filters[:]
+			minInterval = min([f.getSleepTime() for f in filters])
+			modified = stats is not None and stats != polled.stats
+			if modified:
+				polled.stats = stats
+				polled.interval = minInterval
+			else:
+				polled.interval = min(max(polled.interval * 2, minInterval),
+									  minInterval * self.MAX_BACKOFF)
+			self.__schedule(polled, now + polled.interval)
+		finally:
+			self.__lock.release()
+		if modified:
+			logSys.debug(polled.path + " has been modified")
+		for f in filters:
+			try:
+				if stats is None:
+					f.notifyError(polled.path)
+				elif modified:
+					f.notify(polled.path)
+			except Exception, e:
+				logSys.error("Unable to notify the filter of %s: %s"
+							 % (polled.path, e))
+
+	##
+	# Main loop.
+	#
+	# Sleeps until the next file is due.
+
+	def run(self):
+		while True:
+			now = time.time()
+			due, timeout = self.__getDue(now)
+			for polled in due:
+				self.__poll(polled, now)
+			if due:
+				continue
+			try:
+				if select.select([self.__wakeup[0]], [], [], timeout)[0]:
+					os.read(self.__wakeup[0], 512)
+			except select.error, e:
+				# Interrupted by a signal
+				if e[0] != errno.EINTR:
+					raise
+
+
+##
+# A file polled by the PollScheduler.
+
+class PolledFile:
+
+	def __init__(self, path):
+		self.path = path
+		## The filters monitoring the file.
+		self.filters = list()
+		## The stats of the last poll.
+		self.stats = None
+		## The current poll interval.
+		self.interval = 0
+		## The time of the next poll.
+		self.nextTime = 0
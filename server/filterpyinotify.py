@@ -23,11 +23,11 @@ __author__ = "Cyril Jaquier, Lee Clemens, Yaroslav Halchenko"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier, 2011-2012 Lee Clemens, 2012 Yaroslav Halchenko"
 __license__ = "GPL"
 
-from failmanager import FailManagerEmpty
 from filter import FileFilter
 from mytime import MyTime
+from threading import Thread, Lock, Condition
 
-import time, logging, pyinotify
+import logging, os, errno, select, pyinotify
 
 # Gets the instance of the logger.
 logSys = logging.getLogger("fail2ban.filter")
@@ -38,6 +38,9 @@ logSys = logging.getLogger("fail2ban.filter")
 # This class reads a log file and detects login failures or anything else
 # that matches a given regular expression. This class is instantiated by
 # a Jail object.
+#
+# The thread sleeps until the InotifyWatcher of the server reports a change
+# of one of its log files.
 
 class FilterPyinotify(FileFilter):
 	##
@@ -48,23 +51,32 @@ class FilterPyinotify(FileFilter):
 
 	def __init__(self, jail):
 		FileFilter.__init__(self, jail)
-		self.__modified = False
-		# Pyinotify watch manager
-		self.__monitor = pyinotify.WatchManager()
-		self.__watches = dict()
+		self.__watcher = InotifyWatcher.getInstance()
+		## The log files changed since the last wake up.
+		self.__pending = list()
+		self.__event = Condition()
 		logSys.debug("Created FilterPyinotify")
 
 
 	def callback(self, path):
 		self.getFailures(path)
+		self.jail.putFailTickets(self.failManager.toBanBatch())
+		self.failManager.cleanup(MyTime.time())
+
+	##
+	# Signal a change of a log file.
+	#
+	# Called by the InotifyWatcher, wakes the thread up.
+	# @param path log file path
+
+	def notify(self, path):
 		try:
-			while True:
-				ticket = self.failManager.toBan()
-				self.jail.putFailTicket(ticket)
-		except FailManagerEmpty:
-			self.failManager.cleanup(MyTime.time())
-		self.dateDetector.sortTemplate()
-		self.__modified = False
+			self.__event.acquire()
+			if not path in self.__pending:
+				self.__pending.append(path)
+			self.__event.notify()
+		finally:
+			self.__event.release()
 
 	##
 	# Add a log file path
@@ -75,10 +87,9 @@ class FilterPyinotify(FileFilter):
 		if self.containsLogPath(path):
 			logSys.error(path + " already exists")
 		else:
-			wd = self.__monitor.add_watch(path, pyinotify.IN_MODIFY)
-			self.__watches.update(wd)
-			FileFilter.addLogPath(self, path, tail)
-			logSys.info("Added logfile = %s" % path)
+			if self.__watcher.addWatch(self, path):
+				FileFilter.addLogPath(self, path, tail)
+				logSys.info("Added logfile = %s" % path)
 
 	##
 	# Delete a log path
@@ -89,67 +100,303 @@ class FilterPyinotify(FileFilter):
 		if not self.containsLogPath(path):
 			logSys.error(path + " is not monitored")
 		else:
-			wdInt = self.__watches[path]
-			wd = self.__monitor.rm_watch(wdInt)
-			if wd[wdInt]:
-				del self.__watches[path]
-				FileFilter.delLogPath(self, path)
-				logSys.info("Removed logfile = %s" % path)
-			else:
-				logSys.error("Failed to remove watch on path: %s", path)
+			self.__watcher.delWatch(self, path)
+			FileFilter.delLogPath(self, path)
+			logSys.info("Removed logfile = %s" % path)
+
+	def _addDirWatch(self, path):
+		self.__watcher.addWatch(self, path, True)
+
+	def _delDirWatch(self, path):
+		self.__watcher.delWatch(self, path, True)
 
 	##
 	# Main loop.
 	#
-	# This function is the main loop of the thread. It checks if the
-	# file has been modified and looks for failures.
+	# This function is the main loop of the thread. It waits for changes
+	# of the log files and looks for failures.
 	# @return True when the thread exits nicely
 
 	def run(self):
 		self.setActive(True)
-		self.__notifier = pyinotify.ThreadedNotifier(self.__monitor,
-			ProcessPyinotify(self))
-		self.__notifier.start()
-		while self._isActive():
-			if not self.getIdle():
-				self.__notifier.process_events()
-				if self.__notifier.check_events():
-					self.__notifier.read_events()
-			else:
-				time.sleep(self.getSleepTime())
-		# Cleanup pyinotify
-		self.__cleanup()
+		while True:
+			paths = self.__wait()
+			if paths is None:
+				break
+			if self.getIdle():
+				continue
+			for path in paths:
+				if self.isLogGlobDir(path):
+					# Files which disappeared are read to their end first
+					self.refreshLogGlobs()
+					self.jail.putFailTickets(self.failManager.toBanBatch())
+				elif self.containsLogPath(path):
+					self.callback(path)
+		# Cleanup the watches
+		for container in self.getLogPath():
+			self.__watcher.delWatch(self, container.getFileName())
+		for pattern in self.getLogGlob():
+			self.delLogGlob(pattern)
 		logSys.debug(self.jail.getName() + ": filter terminated")
 		return True
 
 	##
-	# Call super.stop() and then stop the 'Notifier'
+	# Wait for changes of the log files.
+	#
+	# @return the changed paths or None when the thread is stopped
+
+	def __wait(self):
+		try:
+			self.__event.acquire()
+			while self._isActive() and not self.__pending:
+				self.__event.wait()
+			if not self._isActive():
+				return None
+			paths = self.__pending
+			self.__pending = list()
+			return paths
+		finally:
+			self.__event.release()
+
+	##
+	# Call super.stop() and then wake the thread up
 
 	def stop(self):
 		# Call super to set __isRunning
 		super(FilterPyinotify, self).stop()
-		# Now stop the Notifier, otherwise we're deadlocked
-		self.__notifier.stop()
+		try:
+			self.__event.acquire()
+			self.__event.notify()
+		finally:
+			self.__event.release()
+
+
+##
+# Inotify watcher.
+#
+# A single inotify instance shared by all the jails of the server. The
+# parent directories of the log files, and of the files their symbolic links
+# point to, are watched, so that the creation or the renaming of a file, e.g.
+# on log rotation, is reported as well. One thread waits on epoll for the
+# inotify events and hands the changed paths to the filters monitoring them.
+# A filter may also monitor a directory, it is then notified of the files
+# created, deleted or renamed in it.
+
+class InotifyWatcher(Thread):
+
+	## The events which add or remove a file in a directory.
+	DIR_MASK = pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO \
+		| pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM
+	MASK = pyinotify.IN_MODIFY | DIR_MASK
+
+	__instance = None
+	__instanceLock = Lock()
+
+	##
+	# Get the watcher of the server.
+	#
+	# The watcher is created and started on first use.
+	# @return the InotifyWatcher
+
+	#@staticmethod
+	def getInstance():
+		try:
+			InotifyWatcher.__instanceLock.acquire()
+			if InotifyWatcher.__instance is None:
+				watcher = InotifyWatcher()
+				watcher.start()
+				InotifyWatcher.__instance = watcher
+			return InotifyWatcher.__instance
+		finally:
+			InotifyWatcher.__instanceLock.release()
+	getInstance = staticmethod(getInstance)
+
+	def __init__(self):
+		Thread.__init__(self)
+		self.setDaemon(True)
+		self.__lock = Lock()
+		self.__monitor = pyinotify.WatchManager()
+		self.__notifier = pyinotify.Notifier(self.__monitor,
+			ProcessPyinotify(self))
+		self.__epoll = select.epoll()
+		self.__epoll.register(self.__monitor.get_fd(), select.EPOLLIN)
+		## Watch descriptor and number of log files by directory.
+		self.__dirs = dict()
+		## Filters and their path by absolute log file path.
+		self.__filters = dict()
+		## Filters and their path by absolute directory path.
+		self.__dirFilters = dict()
+		## Watched absolute paths and directories by filter, path and kind.
+		self.__watches = dict()
 
 	##
-	# Deallocates the resources used by pyinotify.
+	# Watch a log file for a filter.
+	#
+	# A symbolic link is watched in the directory of the file it points to
+	# as well, whose events are reported with the configured path.
+	# @param filter_ the filter to notify
+	# @param path log file path
+	# @param directory True if path is a directory
+	# @return True if the watch is added
+
+	def addWatch(self, filter_, path, directory = False):
+		abspath = os.path.abspath(path)
+		if directory:
+			filters = self.__dirFilters
+			targets = [abspath]
+		else:
+			filters = self.__filters
+			targets = [abspath]
+			realpath = os.path.realpath(abspath)
+			if realpath != abspath:
+				targets.append(realpath)
+		try:
+			self.__lock.acquire()
+			key = (filter_, path, directory)
+			if self.__watches.has_key(key):
+				return True
+			watched = list()
+			for target in targets:
+				if directory:
+					dirname = target
+				else:
+					dirname = os.path.dirname(target)
+				if not self.__addDir(dirname):
+					for added, addedDir in watched:
+						filters[added].remove((filter_, path))
+						if not filters[added]:
+							del filters[added]
+						self.__delDir(addedDir)
+					return False
+				watched.append((target, dirname))
+				filters.setdefault(target, list()).append((filter_, path))
+			self.__watches[key] = watched
+			return True
+		finally:
+			self.__lock.release()
+
+	##
+	# Stop watching a log file for a filter.
+	#
+	# The directory watch is removed with its last log file.
+	# @param filter_ the filter
+	# @param path log file path
+	# @param directory True if path is a directory
+
+	def delWatch(self, filter_, path, directory = False):
+		if directory:
+			allFilters = self.__dirFilters
+		else:
+			allFilters = self.__filters
+		try:
+			self.__lock.acquire()
+			watched = self.__watches.pop((filter_, path, directory), None)
+			if watched is None:
+				return
+			for target, dirname in watched:
+				filters = allFilters[target]
+				filters.remove((filter_, path))
+				if not filters:
+					del allFilters[target]
+				self.__delDir(dirname)
+		finally:
+			self.__lock.release()
+
+	##
+	# Add a reference to the watch of a directory.
+	#
+	# Must be called with the lock held.
+	# @param dirname the absolute directory path
+	# @return True if the directory is watched
+
+	def __addDir(self, dirname):
+		if self.__dirs.has_key(dirname):
+			wd, count = self.__dirs[dirname]
+		else:
+			wd = self.__monitor.add_watch(dirname, self.MASK).get(dirname)
+			if wd is None or wd < 0:
+				logSys.error("Failed to add watch on directory: %s" % dirname)
+				return False
+			count = 0
+		self.__dirs[dirname] = (wd, count + 1)
+		return True
 
-	def __cleanup(self):
-		del self.__notifier
-		del self.__monitor
+	##
+	# Remove a reference to the watch of a directory.
+	#
+	# Must be called with the lock held.
+	# @param dirname the absolute directory path
+
+	def __delDir(self, dirname):
+		wd, count = self.__dirs[dirname]
+		if count > 1:
+			self.__dirs[dirname] = (wd, count - 1)
+		else:
+			del self.__dirs[dirname]
+			if not self.__monitor.rm_watch(wd).get(wd):
+				logSys.error("Failed to remove watch on directory: %s"
+							 % dirname)
+
+	##
+	# Notify the filters monitoring a path.
+	#
+	# The filters monitoring the directory of the path are only notified
+	# when a file is added or removed.
+	# @param pathname the changed path, None for all the paths
+	# @param mask the mask of the inotify event
+
+	def dispatch(self, pathname, mask = 0):
+		try:
+			self.__lock.acquire()
+			if pathname is None:
+				filters = list()
+				for l in self.__filters.values() + self.__dirFilters.values():
+					filters.extend(l)
+			else:
+				filters = self.__filters.get(pathname, [])[:]
+				if mask & self.DIR_MASK:
+					filters.extend(self.__dirFilters.get(
+						os.path.dirname(pathname), []))
+		finally:
+			self.__lock.release()
+		for filter_, path in filters:
+			filter_.notify(path)
+
+	##
+	# Main loop.
+	#
+	# Blocks on epoll until inotify has events to read.
+
+	def run(self):
+		while True:
+			try:
+				self.__epoll.poll()
+			except IOError, e:
+				# Interrupted by a signal
+				if e.errno == errno.EINTR:
+					continue
+				raise
+			try:
+				self.__notifier.read_events()
+				self.__notifier.process_events()
+			except Exception, e:
+				logSys.error("Unable to process the inotify events: %s" % e)
 
 
 class ProcessPyinotify(pyinotify.ProcessEvent):
-	def __init__(self, FileFilter, **kargs):
+	def __init__(self, watcher, **kargs):
 		#super(ProcessPyinotify, self).__init__(**kargs)
 		# for some reason root class _ProcessEvent is old-style (is
 		# not derived from object), so to play safe let's avoid super
 		# for now, and call superclass directly
 		pyinotify.ProcessEvent.__init__(self, **kargs)
-		self.__FileFilter = FileFilter
-		pass
+		self.__watcher = watcher
 
 	# just need default, since using mask on watch to limit events
 	def process_default(self, event):
 		logSys.debug("Callback for Event: %s" % event)
-		self.__FileFilter.callback(event.pathname)
+		if event.mask & pyinotify.IN_Q_OVERFLOW:
+			# Events have been lost, every file may have changed
+			self.__watcher.dispatch(None)
+		else:
+			self.__watcher.dispatch(event.pathname, event.mask)
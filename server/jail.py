@@ -23,7 +23,8 @@ __author__ = "Cyril Jaquier, Lee Clemens, Yaroslav Halchenko"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier, 2011-2012 Lee Clemens, 2012 Yaroslav Halchenko"
 __license__ = "GPL"
 
-import Queue, logging
+import logging
+from collections import deque
 
 from actions import Actions
 
@@ -37,7 +38,8 @@ class Jail:
 
 	def __init__(self, name, backend = "auto"):
 		self.__name = name
-		self.__queue = Queue.Queue()
+		## Tickets waiting to be banned. Appending and popping are atomic.
+		self.__queue = deque()
 		self.__filter = None
 		logSys.info("Creating new jail '%s'" % self.__name)
 		self._setBackend(backend)
@@ -112,14 +114,32 @@ class Jail:
 		return self.__action
 	
 	def putFailTicket(self, ticket):
-		self.__queue.put(ticket)
+		self.__queue.append(ticket)
+	
+	def putFailTickets(self, tickets):
+		self.__queue.extend(tickets)
 	
 	def getFailTicket(self):
 		try:
-			return self.__queue.get(False)
-		except Queue.Empty:
+			return self.__queue.popleft()
+		except IndexError:
 			return False
 	
+	##
+	# Get the pending tickets.
+	#
+	# @param count the maximal number of tickets
+	# @return a list of FailTicket, empty if there is none
+	
+	def getFailTickets(self, count):
+		tickets = list()
+		try:
+			while len(tickets) < count:
+				tickets.append(self.__queue.popleft())
+		except IndexError:
+			pass
+		return tickets
+	
 	def start(self):
 		self.__filter.start()
 		self.__action.start()
@@ -144,9 +164,9 @@ class Jail:
 	def getIdle(self):
 		return self.__filter.getIdle() or self.__action.getIdle()
 	
-	def getStatus(self):
+	def getStatus(self, start = 0, count = None):
 		fStatus = self.__filter.status()
-		aStatus = self.__action.status()
+		aStatus = self.__action.status(start, count)
 		ret = [("filter", fStatus), 
 			   ("action", aStatus)]
 		return ret
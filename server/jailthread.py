@@ -59,7 +59,7 @@ class JailThread(Thread):
 	
 	def setSleepTime(self, value):
 		self.__sleepTime = value
-		logSys.info("Set sleeptime = " + value)
+		logSys.info("Set sleeptime = %s" % value)
 	
 	##
 	# Get the time that the thread sleeps.
@@ -0,0 +1,347 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: t -*-
+# vi: set ft=python sts=4 ts=4 sw=4 noet :
+
+# This file is part of Fail2Ban.
+#
+# Fail2Ban is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Fail2Ban is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Fail2Ban; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+__copyright__ = "Copyright (c) 2004 Cyril Jaquier"
+__license__ = "GPL"
+
+from threading import Lock
+from filter import Filter, FileContainer
+from datedetector import DateDetector
+from mytime import MyTime
+import logging
+
+# Gets the instance of the logger.
+logSys = logging.getLogger("fail2ban.filter")
+
+##
+# Log hub.
+#
+# Shares the log files between the jails of the server, so that a file
+# watched by several jails is read only once.
+
+class LogHub:
+
+	def __init__(self):
+		self.__lock = Lock()
+		## The shared logs indexed by path.
+		self.__logs = dict()
+
+	##
+	# Subscribe a filter to a log file.
+	#
+	# The position in the file is shared: tail is only used by the first
+	# filter subscribing to the file, the other ones start where it is.
+	# @param filter_ the FileFilter
+	# @param path the log file
+	# @param tail if True, a new file is read from its end
+	# @return the SharedLog
+
+	def subscribe(self, filter_, path, tail = False):
+		try:
+			self.__lock.acquire()
+			log = self.__logs.get(path)
+			if log is None:
+				log = SharedLog(path, tail)
+				self.__logs[path] = log
+			log.addSubscriber(filter_)
+			return log
+		finally:
+			self.__lock.release()
+
+	##
+	# Unsubscribe a filter from a log file.
+	#
+	# The file is closed when its last filter unsubscribes.
+	# @param filter_ the FileFilter
+	# @param path the log file
+
+	def unsubscribe(self, filter_, path):
+		try:
+			self.__lock.acquire()
+			log = self.__logs.get(path)
+			if log is None:
+				return
+			log.delSubscriber(filter_)
+			if log.getSubscribers():
+				return
+			del self.__logs[path]
+		finally:
+			self.__lock.release()
+		# Waits for a running read outside of the lock of the hub
+		log.release()
+
+	##
+	# Unsubscribe a filter from all the log files.
+	#
+	# @param filter_ the FileFilter
+
+	def unsubscribeAll(self, filter_):
+		for path in self.getLogPaths():
+			self.unsubscribe(filter_, path)
+
+	def getLogPaths(self):
+		try:
+			self.__lock.acquire()
+			return self.__logs.keys()
+		finally:
+			self.__lock.release()
+
+
+##
+# Log file shared by several filters.
+#
+# Whichever filter reads the file reads the new lines for all of them:
+# the date of each line is searched once, and the failregex of filters
+# with the same configuration are searched once. The failures found are
+# then added to each filter, which applies its findtime and ignoreip.
+# The lines are not given to the filters which are stopped. The lines read
+# for the other filters while a filter is idle are kept, up to MAX_PENDING
+# lines, and given to it by the first read after it is resumed. The file
+# is not read while all the filters are idle, they then continue from the
+# shared position.
+
+class SharedLog:
+
+	## Maximal number of lines kept for an idle filter.
+	MAX_PENDING = 100000
+
+	def __init__(self, path, tail = False):
+		## Lock of the file, held while it is read.
+		self.__lock = Lock()
+		## Lock of the subscribers, never held while reading.
+		self.__subLock = Lock()
+		self.__container = FileContainer(path, tail)
+		## The date detectors of the decoded lines and of the lines as read,
+		## see Filter.setByteLines().
+		self.__dateDetectors = dict()
+		for byteLines in (False, True):
+			dateDetector = DateDetector(byteLines)
+			dateDetector.addDefaultTemplate()
+			self.__dateDetectors[byteLines] = dateDetector
+		self.__subscribers = list()
+		## The lines read while a filter was idle, indexed by filter.
+		self.__pending = dict()
+		## False until the file is read for the first time.
+		self.__read = False
+
+	def getFileName(self):
+		return self.__container.getFileName()
+
+	def addSubscriber(self, filter_):
+		try:
+			self.__subLock.acquire()
+			self.__subscribers.append(filter_)
+		finally:
+			self.__subLock.release()
+
+	def delSubscriber(self, filter_):
+		try:
+			self.__subLock.acquire()
+			if filter_ in self.__subscribers:
+				self.__subscribers.remove(filter_)
+			if self.__pending.has_key(filter_):
+				del self.__pending[filter_]
+		finally:
+			self.__subLock.release()
+
+	def getSubscribers(self):
+		try:
+			self.__subLock.acquire()
+			return self.__subscribers[:]
+		finally:
+			self.__subLock.release()
+
+	##
+	# Get the subscribers which are neither idle nor stopped.
+	#
+	# @return a list of filters
+
+	def getActiveSubscribers(self):
+		return [f for f in self.getSubscribers()
+				if f._isActive() and not f.getIdle()]
+
+	##
+	# Keep lines for the subscribers which are idle.
+	#
+	# The oldest lines are dropped beyond MAX_PENDING lines.
+	# @param lines the lines read
+
+	def __keepPending(self, lines):
+		try:
+			self.__subLock.acquire()
+			for f in self.__subscribers:
+				if not f._isActive() or not f.getIdle():
+					continue
+				pending = self.__pending.setdefault(f, list())
+				pending.extend(lines)
+				if len(pending) > self.MAX_PENDING:
+					logSys.warn("Too many lines kept for an idle jail, "
+								"dropping the oldest ones of %s"
+								% self.getFileName())
+					del pending[:len(pending) - self.MAX_PENDING]
+		finally:
+			self.__subLock.release()
+
+	##
+	# Get the lines kept for a subscriber while it was idle.
+	#
+	# @param filter_ the filter
+	# @return a list of lines
+
+	def __popPending(self, filter_):
+		try:
+			self.__subLock.acquire()
+			return self.__pending.pop(filter_, [])
+		finally:
+			self.__subLock.release()
+
+	def getCursor(self):
+		try:
+			self.__lock.acquire()
+			return self.__container.getCursor()
+		finally:
+			self.__lock.release()
+
+	##
+	# Continue from a saved cursor.
+	#
+	# Only possible before the file is read for the first time, the other
+	# filters rely on the position afterwards.
+	# @param cursor the cursor
+	# @return True if the cursor is used
+
+	def setCursor(self, cursor):
+		try:
+			self.__lock.acquire()
+			if self.__read:
+				return False
+			return self.__container.setCursor(cursor)
+		finally:
+			self.__lock.release()
+
+	def isOpen(self):
+		try:
+			self.__lock.acquire()
+			return self.__container.isOpen()
+		finally:
+			self.__lock.release()
+
+	def release(self):
+		try:
+			self.__lock.acquire()
+			self.__container.release()
+		finally:
+			self.__lock.release()
+
+	##
+	# Reads the new lines for all the active subscribed filters.
+	#
+	# The subscribers are checked again before each block of lines, the
+	# reading stops when none of them is active any more.
+	# @param filter_ the filter reading
+	# @return False if the file could not be opened
+
+	def read(self, filter_):
+		try:
+			self.__lock.acquire()
+			self.__read = True
+			container = self.__container
+			try:
+				container.open()
+			except Exception, e:
+				logSys.error("Unable to open %s" % container.getFileName())
+				logSys.exception(e)
+				return False
+			try:
+				subscribers = self.getActiveSubscribers()
+				if not subscribers:
+					return True
+				# Catches up on the lines read while a filter was idle
+				for f in subscribers:
+					self.__process([[f]], self.__popPending(f))
+				# Skips the lines older than the longest findtime when
+				# reading from the start
+				if container.getPos() == 0:
+					findTime = max([f.getFindTime() for f in subscribers])
+					container.seekTime(MyTime.time() - findTime,
+									   self.__dateDetectors[True].getUnixTime)
+				groups = SharedLog.__groups(subscribers)
+				for lines in container.readlines():
+					active = self.getActiveSubscribers()
+					if not active:
+						# All the jails have been stopped or are idle. The
+						# position stays before these lines, so they are
+						# not kept for the idle jails but read again.
+						break
+					self.__keepPending(lines)
+					if active != subscribers:
+						subscribers = active
+						groups = SharedLog.__groups(subscribers)
+					self.__process(groups, lines)
+			finally:
+				container.close()
+			return True
+		finally:
+			self.__lock.release()
+
+	##
+	# Processes lines for groups of filters.
+	#
+	# @param groups the filters grouped by SharedLog.__groups
+	# @param lines the lines
+
+	def __process(self, groups, lines):
+		dateDetectors = self.__dateDetectors
+		for line in lines:
+			# The line and its date, decoded or as read, computed once
+			dated = dict()
+			for members in groups:
+				byteLines = members[0].getByteLines()
+				if not dated.has_key(byteLines):
+					if byteLines:
+						l = line
+					else:
+						l = Filter.decodeLine(line)
+					dated[byteLines] = (l, dateDetectors[byteLines].matchTime(l))
+				l, timeMatch = dated[byteLines]
+				failList = members[0].processDatedLine(
+					l, timeMatch, dateDetectors[byteLines])
+				if failList:
+					for f in members:
+						f.addFailures(failList, line)
+
+	##
+	# Groups the filters which find the same failures.
+	#
+	# @param filters the filters
+	# @return a list of lists of filters
+
+	#@staticmethod
+	def __groups(filters):
+		groups = dict()
+		order = list()
+		for f in filters:
+			key = (tuple(f.getFailRegex()), tuple(f.getIgnoreRegex()),
+				   f.getUseDns(), f.getByteLines())
+			if not groups.has_key(key):
+				groups[key] = list()
+				order.append(key)
+			groups[key].append(f)
+		return [groups[key] for key in order]
+	__groups = staticmethod(__groups)
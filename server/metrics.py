@@ -0,0 +1,227 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: t -*-
+# vi: set ft=python sts=4 ts=4 sw=4 noet :
+
+# This file is part of Fail2Ban.
+#
+# Fail2Ban is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Fail2Ban is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Fail2Ban; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+__copyright__ = "Copyright (c) 2004 Cyril Jaquier"
+__license__ = "GPL"
+
+from threading import Lock
+from jailthread import JailThread
+from mytime import MyTime
+import logging, time, socket, subprocess
+
+# Gets the instance of the logger.
+logSys = logging.getLogger("fail2ban.metrics")
+
+##
+# Metrics sampler.
+#
+# Samples the failure statistics of every jail at a fixed interval and
+# hands them to the exporters. Runs in its own thread so that neither the
+# sampling nor the exporters slow down the processing of the log lines.
+
+class Metrics(JailThread):
+
+	##
+	# Constructor.
+	#
+	# @param jails the Jails object of the server
+
+	def __init__(self, jails):
+		JailThread.__init__(self)
+		self.setDaemon(True)
+		self.__jails = jails
+		self.__lock = Lock()
+		self.__exporters = list()
+		self.setSleepTime(60)
+
+	##
+	# Add an exporter.
+	#
+	# An exporter with the same description is only added once, as the
+	# client sends the exporters again on reload.
+	# @param exporter the exporter
+	# @return True if the exporter is added
+
+	def addExporter(self, exporter):
+		try:
+			self.__lock.acquire()
+			for e in self.__exporters:
+				if str(e) == str(exporter):
+					return False
+			self.__exporters.append(exporter)
+			return True
+		finally:
+			self.__lock.release()
+
+	##
+	# Delete an exporter.
+	#
+	# @param value the exporter description
+	# @return True if the exporter is deleted
+
+	def delExporter(self, value):
+		try:
+			self.__lock.acquire()
+			for e in self.__exporters:
+				if str(e) == value:
+					self.__exporters.remove(e)
+					return True
+			return False
+		finally:
+			self.__lock.release()
+
+	def getExporters(self):
+		try:
+			self.__lock.acquire()
+			return [str(e) for e in self.__exporters]
+		finally:
+			self.__lock.release()
+
+	##
+	# Sample the statistics of all the jails.
+	#
+	# @return a list of tuples (jail, most retry, IP address, total failures)
+	# sorted by jail name
+
+	def sample(self):
+		samples = list()
+		jails = self.__jails.getAll()
+		names = jails.keys()
+		names.sort()
+		for name in names:
+			failManager = jails[name].getFilter().failManager
+			retry, ip = failManager.sampleMostRetry()
+			samples.append((name, retry, ip, failManager.getFailTotal()))
+		return samples
+
+	def run(self):
+		self.setActive(True)
+		while self._isActive():
+			time.sleep(self.getSleepTime())
+			if self.getIdle():
+				continue
+			unixTime = MyTime.time()
+			samples = self.sample()
+			try:
+				self.__lock.acquire()
+				exporters = self.__exporters[:]
+			finally:
+				self.__lock.release()
+			for exporter in exporters:
+				try:
+					exporter.export(unixTime, samples)
+				except Exception, e:
+					logSys.error("Unable to export metrics to %s: %s"
+								 % (exporter, e))
+		logSys.debug("Metrics sampler terminated")
+		return True
+
+	##
+	# Create an exporter from its description.
+	#
+	# The description is "rrd:<file>", "file:<file>" or
+	# "socket:<host>:<port>".
+	# @param value the description
+	# @return the exporter
+
+	#@staticmethod
+	def createExporter(value):
+		s = value.split(':', 1)
+		if len(s) == 2:
+			if s[0] == "rrd":
+				return RRDExporter(s[1])
+			elif s[0] == "file":
+				return FileExporter(s[1])
+			elif s[0] == "socket":
+				host, port = s[1].rsplit(':', 1)
+				return SocketExporter(host, int(port))
+		raise ValueError("Unknown metrics exporter: %s" % value)
+	createExporter = staticmethod(createExporter)
+
+
+##
+# Exporter updating a round-robin database.
+#
+# Stores the highest retry count over all the jails with "rrdtool update".
+# The database must already exist.
+
+class RRDExporter:
+
+	RRDTOOL = "/usr/bin/rrdtool"
+
+	def __init__(self, path):
+		self.__path = path
+
+	def __str__(self):
+		return "rrd:" + self.__path
+
+	def export(self, unixTime, samples):
+		mostRetry = 0
+		for name, retry, ip, total in samples:
+			mostRetry = max(mostRetry, retry)
+		args = [self.RRDTOOL, "update", self.__path,
+				"%d:%d" % (unixTime, mostRetry)]
+		logSys.debug(" ".join(args))
+		retcode = subprocess.call(args)
+		if retcode != 0:
+			raise OSError("%s returned %d" % (self.RRDTOOL, retcode))
+
+
+##
+# Exporter appending the samples to a text file.
+#
+# Writes one line per jail: time, jail, most retry, IP address and total
+# failures.
+
+class FileExporter:
+
+	def __init__(self, path):
+		self.__path = path
+
+	def __str__(self):
+		return "file:" + self.__path
+
+	def export(self, unixTime, samples):
+		f = open(self.__path, "a")
+		try:
+			for name, retry, ip, total in samples:
+				f.write("%d %s %d %s %d\n" % (unixTime, name, retry, ip, total))
+		finally:
+			f.close()
+
+
+##
+# Exporter sending the samples over UDP.
+#
+# Uses the plaintext protocol of Graphite/carbon, one datagram per sample.
+
+class SocketExporter:
+
+	def __init__(self, host, port):
+		self.__address = (host, port)
+		self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	def __str__(self):
+		return "socket:%s:%d" % self.__address
+
+	def export(self, unixTime, samples):
+		for name, retry, ip, total in samples:
+			data = "fail2ban.%s.mostretry %d %d\nfail2ban.%s.failures %d %d\n" \
+				   % (name, retry, unixTime, name, total, unixTime)
+			self.__socket.sendto(data, self.__address)
@@ -29,11 +29,16 @@ __license__ = "GPL"
 
 from threading import Lock, RLock
 from jails import Jails
+from metrics import Metrics
+from cursors import FileCursors
+from loghub import LogHub
+from executor import ActionExecutor
+from action import Action
 from transmitter import Transmitter
 from asyncserver import AsyncServer
 from asyncserver import AsyncServerException
 from common import version
-import logging, logging.handlers, sys, os, signal
+import logging, logging.handlers, sys, os, signal, glob
 
 # Gets the instance of the logger.
 logSys = logging.getLogger("fail2ban.server")
@@ -49,6 +54,10 @@ class Server:
 		self.__daemon = daemon
 		self.__transm = Transmitter(self)
 		self.__asyncServer = AsyncServer(self.__transm)
+		self.__metrics = Metrics(self.__jails)
+		self.__cursors = None
+		self.__logHub = LogHub()
+		self.__executor = ActionExecutor()
 		self.__logLevel = None
 		self.__logTarget = None
 		# Set logging level
@@ -86,12 +95,18 @@ class Server:
 		except IOError, e:
 			logSys.error("Unable to create PID file: %s" % e)
 		
+		# Start the helper executing the action commands while the server
+		# is still small
+		Action.startRunner()
+		
 		# Start the communication
 		logSys.debug("Starting communication")
 		try:
 			self.__asyncServer.start(sock, force)
 		except AsyncServerException, e:
 			logSys.error("Could not start server: %s", e)
+		# The jails are stopped, no more commands
+		Action.stopRunner()
 		# Removes the PID file.
 		try:
 			logSys.debug("Remove PID file %s" % Server.PID_FILE)
@@ -114,13 +129,19 @@ class Server:
 		# are exiting)
 		# See https://github.com/fail2ban/fail2ban/issues/7
 		self.__asyncServer.stop()
+		self.__metrics.stop()
 		# Now stop all the jails
 		self.stopAllJail()
 	
 	def addJail(self, name, backend):
 		self.__jails.add(name, backend)
+		filter_ = self.__jails.getFilter(name)
+		filter_.setCursors(self.__cursors)
+		filter_.setLogHub(self.__logHub)
+		self.__jails.getAction(name).setExecutor(self.__executor)
 		
 	def delJail(self, name):
+		self.__logHub.unsubscribeAll(self.__jails.getFilter(name))
 		self.__jails.remove(name)
 	
 	def startJail(self, name):
@@ -138,6 +159,8 @@ class Server:
 			if self.isAlive(name):
 				self.__jails.get(name).stop()
 				self.delJail(name)
+			if self.__cursors is not None:
+				self.__cursors.save()
 		finally:
 			self.__lock.release()
 	
@@ -171,10 +194,16 @@ class Server:
 		return self.__jails.getFilter(name).getIgnoreIP()
 	
 	def addLogPath(self, name, fileName):
-		self.__jails.getFilter(name).addLogPath(fileName)
+		if glob.has_magic(fileName):
+			self.__jails.getFilter(name).addLogGlob(fileName)
+		else:
+			self.__jails.getFilter(name).addLogPath(fileName)
 	
 	def delLogPath(self, name, fileName):
-		self.__jails.getFilter(name).delLogPath(fileName)
+		if glob.has_magic(fileName):
+			self.__jails.getFilter(name).delLogGlob(fileName)
+		else:
+			self.__jails.getFilter(name).delLogPath(fileName)
 	
 	def getLogPath(self, name):
 		return [m.getFileName()
@@ -210,6 +239,12 @@ class Server:
 	def getUseDns(self, name):
 		return self.__jails.getFilter(name).getUseDns()
 	
+	def setByteLines(self, name, value):
+		self.__jails.getFilter(name).setByteLines(value)
+	
+	def getByteLines(self, name):
+		return self.__jails.getFilter(name).getByteLines()
+	
 	def setMaxRetry(self, name, value):
 		self.__jails.getFilter(name).setMaxRetry(value)
 	
@@ -273,6 +308,36 @@ class Server:
 	
 	def getActionUnban(self, name, action):
 		return self.__jails.getAction(name).getAction(action).getActionUnban()
+	
+	def setActionBanBatch(self, name, action, value):
+		self.__jails.getAction(name).getAction(action).setActionBanBatch(value)
+	
+	def getActionBanBatch(self, name, action):
+		return self.__jails.getAction(name).getAction(action).getActionBanBatch()
+	
+	def setActionUnbanBatch(self, name, action, value):
+		self.__jails.getAction(name).getAction(action).setActionUnbanBatch(value)
+	
+	def getActionUnbanBatch(self, name, action):
+		return self.__jails.getAction(name).getAction(action).getActionUnbanBatch()
+	
+	def setActionCheckTTL(self, name, action, value):
+		self.__jails.getAction(name).getAction(action).setCheckTTL(value)
+	
+	def getActionCheckTTL(self, name, action):
+		return self.__jails.getAction(name).getAction(action).getCheckTTL()
+	
+	def setActionExpires(self, name, action, value):
+		self.__jails.getAction(name).getAction(action).setExpires(value)
+	
+	def getActionExpires(self, name, action):
+		return self.__jails.getAction(name).getAction(action).getExpires()
+	
+	def setActionConcurrency(self, name, action, value):
+		self.__jails.getAction(name).getAction(action).setConcurrency(value)
+	
+	def getActionConcurrency(self, name, action):
+		return self.__jails.getAction(name).getAction(action).getConcurrency()
 		
 	# Status
 	def status(self):
@@ -290,8 +355,78 @@ class Server:
 		finally:
 			self.__lock.release()
 	
-	def statusJail(self, name):
-		return self.__jails.get(name).getStatus()
+	def statusJail(self, name, start = 0, count = None):
+		return self.__jails.get(name).getStatus(start, count)
+	
+	# File cursors
+	
+	##
+	# Set the file keeping the position reached in the log files.
+	#
+	# Applies to the log files added afterwards.
+	# @param value the state file
+	
+	def setCursorFile(self, value):
+		try:
+			self.__lock.acquire()
+			if self.__cursors is not None:
+				self.__cursors.save()
+			self.__cursors = FileCursors(value)
+			for name in self.__jails.getAll():
+				self.__jails.getFilter(name).setCursors(self.__cursors)
+		finally:
+			self.__lock.release()
+	
+	def getCursorFile(self):
+		if self.__cursors is None:
+			return None
+		return self.__cursors.getFileName()
+	
+	# Metrics
+	
+	##
+	# Add a metrics exporter.
+	#
+	# The sampler thread is started with the first exporter.
+	# @param value the exporter description, see Metrics.createExporter()
+	
+	def addMetrics(self, value):
+		try:
+			self.__lock.acquire()
+			self.__metrics.addExporter(Metrics.createExporter(value))
+			if not self.__metrics.isAlive():
+				self.__metrics.start()
+		finally:
+			self.__lock.release()
+	
+	##
+	# Delete a metrics exporter.
+	#
+	# @param value the exporter description or "all"
+	
+	def delMetrics(self, value):
+		if value == "all":
+			for exporter in self.__metrics.getExporters():
+				self.__metrics.delExporter(exporter)
+		elif not self.__metrics.delExporter(value):
+			raise ValueError("Unknown metrics exporter: %s" % value)
+	
+	def getMetrics(self):
+		return self.__metrics.getExporters()
+	
+	def setMetricsInterval(self, value):
+		self.__metrics.setSleepTime(value)
+	
+	def getMetricsInterval(self):
+		return self.__metrics.getSleepTime()
+	
+	# Action executor
+	
+	def setActionWorkers(self, value):
+		self.__executor.setWorkers(value)
+	
+	def getActionWorkers(self):
+		return self.__executor.getWorkers()
 	
 	# Logging
 	
@@ -91,4 +91,18 @@ class FailTicket(Ticket):
 # This class extends the Ticket class. It is mainly used by the BanManager.
 
 class BanTicket(Ticket):
-	pass
+	
+	def __init__(self, ip, time, matches=None):
+		Ticket.__init__(self, ip, time, matches)
+		self.__permanent = False
+	
+	##
+	# Set whether the ban was made with a negative ban time.
+	#
+	# @param value True if the ban never expires
+	
+	def setPermanent(self, value):
+		self.__permanent = value
+	
+	def isPermanent(self):
+		return self.__permanent
@@ -113,6 +113,29 @@ class Transmitter:
 			value = command[1]
 			self.__server.setLogTarget(value)
 			return self.__server.getLogTarget()
+		# File cursors
+		elif name == "cursorfile":
+			value = command[1]
+			self.__server.setCursorFile(value)
+			return self.__server.getCursorFile()
+		# Metrics
+		elif name == "metrics":
+			value = command[1]
+			self.__server.addMetrics(value)
+			return self.__server.getMetrics()
+		elif name == "delmetrics":
+			value = command[1]
+			self.__server.delMetrics(value)
+			return self.__server.getMetrics()
+		elif name == "metricsinterval":
+			value = int(command[1])
+			self.__server.setMetricsInterval(value)
+			return self.__server.getMetricsInterval()
+		# Action executor
+		elif name == "actionworkers":
+			value = int(command[1])
+			self.__server.setActionWorkers(value)
+			return self.__server.getActionWorkers()
 		# Jail
 		elif command[1] == "idle":
 			if command[2] == "on":
@@ -158,6 +181,13 @@ class Transmitter:
 			value = command[2]
 			self.__server.setUseDns(name, value)
 			return self.__server.getUseDns(name)
+		elif command[1] == "bytelines":
+			value = command[2]
+			if value == "true":
+				self.__server.setByteLines(name, True)
+			elif value == "false":
+				self.__server.setByteLines(name, False)
+			return self.__server.getByteLines(name)
 		elif command[1] == "findtime":
 			value = command[2]
 			self.__server.setFindTime(name, int(value))
@@ -217,6 +247,34 @@ class Transmitter:
 			value = command[3]
 			self.__server.setActionUnban(name, act, value)
 			return self.__server.getActionUnban(name, act)
+		elif command[1] == "actionbanbatch":
+			act = command[2]
+			value = command[3]
+			self.__server.setActionBanBatch(name, act, value)
+			return self.__server.getActionBanBatch(name, act)
+		elif command[1] == "actionunbanbatch":
+			act = command[2]
+			value = command[3]
+			self.__server.setActionUnbanBatch(name, act, value)
+			return self.__server.getActionUnbanBatch(name, act)
+		elif command[1] == "actioncheckttl":
+			act = command[2]
+			value = int(command[3])
+			self.__server.setActionCheckTTL(name, act, value)
+			return self.__server.getActionCheckTTL(name, act)
+		elif command[1] == "actionexpires":
+			act = command[2]
+			value = command[3]
+			if value == "true":
+				self.__server.setActionExpires(name, act, True)
+			elif value == "false":
+				self.__server.setActionExpires(name, act, False)
+			return self.__server.getActionExpires(name, act)
+		elif command[1] == "actionconcurrency":
+			act = command[2]
+			value = int(command[3])
+			self.__server.setActionConcurrency(name, act, value)
+			return self.__server.getActionConcurrency(name, act)
 		raise Exception("Invalid command (no set action or not yet implemented)")
 	
 	def __commandGet(self, command):
@@ -226,6 +284,17 @@ class Transmitter:
 			return self.__server.getLogLevel()
 		elif name == "logtarget":
 			return self.__server.getLogTarget()
+		# File cursors
+		elif name == "cursorfile":
+			return self.__server.getCursorFile()
+		# Metrics
+		elif name == "metrics":
+			return self.__server.getMetrics()
+		elif name == "metricsinterval":
+			return self.__server.getMetricsInterval()
+		# Action executor
+		elif name == "actionworkers":
+			return self.__server.getActionWorkers()
 		# Filter
 		elif command[1] == "logpath":
 			return self.__server.getLogPath(name)
@@ -237,6 +306,8 @@ class Transmitter:
 			return self.__server.getIgnoreRegex(name)
 		elif command[1] == "usedns":
 			return self.__server.getUseDns(name)
+		elif command[1] == "bytelines":
+			return self.__server.getByteLines(name)
 		elif command[1] == "findtime":
 			return self.__server.getFindTime(name)
 		elif command[1] == "maxretry":
@@ -261,6 +332,21 @@ class Transmitter:
 		elif command[1] == "actionunban":
 			act = command[2]
 			return self.__server.getActionUnban(name, act)
+		elif command[1] == "actionbanbatch":
+			act = command[2]
+			return self.__server.getActionBanBatch(name, act)
+		elif command[1] == "actionunbanbatch":
+			act = command[2]
+			return self.__server.getActionUnbanBatch(name, act)
+		elif command[1] == "actioncheckttl":
+			act = command[2]
+			return self.__server.getActionCheckTTL(name, act)
+		elif command[1] == "actionexpires":
+			act = command[2]
+			return self.__server.getActionExpires(name, act)
+		elif command[1] == "actionconcurrency":
+			act = command[2]
+			return self.__server.getActionConcurrency(name, act)
 		raise Exception("Invalid command (no get action or not yet implemented)")
 	
 	def status(self, command):
@@ -268,6 +354,13 @@ class Transmitter:
 			return self.__server.status()
 		else:
 			name = command[0]
-			return self.__server.statusJail(name)
+			# Optional paging of the IP list
+			start = 0
+			count = None
+			if len(command) > 1:
+				start = int(command[1])
+			if len(command) > 2:
+				count = int(command[2])
+			return self.__server.statusJail(name, start, count)
 		raise Exception("Invalid command (no status)")
 	
@@ -27,8 +27,14 @@ __date__ = "$Date$"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier"
 __license__ = "GPL"
 
-import unittest, time
+import unittest, time, threading, tempfile, os
 from server.action import Action
+from server.executor import ActionExecutor
+from server.jail import Jail
+from server.ticket import FailTicket
+from server.mytime import MyTime
+from client.configreader import ConfigReader
+from client.actionreader import ActionReader
 
 class ExecuteAction(unittest.TestCase):
 
@@ -47,4 +53,327 @@ class ExecuteAction(unittest.TestCase):
 		self.__action.setActionCheck("[ -e /tmp/fail2ban.test ]")
 		
 		self.assertTrue(self.__action.execActionBan(None))
+
+	def testCommandRunner(self):
+		Action.startRunner()
+		try:
+			self.assertTrue(Action.executeCmd("true"))
+			self.assertFalse(Action.executeCmd("exit 3"))
+			# Commands run in parallel
+			time0 = time.time()
+			threads = [threading.Thread(target = Action.executeCmd,
+										args = ("sleep 0.5",))
+					   for i in range(3)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			self.assertTrue(time.time() - time0 < 1.4)
+			self.assertTrue(Action.executeCmd(u"echo \xe9 > /dev/null"))
+		finally:
+			Action.stopRunner()
+		# Back to os.system()
+		self.assertTrue(Action.executeCmd("true"))
+
+	def testCommandRunnerExited(self):
+		_, name = tempfile.mkstemp('fail2ban', 'action')
+		Action.startRunner()
+		try:
+			# The helper exits while the command runs, which is failed and
+			# not executed again
+			self.assertFalse(Action.executeCmd(
+				"[ -s %s ]; e=$?; echo >> %s; [ $e = 0 ] || kill -9 $PPID"
+				% (name, name)))
+			self.assertEqual(len(open(name).readlines()), 1)
+			# Not sent any more, executed by os.system()
+			self.assertTrue(Action.executeCmd("true"))
+		finally:
+			Action.stopRunner()
+			os.unlink(name)
+
+	def testCheckCached(self):
+		_, name = tempfile.mkstemp('fail2ban', 'action')
+		try:
+			self.__action.setActionCheck("echo >> %s" % name)
+			self.__action.setActionBan("true")
+			def checks():
+				return len(open(name).readlines())
+			for i in range(3):
+				self.assertTrue(self.__action.execActionBan(None))
+			self.assertEqual(checks(), 1)
+			# A failure invalidates the check
+			self.__action.setActionBan("false")
+			self.assertFalse(self.__action.execActionBan(None))
+			self.assertEqual(checks(), 1)
+			self.__action.setActionBan("true")
+			self.assertTrue(self.__action.execActionBan(None))
+			self.assertEqual(checks(), 2)
+			# Once expired, the check runs in the background
+			self.__action.setCheckTTL(0.2)
+			time.sleep(0.3)
+			self.assertTrue(self.__action.execActionBan(None))
+			time0 = time.time()
+			while checks() < 3 and time.time() < time0 + 2:
+				time.sleep(0.1)
+			self.assertEqual(checks(), 3)
+			# 0 checks every time
+			self.__action.setCheckTTL(0)
+			self.assertTrue(self.__action.execActionBan(None))
+			self.assertEqual(checks(), 4)
+		finally:
+			os.unlink(name)
+
+	def testExecuteActionBanBatch(self):
+		_, name = tempfile.mkstemp('fail2ban', 'action')
+		try:
+			aInfos = [{"ip": "192.0.2.1"}, {"ip": "192.0.2.2"}]
+			# Without batched command, "ban" runs for each IP
+			self.__action.setActionBan("echo <ip> >> %s" % name)
+			self.assertTrue(self.__action.execActionBanBatch(aInfos))
+			self.assertEqual(open(name).read(), "192.0.2.1\n192.0.2.2\n")
+			self.__action.setActionBanBatch("echo <ips> > %s" % name)
+			self.assertTrue(self.__action.execActionBanBatch(aInfos))
+			self.assertEqual(open(name).read(), "192.0.2.1 192.0.2.2\n")
+		finally:
+			os.unlink(name)
+
+	def testExecuteActionBanBatchFailed(self):
+		_, name = tempfile.mkstemp('fail2ban', 'action')
+		try:
+			aInfos = [{"ip": "192.0.2.1"}, {"ip": "192.0.2.2"}]
+			self.__action.setActionBan(
+				"[ <ip> != 192.0.2.1 ] && echo <ip> >> %s" % name)
+			self.__action.setActionBanBatch("false")
+			# The addresses are banned one by one when the batch fails
+			self.assertFalse(self.__action.execActionBanBatch(aInfos))
+			self.assertEqual(open(name).read(), "192.0.2.2\n")
+		finally:
+			os.unlink(name)
+
+	def testExecuteActionUnbanBatchFailed(self):
+		_, name = tempfile.mkstemp('fail2ban', 'action')
+		try:
+			aInfos = [{"ip": "192.0.2.1"}, {"ip": "192.0.2.2"}]
+			self.__action.setActionUnban(
+				"[ <ip> != 192.0.2.1 ] && echo <ip> >> %s" % name)
+			self.__action.setActionUnbanBatch("false")
+			# The addresses are unbanned one by one when the batch fails
+			self.assertFalse(self.__action.execActionUnbanBatch(aInfos))
+			self.assertEqual(open(name).read(), "192.0.2.2\n")
+		finally:
+			os.unlink(name)
 		
+
+class Executor(unittest.TestCase):
+
+	def setUp(self):
+		"""Call before every test case."""
+		self.__executor = ActionExecutor(2)
+		self.__log = []
+		self.__lock = threading.Lock()
+
+	def __job(self, name, delay = 0):
+		self.__lock.acquire()
+		self.__log.append(name + " start")
+		self.__lock.release()
+		time.sleep(delay)
+		self.__lock.acquire()
+		self.__log.append(name + " end")
+		self.__lock.release()
+
+	def testActionsConcurrent(self):
+		slow = Action("slow")
+		fast = Action("fast")
+		self.__executor.submit(slow, self.__job, ("slow", 0.5))
+		self.__executor.submit(fast, self.__job, ("fast",))
+		self.__executor.wait(fast)
+		# The fast action does not wait for the slow one
+		self.assertEqual(self.__log.count("fast end"), 1)
+		self.assertFalse("slow end" in self.__log)
+		self.__executor.wait(slow)
+		self.assertEqual(self.__log[-1], "slow end")
+
+	def testActionOrder(self):
+		action = Action("action")
+		action.setConcurrency(2)
+		self.__executor.submit(action, self.__job, ("start", 0.1))
+		self.__executor.submit(action, self.__job, ("ban a", 0.2), ("a",))
+		self.__executor.submit(action, self.__job, ("ban b", 0.1), ("b",))
+		self.__executor.submit(action, self.__job, ("unban a",), ("b", "a"))
+		self.__executor.wait(action)
+		log = self.__log
+		# "start" runs alone
+		self.assertEqual(log[:2], ["start start", "start end"])
+		# different addresses run in parallel
+		self.assertTrue(log.index("ban b start") < log.index("ban a end"))
+		# but not the commands for the same address
+		self.assertTrue(log.index("ban a end") < log.index("unban a start"))
+
+	def testActionsOverlap(self):
+		_, name = tempfile.mkstemp('fail2ban', 'action')
+		jail = Jail("test", "polling")
+		actions = jail.getAction()
+		actions.setSleepTime(0.1)
+		actions.setExecutor(self.__executor)
+		actions.addAction("slow")
+		action = actions.getAction("slow")
+		action.setConcurrency(2)
+		action.setActionBan("echo <ip> start >> %s; sleep 0.5; echo <ip> end >> %s"
+							% (name, name))
+		def waitLine(line):
+			time0 = time.time()
+			while time.time() < time0 + 5:
+				if line in open(name).read().splitlines():
+					return
+				time.sleep(0.05)
+		try:
+			actions.start()
+			jail.putFailTicket(FailTicket("192.0.2.1", MyTime.time()))
+			waitLine("192.0.2.1 start")
+			jail.putFailTicket(FailTicket("192.0.2.2", MyTime.time()))
+			waitLine("192.0.2.2 start")
+			actions.stop()
+			actions.join()
+			log = open(name).read().splitlines()
+			# The bans of different addresses run in parallel
+			self.assertTrue(log.index("192.0.2.2 start") < log.index("192.0.2.1 end"))
+		finally:
+			os.unlink(name)
+
+class IPSetAction(unittest.TestCase):
+
+	def setUp(self):
+		"""Call before every test case."""
+		self.__dir = tempfile.mkdtemp('fail2ban')
+		self.__log = os.path.join(self.__dir, "calls")
+		# Stand-in binaries recording their calls
+		for name in ("ipset", "iptables"):
+			path = os.path.join(self.__dir, name)
+			f = open(path, "w")
+			f.write('#!/bin/sh\necho "%s $@" >> %s\n' % (name, self.__log)
+					+ '[ "$1" = restore ] && cat >> %s\nexit 0\n' % self.__log)
+			f.close()
+			os.chmod(path, 0755)
+		self.__path = os.environ["PATH"]
+		os.environ["PATH"] = self.__dir + ":" + self.__path
+		self.__baseDir = ConfigReader.getBaseDir()
+		ConfigReader.setBaseDir("config")
+
+	def tearDown(self):
+		"""Call after every test case."""
+		os.environ["PATH"] = self.__path
+		ConfigReader.setBaseDir(self.__baseDir)
+		for name in os.listdir(self.__dir):
+			os.unlink(os.path.join(self.__dir, name))
+		os.rmdir(self.__dir)
+
+	def __addAction(self, actions):
+		reader = ActionReader(["iptables-ipset", {"name": "test"}], "test")
+		self.assertTrue(reader.read())
+		reader.getOptions({})
+		for cmd in reader.convert():
+			if cmd[2] == "addaction":
+				actions.addAction(cmd[3])
+				continue
+			action = actions.getAction(cmd[3])
+			if cmd[2] == "setcinfo":
+				action.setCInfo(cmd[4], cmd[5])
+			elif cmd[2] == "actionexpires":
+				action.setExpires(cmd[4] == "true")
+			else:
+				setter = {"actionstart": action.setActionStart,
+						  "actionstop": action.setActionStop,
+						  "actioncheck": action.setActionCheck,
+						  "actionban": action.setActionBan,
+						  "actionunban": action.setActionUnban,
+						  "actionbanbatch": action.setActionBanBatch,
+						  "actionunbanbatch": action.setActionUnbanBatch}[cmd[2]]
+				setter(cmd[4])
+
+	def __waitBanned(self, actions, count):
+		time0 = time.time()
+		while time.time() < time0 + 5:
+			if actions.status()[0][1] == count:
+				return
+			time.sleep(0.1)
+
+	def testExpiredNotUnbanned(self):
+		jail = Jail("test", "polling")
+		actions = jail.getAction()
+		actions.setBanTime(600)
+		self.__addAction(actions)
+		now = MyTime.time()
+		jail.putFailTicket(FailTicket("192.0.2.1", now))
+		actions.start()
+		self.__waitBanned(actions, 1)
+		# The ban expires
+		MyTime.setTime(now + 700)
+		try:
+			self.__waitBanned(actions, 0)
+		finally:
+			MyTime.setTime(now)
+		actions.stop()
+		actions.join()
+		calls = open(self.__log).read().splitlines()
+		self.assertEqual(calls[0],
+			"ipset create fail2ban-test hash:ip timeout 600 -exist")
+		self.assertTrue(
+			"add fail2ban-test 192.0.2.1 timeout 600 -exist" in calls)
+		# The set removes the address, no unban command
+		self.assertFalse([c for c in calls if c.find("del") >= 0])
+		self.assertEqual(calls[-1], "ipset destroy fail2ban-test")
+
+	def testPermanent(self):
+		jail = Jail("test", "polling")
+		actions = jail.getAction()
+		actions.setBanTime(-1)
+		self.__addAction(actions)
+		now = MyTime.time()
+		jail.putFailTicket(FailTicket("192.0.2.1", now))
+		actions.start()
+		self.__waitBanned(actions, 1)
+		# The ban was permanent in the set, it is removed on expiry once
+		# the ban time is positive
+		actions.setBanTime(600)
+		MyTime.setTime(now + 700)
+		try:
+			self.__waitBanned(actions, 0)
+		finally:
+			MyTime.setTime(now)
+		actions.stop()
+		actions.join()
+		calls = open(self.__log).read().splitlines()
+		self.assertEqual(calls[0],
+			"ipset create fail2ban-test hash:ip timeout 0 -exist")
+		self.assertTrue(
+			"add fail2ban-test 192.0.2.1 timeout 0 -exist" in calls)
+		self.assertTrue("del fail2ban-test 192.0.2.1 -exist" in calls)
+
+	def testBanTimeChanged(self):
+		jail = Jail("test", "polling")
+		actions = jail.getAction()
+		actions.setBanTime(600)
+		self.__addAction(actions)
+		now = MyTime.time()
+		jail.putFailTicket(FailTicket("192.0.2.1", now))
+		actions.start()
+		self.__waitBanned(actions, 1)
+		# The address is added again with the time remaining under the new
+		# ban time
+		MyTime.setTime(now + 100)
+		try:
+			actions.setBanTime(3600)
+		finally:
+			MyTime.setTime(now)
+		actions.setBanTime(-1)
+		actions.stop()
+		actions.join()
+		calls = open(self.__log).read().splitlines()
+		self.assertTrue(
+			"add fail2ban-test 192.0.2.1 timeout 600 -exist" in calls)
+		self.assertTrue(
+			"ipset add fail2ban-test 192.0.2.1 timeout 3500 -exist" in calls)
+		self.assertTrue(
+			"ipset add fail2ban-test 192.0.2.1 timeout 0 -exist" in calls)
+		# Unbanned when the jail stops
+		self.assertTrue("del fail2ban-test 192.0.2.1 -exist" in calls)
@@ -49,6 +49,27 @@ class AddFailure(unittest.TestCase):
 		self.assertFalse(self.__banManager.addBanTicket(self.__ticket))
 		self.assertEqual(self.__banManager.size(), 1)
 		
+	def testUnBanList(self):
+		self.__banManager.setBanTime(600)
+		for ip, t in (("192.0.2.1", 1167606300.0), ("192.0.2.2", 1167605000.0),
+					  ("192.0.2.3", 1167606000.0)):
+			self.assertTrue(self.__banManager.addBanTicket(BanTicket(ip, t)))
+		self.assertEqual(self.__banManager.getBanList(),
+						 ["192.0.2.2", "193.168.0.128", "192.0.2.3", "192.0.2.1"])
+		self.assertEqual(self.__banManager.getBanList(1, 2),
+						 ["193.168.0.128", "192.0.2.3"])
+		self.assertEqual(self.__banManager.getBanList(3, 2), ["192.0.2.1"])
+		unBan = self.__banManager.unBanList(1167606600.0)
+		self.assertEqual([t.getIP() for t in unBan],
+						 ["192.0.2.2", "193.168.0.128"])
+		self.assertEqual(self.__banManager.size(), 2)
+		self.assertEqual(self.__banManager.unBanList(1167606600.0), [])
+		# Unbanned addresses can be banned again
+		self.assertTrue(self.__banManager.addBanTicket(self.__ticket))
+		self.assertEqual(len(self.__banManager.flushBanList()), 3)
+		self.assertEqual(self.__banManager.size(), 0)
+		self.assertEqual(self.__banManager.getBanTotal(), 5)
+
 	def _testInListOK(self):
 		ticket = BanTicket('193.168.0.128', 1167605999.0)
 		self.assertTrue(self.__banManager.inBanList(ticket))
@@ -27,9 +27,10 @@ __date__ = "$Date$"
 __copyright__ = "Copyright (c) 2004 Cyril Jaquier"
 __license__ = "GPL"
 
-import unittest
+import unittest, time
 from server.datedetector import DateDetector
-from server.datetemplate import DateTemplate
+from server.datetemplate import DateTemplate, DateStrptime
+from server.mytime import MyTime
 
 class DateDetectorTest(unittest.TestCase):
 
@@ -78,6 +79,72 @@ class DateDetectorTest(unittest.TestCase):
 			self.assertEqual(self.__datedetector.getTime(log)[:6], date[:6])
 			self.assertEqual(self.__datedetector.getUnixTime(log), dateUnix)
 
+	def testMatchTimeReuse(self):
+		log = "Jan 23 21:59:59 [sshd] error: PAM: Authentication failure"
+		dateUnix = 1106513999.0
+
+		match = self.__datedetector.matchTime(log)
+		self.assertEqual(match.group(), "Jan 23 21:59:59")
+		self.assertEqual(self.__datedetector.getUnixTime(match.group(), match), dateUnix)
+		# the date was not searched again
+		self.assertEqual(self.__datedetector.getTemplates()[0].getHits(), 1)
+
+	def testTemplateOrder(self):
+		log = "[31/Oct/2006:09:22:55 -0000] error: PAM: Authentication failure"
+		for i in range(3):
+			self.assertNotEqual(self.__datedetector.matchTime(log), None)
+		template = self.__datedetector.getTemplates()[0]
+		self.assertEqual(template.getName(), "Day/MONTH/Year:Hour:Minute:Second")
+		self.assertEqual(template.getHits(), 3)
+		# other formats are still recognized
+		log = "Jan 23 21:59:59 [sshd] error: PAM: Authentication failure"
+		self.assertEqual(self.__datedetector.matchTime(log).group(), "Jan 23 21:59:59")
+		self.assertEqual(self.__datedetector.getUnixTime(log), 1106513999.0)
+
+	def testFastUnixTime(self):
+		"""Times computed from the named groups equal those from strptime
+		"""
+		times = (1104537600,	# new year
+				 1111885200 - 1, 1111885200, 1111885200 + 1800, # DST starts
+				 1109635199,	# end of February
+				 1124013599)
+		# local time is ambiguous once DST ends, strptime picks the first
+		ambiguous = (1130634000 - 1, 1130634000, 1130634000 + 1800)
+		for template in self.__datedetector.getTemplates():
+			if not isinstance(template, DateStrptime) \
+					or not "(?P<d>" in template.getRegex():
+				continue
+			for t in times + ambiguous:
+				log = time.strftime(template.getPattern(), time.localtime(t)) \
+					  + " [sshd] error: PAM: Authentication failure"
+				self.assertEqual(template.getUnixTime(log),
+								 time.mktime(template.getDate(log)))
+				if "(?P<Y>" in template.getRegex() and not t in ambiguous:
+					self.assertEqual(template.getUnixTime(log), t)
+
+	def testUnixTimeCache(self):
+		template = self.__datedetector.getTemplates()[0]
+		self.assertEqual(template.getName(), "MONTH Day Hour:Minute:Second")
+		log = "Aug 14 12:30:00 [sshd] error: PAM: Authentication failure"
+		now = MyTime.time()
+		try:
+			# in the future, so it is taken from last year
+			self.assertEqual(template.getUnixTime(log), 1092479400.0)
+			MyTime.setTime(now + 3600)
+			self.assertEqual(template.getUnixTime(log), 1124015400.0)
+			# same day, the cached value is used
+			template._getUnixTime = None
+			self.assertEqual(template.getUnixTime(log), 1124015400.0)
+			del template._getUnixTime
+			# clock went backwards
+			MyTime.setTime(now)
+			self.assertEqual(template.getUnixTime(log), 1092479400.0)
+			# next year
+			MyTime.setTime(now + 366 * 86400)
+			self.assertEqual(template.getUnixTime(log), 1155551400.0)
+		finally:
+			MyTime.setTime(now)
+
 #	def testDefaultTempate(self):
 #		self.__datedetector.setDefaultRegex("^\S{3}\s{1,2}\d{1,2} \d{2}:\d{2}:\d{2}")
 #		self.__datedetector.setDefaultPattern("%b %d %H:%M:%S")
@@ -75,6 +75,28 @@ class AddFailure(unittest.TestCase):
 		self.__failManager.cleanup(timestamp)
 		self.assertEqual(self.__failManager.size(), 2)
 	
+	def testCleanupSeenAgain(self):
+		self.__failManager.addFailure(FailTicket('100.100.10.10', 1167605000.0))
+		self.__failManager.cleanup(1167605500.0)
+		self.assertEqual(self.__failManager.size(), 3)
+		self.__failManager.cleanup(1167605990.0)
+		self.assertEqual(self.__failManager.size(), 2)
+		# Banned addresses are not in the list anymore
+		self.__failManager.toBanBatch()
+		self.__failManager.addFailure(FailTicket('87.142.124.10', 1167606500.0))
+		self.__failManager.cleanup(1167606700.0)
+		self.assertEqual(self.__failManager.size(), 1)
+		self.__failManager.cleanup(1167607200.0)
+		self.assertEqual(self.__failManager.size(), 0)
+
+	def testSampleMostRetry(self):
+		self.assertEqual(self.__failManager.sampleMostRetry(),
+						 (5, "193.168.0.128"))
+		self.assertEqual(self.__failManager.sampleMostRetry(), (0, None))
+		self.__failManager.addFailure(FailTicket('87.142.124.10', 1167605999.0))
+		self.assertEqual(self.__failManager.sampleMostRetry(),
+						 (4, "87.142.124.10"))
+
 	def testbanOK(self):
 		self.__failManager.setMaxRetry(5)
 		#ticket = FailTicket('193.168.0.128', None)
@@ -85,6 +107,19 @@ class AddFailure(unittest.TestCase):
 		self.__failManager.setMaxRetry(10)
 		self.assertRaises(FailManagerEmpty, self.__failManager.toBan)
 
+	def testBanBatch(self):
+		tickets = self.__failManager.toBanBatch()
+		self.assertEqual(sorted([t.getIP() for t in tickets]),
+						 ["193.168.0.128", "87.142.124.10"])
+		self.assertEqual(self.__failManager.toBanBatch(), [])
+		self.assertEqual(self.__failManager.size(), 1)
+		# Lowering maxretry makes the remaining address ready
+		self.__failManager.setMaxRetry(1)
+		tickets = self.__failManager.toBanBatch()
+		self.assertEqual([t.getIP() for t in tickets], ["100.100.10.10"])
+		self.assertEqual(tickets[0].getAttempt(), 1)
+		self.assertRaises(FailManagerEmpty, self.__failManager.toBan)
+
 	def testWindow(self):
 		ticket = self.__failManager.toBan()
 		self.assertNotEqual(ticket.getIP(), "100.100.10.10")
@@ -26,11 +26,15 @@ import unittest
 import os
 import time
 import tempfile
+import threading
 
-from server.filterpoll import FilterPoll
-from server.filter import FileFilter, DNSUtils
+from server.filterpoll import FilterPoll, PollScheduler
+from server.filter import FileFilter, FileContainer, DNSUtils
 from server.failmanager import FailManager
 from server.failmanager import FailManagerEmpty
+from server.failregex import FailRegex, RegexSet
+from server.cursors import FileCursors
+from server.loghub import LogHub
 
 #
 # Useful helpers
@@ -132,6 +136,24 @@ class IgnoreIP(unittest.TestCase):
 		self.filter.addIgnoreIP("www.epfl.ch")
 		self.assertFalse(self.filter.inIgnoreIPList("127.177.50.10"))
 
+	def testIgnoreIPCIDR(self):
+		self.filter.addIgnoreIP("10.0.0.0/8")
+		self.filter.addIgnoreIP("192.168.1.0/24")
+		self.filter.addIgnoreIP("192.168.2.0/24")
+		self.filter.addIgnoreIP("192.168.1.128/25")
+		self.filter.addIgnoreIP("1.2.3.4/0x")
+		for ip in "10.0.0.0", "10.255.255.255", "192.168.1.0", \
+				"192.168.2.255", "192.168.1.200":
+			self.assertTrue(self.filter.inIgnoreIPList(ip))
+		for ip in "9.255.255.255", "11.0.0.0", "192.168.0.255", \
+				"192.168.3.0", "1.2.3.4", "abcdef":
+			self.assertFalse(self.filter.inIgnoreIPList(ip))
+		self.filter.delIgnoreIP("192.168.2.0/24")
+		self.assertFalse(self.filter.inIgnoreIPList("192.168.2.1"))
+		self.assertTrue(self.filter.inIgnoreIPList("192.168.1.1"))
+		self.assertEqual(self.filter.getIgnoreIP(),
+			["10.0.0.0/8", "192.168.1.0/24", "192.168.1.128/25", "1.2.3.4/0x"])
+
 
 class LogFile(unittest.TestCase):
 
@@ -149,9 +171,276 @@ class LogFile(unittest.TestCase):
 	#def testOpen(self):
 	#	self.filter.openLogFile(LogFile.FILENAME)
 
-	def testIsModified(self):
-		self.assertTrue(self.filter.isModified(LogFile.FILENAME))
-
+	def testGetStats(self):
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		f = open(name, 'w')
+		try:
+			stats = PollScheduler.getStats(name)
+			self.assertEqual(PollScheduler.getStats(name), stats)
+			# written
+			f.write("line 1\n")
+			f.flush()
+			self.assertNotEqual(PollScheduler.getStats(name), stats)
+			stats = PollScheduler.getStats(name)
+			# replaced by a file of the same size
+			os.rename(name, name + '.1')
+			open(name, 'w').write("line 2\n")
+			self.assertNotEqual(PollScheduler.getStats(name), stats)
+			os.unlink(name + '.1')
+			os.unlink(name)
+			self.assertRaises(OSError, PollScheduler.getStats, name)
+		finally:
+			_killfile(f, name)
+
+	def testPollSchedulerAddWatch(self):
+		class Watcher:
+			def __init__(self):
+				self.notified = threading.Event()
+			def getSleepTime(self):
+				return 10
+			def notify(self, path):
+				self.notified.set()
+			def notifyError(self, path):
+				pass
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		scheduler = PollScheduler()
+		scheduler.start()
+		first, second = Watcher(), Watcher()
+		try:
+			scheduler.addWatch(first, name)
+			first.notified.wait(2)
+			self.assertTrue(first.notified.isSet())
+			# A filter added later is notified without a write
+			scheduler.addWatch(second, name)
+			second.notified.wait(2)
+			self.assertTrue(second.notified.isSet())
+		finally:
+			scheduler.delWatch(first, name)
+			scheduler.delWatch(second, name)
+			os.unlink(name)
+
+	def testPollResumed(self):
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		filter_ = FilterPoll(None)
+		notified = []
+		filter_.notify = notified.append
+		try:
+			filter_.addLogPath(name)
+			time0 = time.time()
+			while not notified and time.time() < time0 + 2:
+				time.sleep(0.1)
+			del notified[:]
+			# The files are read again when the jail is resumed
+			filter_.setIdle(True)
+			filter_.setIdle(False)
+			self.assertEqual(notified, [name])
+		finally:
+			filter_.delLogPath(name)
+			os.unlink(name)
+
+	def testReadLinesPartial(self):
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		f = open(name, 'w')
+		try:
+			f.write("line 1\nline 2\nline 3\nlin")
+			f.flush()
+			container = FileContainer(name)
+			container.BLOCK_SIZE = 5
+			container.open()
+			batches = list(container.readlines())
+			container.close()
+			self.assertEqual(sum(batches, []),
+							 ["line 1\n", "line 2\n", "line 3\n"])
+			self.assertTrue(len(batches) > 1)
+			# The rest of the line is written later
+			f.write("e 4\nline 5\n")
+			f.flush()
+			container.open()
+			batches = container.readlines()
+			# Lines of a batch which is not processed are read again
+			self.assertEqual(batches.next(), ["line 4\n"])
+			container.close()
+			container.open()
+			self.assertEqual(container.readline(), "line 4\n")
+			self.assertEqual(sum(container.readlines(), []), ["line 5\n"])
+			self.assertEqual(container.readline(), "")
+			container.close()
+		finally:
+			_killfile(f, name)
+
+
+	def testKeepOpen(self):
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		f = open(name, 'w')
+		try:
+			f.write("line 1\n")
+			f.flush()
+			container = FileContainer(name)
+			container.open()
+			self.assertEqual(container.readline(), "line 1\n")
+			container.close()
+			f.write("line 2\n")
+			f.flush()
+			container.open()
+			self.assertEqual(container.readline(), "line 2\n")
+			container.close()
+			# Rotated: the path points to a new file, the lines written to
+			# the old one meanwhile are read first
+			os.rename(name, name + '.1')
+			f.write("line 2b\n")
+			f.close()
+			f = open(name, 'w')
+			f.write("line 3\n")
+			f.flush()
+			container.open()
+			self.assertEqual(sum(container.readlines(), []),
+							 ["line 2b\n", "line 3\n"])
+			container.close()
+			# Truncated in place (copytruncate)
+			f.truncate(0)
+			f.seek(0)
+			f.write("l4\n")
+			f.flush()
+			container.open()
+			self.assertEqual(container.readline(), "l4\n")
+			container.close()
+			# Truncated and written again past the position
+			f.truncate(0)
+			f.seek(0)
+			f.write("line 5\nline 6\n")
+			f.flush()
+			container.open()
+			self.assertEqual(sum(container.readlines(), []),
+							 ["line 5\n", "line 6\n"])
+			container.close()
+			container.release()
+		finally:
+			_killfile(f, name)
+			_killfile(None, name + '.1')
+
+	def testSeekTime(self):
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		f = open(name, 'w')
+		try:
+			for i in xrange(1000):
+				f.write("%d line\n" % (1000 + i))
+				if i % 10 == 0:
+					f.write("no date\n")
+			f.flush()
+			def getTime(line):
+				if line.startswith("no"):
+					return None
+				return int(line.split()[0])
+			container = FileContainer(name)
+			container.BLOCK_SIZE = 50
+			container.open()
+			container.seekTime(1500, getTime)
+			lines = sum(container.readlines(), [])
+			container.close()
+			self.assertEqual(lines[-1], "1999 line\n")
+			first = [l for l in lines if getTime(l) is not None][0]
+			self.assertTrue(1490 <= getTime(first) <= 1500)
+			# Reading continues from the saved position
+			container.open()
+			container.seekTime(1600, getTime)
+			self.assertEqual(container.readline(), "")
+			container.close()
+		finally:
+			_killfile(f, name)
+
+	def testCursors(self):
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		_, state = tempfile.mkstemp('fail2ban', 'cursors')
+		os.unlink(state)
+		f = open(name, 'w')
+		try:
+			f.write("line 1\nline 2\n")
+			f.flush()
+			cursors = FileCursors(state)
+			self.filter = FilterPoll(None)
+			self.filter.setCursors(cursors)
+			self.filter.addLogPath(name)
+			self.filter.setActive(True)
+			self.filter.getFailures(name)
+			cursors.save()
+			# After a restart the file is read from the saved position
+			self.filter = FilterPoll(None)
+			self.filter.setCursors(FileCursors(state))
+			self.filter.addLogPath(name)
+			container = self.filter.getFileContainer(name)
+			self.assertEqual(container.getCursor()[2], 14)
+			# but not if it was rotated since
+			f.close()
+			f = open(name, 'w')
+			f.write("line 3\nline 4\nline 5\n")
+			f.flush()
+			self.filter = FilterPoll(None)
+			self.filter.setCursors(FileCursors(state))
+			self.filter.addLogPath(name)
+			container = self.filter.getFileContainer(name)
+			self.assertEqual(container.getCursor()[2], 0)
+		finally:
+			_killfile(f, name)
+			_killfile(None, state)
+
+	def testLogGlob(self):
+		dirname = tempfile.mkdtemp('fail2ban')
+		pattern = os.path.join(dirname, "*.log")
+		def path(name):
+			return os.path.join(dirname, name)
+		def logPaths():
+			paths = [c.getFileName() for c in self.filter.getLogPath()]
+			paths.sort()
+			return paths
+		try:
+			open(path("a.log"), "w").close()
+			open(path("a.txt"), "w").close()
+			self.filter = FileFilter(None)
+			self.filter.MAX_GLOB_FILES = 2
+			self.filter.addLogGlob(pattern)
+			self.assertEqual(logPaths(), [path("a.log")])
+			self.assertTrue(self.filter.isLogGlobDir(dirname))
+			# New files are added up to MAX_GLOB_FILES
+			open(path("b.log"), "w").close()
+			open(path("c.log"), "w").close()
+			self.filter.refreshLogGlobs()
+			self.assertEqual(logPaths(), [path("a.log"), path("b.log")])
+			# and removed ones are dropped
+			os.unlink(path("a.log"))
+			self.filter.refreshLogGlobs()
+			self.assertEqual(logPaths(), [path("b.log"), path("c.log")])
+			self.filter.delLogGlob(pattern)
+			self.assertEqual(logPaths(), [])
+			self.assertFalse(self.filter.isLogGlobDir(dirname))
+		finally:
+			for name in os.listdir(dirname):
+				os.unlink(path(name))
+			os.rmdir(dirname)
+
+	def testLogGlobRotated(self):
+		dirname = tempfile.mkdtemp('fail2ban')
+		name = os.path.join(dirname, "a.log")
+		try:
+			f = _copy_lines_between_files(GetFailures.FILENAME_01, name, n=14,
+										  mode='w')
+			self.filter = FileFilter(None)
+			self.filter.setActive(True)
+			self.filter.addFailRegex("failure for kevin from <HOST>")
+			self.filter.addLogGlob(os.path.join(dirname, "*.log"))
+			self.filter.getFailures(name)
+			self.assertEqual(self.filter.failManager.getFailTotal(), 2)
+			# Renamed out of the pattern, the lines written before are read
+			# when the file is dropped
+			os.rename(name, name + ".1")
+			_copy_lines_between_files(GetFailures.FILENAME_01, f, skip=14)
+			f.close()
+			self.filter.refreshLogGlobs()
+			self.assertFalse(self.filter.containsLogPath(name))
+			self.assertEqual(self.filter.failManager.getFailTotal(), 3)
+		finally:
+			for name in os.listdir(dirname):
+				os.unlink(os.path.join(dirname, name))
+			os.rmdir(dirname)
 
 
 def get_monitor_failures_testcase(Filter_):
@@ -179,11 +468,12 @@ def get_monitor_failures_testcase(Filter_):
 			  % (Filter_, hasattr(self, 'name') and self.name or 'tempfile')
 
 		def isModified(self, delay=2.):
-			"""Wait up to `delay` sec to assure that it was modified or not
+			"""Wait up to `delay` sec to assure that it was notified or not
 			"""
 			time0 = time.time()
 			while time.time() < time0 + delay:
-				if self.filter.isModified(self.name):
+				if self.name in self.notified:
+					del self.notified[:]
 					return True
 				time.sleep(0.1)
 			return False
@@ -193,10 +483,11 @@ def get_monitor_failures_testcase(Filter_):
 			return not self.isModified(0.4)
 
 		def _testNewChangeViaIsModified(self):
-			if not hasattr(self.filter, 'isModified'):
+			if not hasattr(self.filter, 'notify'):
 				raise unittest.SkipTest(
-					"%s does not have isModified (present only in poll atm"
-					% (self.filter,))
+					"%s is not notified of changes" % (self.filter,))
+			self.notified = []
+			self.filter.notify = self.notified.append
 			# it is a brand new one -- so first we think it is modified
 			self.assertTrue(self.isModified())
 			# but not any longer
@@ -223,6 +514,89 @@ def get_monitor_failures_testcase(Filter_):
 			_killfile(self.name, self.name + '.old')
 			pass
 
+		def testNewChangeViaNotify(self):
+			if not hasattr(self.filter, 'notify'):
+				raise unittest.SkipTest(
+					"%s is not notified of changes" % (self.filter,))
+			notified = []
+			self.filter.notify = notified.append
+			def waitNotified(delay=2.):
+				time0 = time.time()
+				while time.time() < time0 + delay and not notified:
+					time.sleep(0.1)
+				return notified and notified.pop() == self.name
+			self.file.write("line\n")
+			self.file.flush()
+			self.assertTrue(waitNotified())
+			# a new file is reported as well on rotation
+			os.rename(self.name, self.name + '.old')
+			self.file.close()
+			self.file = open(self.name, 'a')
+			self.assertTrue(waitNotified())
+			_killfile(self.name, self.name + '.old')
+			self.filter.delLogPath(self.name)
+
+		def testSymlinkViaNotify(self):
+			if not hasattr(self.filter, 'notify'):
+				raise unittest.SkipTest(
+					"%s is not notified of changes" % (self.filter,))
+			# the link is in another directory than the file
+			dirname = tempfile.mkdtemp("fail2ban")
+			link = os.path.join(dirname, "link.log")
+			os.symlink(self.name, link)
+			notified = []
+			self.filter.notify = notified.append
+			def waitNotified(delay=2.):
+				time0 = time.time()
+				while time.time() < time0 + delay and not notified:
+					time.sleep(0.1)
+				return link in notified
+			try:
+				self.filter.addLogPath(link)
+				self.assertTrue(self.filter.containsLogPath(link))
+				# a new watch may be reported at once
+				waitNotified(0.4)
+				del notified[:]
+				self.file.write("line\n")
+				self.file.flush()
+				self.assertTrue(waitNotified(4.))
+				self.filter.delLogPath(link)
+			finally:
+				os.unlink(link)
+				os.rmdir(dirname)
+
+		def testDirWatchViaNotify(self):
+			if not hasattr(self.filter, 'notify') \
+					or not hasattr(self.filter, '_addDirWatch'):
+				raise unittest.SkipTest(
+					"%s does not watch directories" % (self.filter,))
+			dirname = tempfile.mkdtemp("fail2ban")
+			notified = []
+			self.filter.notify = notified.append
+			def waitNotified(delay=2.):
+				time0 = time.time()
+				while time.time() < time0 + delay and not notified:
+					time.sleep(0.1)
+				return notified and notified.pop() == dirname
+			try:
+				f = open(os.path.join(dirname, "a.log"), "a")
+				self.filter._addDirWatch(dirname)
+				# a new watch may be reported at once
+				waitNotified(0.4)
+				# a write to a file is no change of the directory
+				f.write("line\n")
+				f.flush()
+				self.assertFalse(waitNotified(0.4))
+				# but a new file is
+				open(os.path.join(dirname, "b.log"), "w").close()
+				self.assertTrue(waitNotified(4.))
+				self.filter._delDirWatch(dirname)
+				f.close()
+			finally:
+				for name in os.listdir(dirname):
+					os.unlink(os.path.join(dirname, name))
+				os.rmdir(dirname)
+
 		def testNewChangeViaGetFailures_simple(self):
 			# suck in lines from this sample log file
 			self.filter.getFailures(self.name)
@@ -307,6 +681,117 @@ class GetFailures(unittest.TestCase):
 		_assert_correct_last_attempt(self, self.filter, GetFailures.FAILURES_01)
 
 
+	def testGetFailuresShared(self):
+		regex = "(?:(?:Authentication failure|Failed [-/\w+]+) for(?: [iI](?:llegal|nvalid) user)?|[Ii](?:llegal|nvalid) user|ROOT LOGIN REFUSED) .*(?: from|FROM) <HOST>"
+		logHub = LogHub()
+		filters = [FileFilter(None), FileFilter(None), FileFilter(None)]
+		for filter_ in filters:
+			filter_.setActive(True)
+			filter_.setLogHub(logHub)
+			filter_.addLogPath(GetFailures.FILENAME_01)
+		filters[0].addFailRegex(regex)
+		filters[1].addFailRegex(regex)
+		filters[2].addFailRegex("failure for kevin from <HOST>")
+		filters[1].addIgnoreIP("193.168.0.128")
+		# One filter reads the file for all of them
+		self.assertTrue(filters[0].getFailures(GetFailures.FILENAME_01))
+		self.assertEqual(filters[0].failManager.getFailTotal(), 3)
+		self.assertEqual(filters[1].failManager.getFailTotal(), 0)
+		self.assertEqual(filters[2].failManager.getFailTotal(), 3)
+		self.assertTrue(filters[2].getFailures(GetFailures.FILENAME_01))
+		self.assertEqual(filters[2].failManager.getFailTotal(), 3)
+		_assert_correct_last_attempt(self, filters[0], GetFailures.FAILURES_01)
+		for filter_ in filters:
+			filter_.delLogPath(GetFailures.FILENAME_01)
+		self.assertEqual(logHub.getLogPaths(), [])
+
+	def testGetFailuresSharedIdle(self):
+		regex = "failure for kevin from <HOST>"
+		logHub = LogHub()
+		filters = [FileFilter(None), FileFilter(None), FileFilter(None)]
+		for filter_ in filters:
+			filter_.setActive(True)
+			filter_.setLogHub(logHub)
+			filter_.addLogPath(GetFailures.FILENAME_01)
+			filter_.addFailRegex(regex)
+		filters[1].setIdle(True)
+		filters[2].stop()
+		# The idle and stopped filters get no lines
+		self.assertTrue(filters[0].getFailures(GetFailures.FILENAME_01))
+		self.assertEqual(filters[0].failManager.getFailTotal(), 3)
+		self.assertEqual(filters[1].failManager.getFailTotal(), 0)
+		self.assertEqual(filters[2].failManager.getFailTotal(), 0)
+		for filter_ in filters:
+			filter_.delLogPath(GetFailures.FILENAME_01)
+
+	def testGetFailuresSharedResumed(self):
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		f = open(name, 'w')
+		try:
+			logHub = LogHub()
+			filters = [FileFilter(None), FileFilter(None)]
+			for filter_ in filters:
+				filter_.setActive(True)
+				filter_.setLogHub(logHub)
+				filter_.addLogPath(name)
+				filter_.addFailRegex("failure for kevin from <HOST>")
+			self.assertTrue(filters[0].getFailures(name))
+			filters[1].setIdle(True)
+			# Written while the second jail is idle
+			_copy_lines_between_files(GetFailures.FILENAME_01, f, n=14)
+			self.assertTrue(filters[0].getFailures(name))
+			self.assertEqual(filters[0].failManager.getFailTotal(), 2)
+			self.assertEqual(filters[1].failManager.getFailTotal(), 0)
+			# Catches up once resumed, with the lines written since then
+			filters[1].setIdle(False)
+			_copy_lines_between_files(GetFailures.FILENAME_01, f, skip=14)
+			self.assertTrue(filters[1].getFailures(name))
+			self.assertEqual(filters[0].failManager.getFailTotal(), 3)
+			self.assertEqual(filters[1].failManager.getFailTotal(), 3)
+			_assert_correct_last_attempt(self, filters[1],
+										 GetFailures.FAILURES_01)
+			for filter_ in filters:
+				filter_.delLogPath(name)
+		finally:
+			_killfile(f, name)
+
+	def testGetFailuresSharedAllIdle(self):
+		_, name = tempfile.mkstemp('fail2ban', 'logfile')
+		f = open(name, 'w')
+		blockSize = FileContainer.BLOCK_SIZE
+		try:
+			_copy_lines_between_files(GetFailures.FILENAME_01, f, n=3, skip=12)
+			# One line per batch
+			FileContainer.BLOCK_SIZE = 100
+			logHub = LogHub()
+			filters = [FileFilter(None), FileFilter(None)]
+			for filter_ in filters:
+				filter_.setActive(True)
+				filter_.setLogHub(logHub)
+				filter_.addLogPath(name)
+				filter_.addFailRegex("failure for kevin from <HOST>")
+			filters[1].setIdle(True)
+			# The reading jail is set idle after the first line
+			addFailures = filters[0].addFailures
+			def addFailuresIdle(failList, line):
+				addFailures(failList, line)
+				filters[0].setIdle(True)
+			filters[0].addFailures = addFailuresIdle
+			self.assertTrue(filters[0].getFailures(name))
+			self.assertEqual(filters[0].failManager.getFailTotal(), 1)
+			# The lines left unread are not kept as well
+			filters[0].addFailures = addFailures
+			for filter_ in filters:
+				filter_.setIdle(False)
+			self.assertTrue(filters[1].getFailures(name))
+			self.assertEqual(filters[0].failManager.getFailTotal(), 3)
+			self.assertEqual(filters[1].failManager.getFailTotal(), 3)
+			for filter_ in filters:
+				filter_.delLogPath(name)
+		finally:
+			FileContainer.BLOCK_SIZE = blockSize
+			_killfile(f, name)
+
 	def testGetFailures02(self):
 		output = ('141.3.81.106', 4, 1124013539.0,
 				  ['Aug 14 11:%d:59 i60p295 sshd[12365]: Failed publickey for roehl from ::ffff:141.3.81.106 port 51332 ssh2\n'
@@ -387,6 +872,87 @@ class GetFailures(unittest.TestCase):
 
 		self.assertRaises(FailManagerEmpty, self.filter.failManager.toBan)
 
+class CombinedRegex(unittest.TestCase):
+
+	LINE = "sshd[123]: bar 192.0.2.1 foo 192.0.2.2"
+
+	def testPrecedence(self):
+		regexSet = RegexSet([FailRegex("foo <HOST>"), FailRegex("bar <HOST>")])
+		self.assertTrue(regexSet.isCombined())
+		# "bar" is found first in the line, but "foo" has precedence
+		self.assertEqual(regexSet.search(self.LINE), 0)
+		self.assertEqual(regexSet[0].getHost(), "192.0.2.2")
+		self.assertEqual(regexSet.search(self.LINE, 1), 1)
+		self.assertEqual(regexSet[1].getHost(), "192.0.2.1")
+		self.assertEqual(regexSet.search("nothing to see here"), -1)
+
+	def testHostFromCombinedMatch(self):
+		regexSet = RegexSet([FailRegex("baz <HOST>"), FailRegex("(?P<x>b)ar <HOST>"),
+							 FailRegex("foo <HOST>")])
+		self.assertTrue(regexSet.isCombined())
+		self.assertEqual(regexSet.search(self.LINE), 1)
+		self.assertEqual(regexSet[1].getHost(), "192.0.2.1")
+
+	def testLiterals(self):
+		self.assertEqual(FailRegex("^Failed .* from <HOST>").getLiteral(), "Failed ")
+		self.assertEqual(FailRegex("(?:error: )?Auth(?:entication)? failure "
+								   "for .* from <HOST>").getLiteral(), " failure for ")
+		self.assertEqual(FailRegex("Invalid user \\S+ from <HOST>").getLiteral(), "Invalid user ")
+		self.assertEqual(FailRegex("(?i)failed .* from <HOST>").getLiteral(), "")
+		self.assertEqual(FailRegex("(?:a|b)+<HOST>").getLiteral(), "")
+
+	def testLiteralPrefilter(self):
+		regexSet = RegexSet([FailRegex("foo <HOST>"), FailRegex("[fb]ar <HOST>"),
+							 FailRegex("bar <HOST>")])
+		self.assertEqual(regexSet.search(self.LINE), 0)
+		self.assertEqual(regexSet.search(self.LINE, 1), 1)
+		self.assertEqual(regexSet.search(self.LINE, 2), 2)
+		self.assertEqual(regexSet[2].getHost(), "192.0.2.1")
+		self.assertEqual(regexSet.search("sshd[123]: far 192.0.2.3"), 1)
+		self.assertEqual(regexSet.search("sshd[123]: fo 192.0.2.3"), -1)
+
+	def testMayMatch(self):
+		regexSet = RegexSet([FailRegex("foo <HOST>"), FailRegex("bar <HOST>")])
+		self.assertTrue(regexSet.mayMatch(self.LINE))
+		self.assertFalse(regexSet.mayMatch("sshd[123]: fo 192.0.2.3"))
+		regexSet = RegexSet([FailRegex("foo <HOST>"), FailRegex("(?:a|b)+<HOST>")])
+		self.assertTrue(regexSet.mayMatch("sshd[123]: fo 192.0.2.3"))
+		self.assertFalse(RegexSet([]).mayMatch(self.LINE))
+
+	def testProcessBytes(self):
+		filter_ = FileFilter(None)
+		filter_.setByteLines(True)
+		filter_.addFailRegex("user \\S+ from <HOST>")
+		# Lines are matched without decoding, whatever their encoding
+		for user in "j\xc3\xbcrgen", "j\xfcrgen":
+			line = "Aug 14 11:59:59 sshd[123]: user %s from 192.0.2.1\n" % user
+			self.assertEqual(filter_.processLine(line),
+							 [["192.0.2.1", 1124013599.0]])
+		self.assertEqual(filter_.processLine(
+			"Aug 14 11:59:59 sshd[123]: session opened\n"), [])
+
+	def testProcessLocalizedMonth(self):
+		unixTime = time.mktime((2005, 2, 12, 10, 0, 0, 0, 0, -1))
+		for byteLines in False, True:
+			filter_ = FileFilter(None)
+			filter_.setByteLines(byteLines)
+			filter_.addFailRegex("user \\S+ from <HOST>")
+			# A non-ASCII month name, as written by a french syslog
+			line = "F\xc3\xa9v 12 10:00:00 sshd[123]: user x from 192.0.2.1\n"
+			self.assertEqual(filter_.processLine(line),
+							 [["192.0.2.1", unixTime]])
+			self.assertEqual(filter_.getLineTime(line), unixTime)
+
+	def testFallback(self):
+		regexSet = RegexSet([FailRegex(r"(b)\1 <HOST>"), FailRegex(r"(o)\1 <HOST>")])
+		self.assertFalse(regexSet.isCombined())
+		self.assertEqual(regexSet.search(self.LINE), 1)
+		self.assertEqual(regexSet[1].getHost(), "192.0.2.2")
+		regexSet = RegexSet([FailRegex("(?i)FOO <HOST>"), FailRegex("bar <HOST>")])
+		self.assertFalse(regexSet.isCombined())
+		self.assertEqual(regexSet.search(self.LINE), 0)
+
+
 class DNSUtilsTests(unittest.TestCase):
 
 	def testUseDns(self):
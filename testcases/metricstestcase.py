@@ -0,0 +1,63 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: t -*-
+# vi: set ft=python sts=4 ts=4 sw=4 noet :
+
+# This file is part of Fail2Ban.
+#
+# Fail2Ban is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Fail2Ban is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Fail2Ban; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Author: Cyril Jaquier
+# 
+# $Revision$
+
+__author__ = "Cyril Jaquier"
+__version__ = "$Revision$"
+__date__ = "$Date$"
+__copyright__ = "Copyright (c) 2004 Cyril Jaquier"
+__license__ = "GPL"
+
+import unittest, tempfile, os
+from server.metrics import Metrics
+
+class Exporters(unittest.TestCase):
+
+	def testFileExporter(self):
+		fd, path = tempfile.mkstemp("fail2ban")
+		os.close(fd)
+		try:
+			exporter = Metrics.createExporter("file:" + path)
+			self.assertEqual(str(exporter), "file:" + path)
+			exporter.export(1167606000, [("ssh", 5, "193.168.0.128", 13)])
+			exporter.export(1167606060, [("ssh", 0, None, 13)])
+			self.assertEqual(open(path).readlines(),
+							 ["1167606000 ssh 5 193.168.0.128 13\n",
+							  "1167606060 ssh 0 None 13\n"])
+		finally:
+			os.unlink(path)
+		self.assertRaises(ValueError, Metrics.createExporter, "foo:bar")
+
+	def testExportersOnce(self):
+		metrics = Metrics(None)
+		self.assertTrue(metrics.addExporter(
+			Metrics.createExporter("file:/tmp/a")))
+		self.assertTrue(metrics.addExporter(
+			Metrics.createExporter("file:/tmp/b")))
+		# Sent again on reload
+		self.assertFalse(metrics.addExporter(
+			Metrics.createExporter("file:/tmp/a")))
+		self.assertEqual(metrics.getExporters(), ["file:/tmp/a", "file:/tmp/b"])
+		# Removed from the configuration
+		self.assertTrue(metrics.delExporter("file:/tmp/a"))
+		self.assertFalse(metrics.delExporter("file:/tmp/a"))
+		self.assertEqual(metrics.getExporters(), ["file:/tmp/b"])